@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# :Project:   metapensiero.raccoon.service -- bind time benchmark
+# :Created:   mar 20 ott 2026 09:48:37 CEST
+# :Author:    Alberto Berti <alberto@metapensiero.it>
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2026 Alberto Berti
+#
+
+"""Compare sequential and concurrent registration when binding a service
+tree with 200 endpoints (20 children with 10 endpoints each) against the
+local router stand-in.
+
+Usage: python bench/bind.py [rtt in ms, default 1]
+"""
+
+import asyncio
+import sys
+import time
+
+from standin import LocalRouter
+
+from metapensiero.raccoon.node import WAMPNodeContext
+from metapensiero.raccoon.node.wamp import call
+from metapensiero.raccoon.service import WAMPNode, init_system
+
+CHILDREN = 20
+ENDPOINTS = 10
+
+
+def endpoint_class():
+    def make(i):
+        def endpoint(self, details):
+            return i
+        endpoint.__name__ = 'ep{}'.format(i)
+        return call(endpoint)
+    return type('Endpoints', (WAMPNode,),
+                {'ep{}'.format(i): make(i) for i in range(ENDPOINTS)})
+
+
+async def bind_tree(router, path, concurrent, loop):
+    session = router.session()
+    context = WAMPNodeContext(loop=loop, wamp_session=session)
+    cls = endpoint_class()
+    root = WAMPNode()
+    before = router.messages
+    start = time.perf_counter()
+    if concurrent:
+        batch = session.bulk_registrations(root.node_bind_concurrency)
+        batch_ctx = batch.bind_context(context)
+        async with batch:
+            await root.node_bind(path, batch_ctx)
+            for i in range(CHILDREN):
+                await root.node_add('child{}'.format(i), cls())
+        batch.release_context(batch_ctx)
+    else:
+        await root.node_bind(path, context)
+        for i in range(CHILDREN):
+            await root.node_add('child{}'.format(i), cls())
+    elapsed = time.perf_counter() - start
+    endpoints = sum(1 for p in router.procedures if p.startswith(path))
+    await root.node_unbind()
+    return elapsed, endpoints, router.messages - before
+
+
+def main():
+    rtt = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.001
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(init_system(loop=loop))
+    router = LocalRouter(rtt)
+    for concurrent in (False, True):
+        elapsed, endpoints, messages = loop.run_until_complete(
+            bind_tree(router, 'bench.bind', concurrent, loop))
+        print("{:>10}: {} endpoints, {} router messages, {:.3f}s".format(
+            'concurrent' if concurrent else 'sequential', endpoints,
+            messages, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# :Project:   metapensiero.raccoon.service -- compression benchmark
+# :Created:   mar 20 ott 2026 23:41:56 CEST
+# :Author:    Alberto Berti <alberto@metapensiero.it>
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2026 Alberto Berti
+#
+
+"""Measure the CPU time spent compressing and decompressing typical payloads
+with the zlib codec at various levels, against the bytes saved.
+
+The last column is the link speed below which the compression pays off,
+that is when sending the saved bytes takes longer than compressing and
+decompressing them.
+
+Usage: python bench/compression.py [iterations, default 200]
+"""
+
+import json
+import random
+import sys
+import timeit
+
+from metapensiero.raccoon.service import compression
+
+LEVELS = (1, 6, 9)
+
+
+def peer_start(locations):
+    return {'locations': {
+        'location{}'.format(i): {
+            'id': 0, 'location': 'location{}'.format(i), 'role': 'member',
+            'uri': 'raccoon.app.sessions.0001a2b3c4d.location{}'.format(i)}
+        for i in range(locations)}, 'details': {}}
+
+
+def document(rows):
+    rnd = random.Random(42)
+    return {'rows': [{'id': i, 'name': 'item {}'.format(i),
+                      'price': round(rnd.uniform(1, 1000), 2),
+                      'tags': rnd.sample(['red', 'green', 'blue', 'new',
+                                          'sale', 'bulk'], 3)}
+                     for i in range(rows)]}
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    payloads = [('peer_start 10', peer_start(10)),
+                ('peer_start 200', peer_start(200)),
+                ('document 1000', document(1000)),
+                ('document 20000', document(20000))]
+    print("{:>15} {:>5} {:>9} {:>9} {:>10} {:>10} {:>12}".format(
+        'payload', 'level', 'raw', 'packed', 'encode', 'decode',
+        'pays below'))
+    for name, value in payloads:
+        raw = len(json.dumps(value, separators=(',', ':')))
+        for level in LEVELS:
+            compressor = compression.Compressor(
+                compression.ZlibCodec(level), threshold=0)
+            encoded = compressor.encode(value)
+            packed = len(encoded['data']) if encoded is not value else raw
+            enc = timeit.timeit(lambda: compressor.encode(value),
+                                number=iterations) / iterations
+            dec = timeit.timeit(lambda: compression.decode(encoded),
+                                number=iterations) / iterations
+            saved = raw - packed
+            speed = saved / (enc + dec) / 2**20 if saved > 0 else 0
+            print("{:>15} {:>5} {:>9} {:>9} {:>8.3f}ms {:>8.3f}ms"
+                  " {:>7.1f} MB/s".format(name, level, raw, packed,
+                                          enc * 1e3, dec * 1e3, speed))
+
+
+if __name__ == '__main__':
+    main()
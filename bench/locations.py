@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# :Project:   metapensiero.raccoon.service -- node registration benchmark
+# :Created:   mar 20 ott 2026 15:41:27 CEST
+# :Author:    Alberto Berti <alberto@metapensiero.it>
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2026 Alberto Berti
+#
+
+"""Measure the time and the memory needed to bind many nodes, most of which
+are never watched, and the cost of the system locations alone.
+
+Usage: python bench/locations.py [nodes, default 100000]
+"""
+
+import asyncio
+import sys
+import time
+import tracemalloc
+
+from metapensiero.raccoon.node import NodeContext
+from metapensiero.raccoon.service import Node, init_system, system
+
+
+async def bind_nodes(count, loop):
+    root = Node()
+    await root.node_bind('bench.locations', NodeContext(loop=loop))
+    children = [Node() for _ in range(count)]
+    start = time.perf_counter()
+    for i, child in enumerate(children):
+        await root.node_add('n{}'.format(i), child)
+    elapsed = time.perf_counter() - start
+    return root, children, elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(init_system(loop=loop))
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    root, children, elapsed = loop.run_until_complete(bind_nodes(count, loop))
+    after = tracemalloc.take_snapshot()
+    total = sum(s.size_diff for s in after.compare_to(before, 'filename'))
+    system_file = system.__class__.__module__.replace('.', '/') + '.py'
+    located = sum(s.size_diff for s in after.compare_to(before, 'filename')
+                  if s.traceback[0].filename.endswith(system_file))
+    tracemalloc.stop()
+    print("{} nodes bound in {:.2f}s ({:.1f}us/node)".format(
+        count, elapsed, elapsed / count * 1e6))
+    print("memory: {:.1f} MB total, {:.1f} MB allocated by the system"
+          " module ({:.0f} bytes/node)".format(total / 2**20, located / 2**20,
+                                               located / count))
+
+    locations = [system.NODE_LOCATION[c] for c in children]
+    start = time.perf_counter()
+    for loc in locations:
+        loc.changed()
+    print("{} changed() on unwatched locations in {:.3f}s".format(
+        count, time.perf_counter() - start))
+
+    start = time.perf_counter()
+    loop.run_until_complete(root.node_unbind())
+    print("unbound in {:.2f}s".format(time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# :Project:   metapensiero.raccoon.service -- binary payloads benchmark
+# :Created:   mar 20 ott 2026 22:17:05 CEST
+# :Author:    Alberto Berti <alberto@metapensiero.it>
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2026 Alberto Berti
+#
+
+"""Send a 10 MB binary value in the details of a message, whole and in
+chunks of various sizes, through the local router stand-in, measuring the
+throughput and the peak of the memory allocated.
+
+Each publication is serialized and deserialized with the chosen autobahn
+serializer, to account for the copies done by the transport.
+
+Usage: python bench/payload.py [json|msgpack, default json]
+"""
+
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+from standin import LocalRouter
+
+from arstecnica.raccoon.autobahn.client import ClientSession
+from autobahn.wamp import serializer
+
+from metapensiero.raccoon.node import WAMPNodeContext
+from metapensiero.raccoon.service import WAMPNode, init_system
+from metapensiero.raccoon.service.message import Message, on_message
+
+SIZE = 10 * 1024 * 1024
+CHUNK_SIZES = (SIZE + 1, 1024 * 1024, 256 * 1024, 64 * 1024)
+
+
+def serialize_publications(ser):
+    publish = ClientSession.publish
+
+    def serialized_publish(self, topic, *args, **kwargs):
+        kwargs.pop('options', None)
+        payload = ser.serialize([list(args), kwargs])
+        args, kwargs = ser.unserialize(payload)[0]
+        return publish(self, topic, *args, **kwargs)
+
+    ClientSession.publish = serialized_publish
+
+
+class Receiver(WAMPNode):
+
+    received = None
+
+    @on_message('blob')
+    def on_blob(self, msg):
+        self.received.set_result(len(msg.details['data']))
+
+
+async def run(router, chunk_size, payload, loop):
+    receiver = Receiver()
+    await receiver.node_bind('bench.payload.receiver', WAMPNodeContext(
+        loop=loop, wamp_session=router.session()))
+    sender = WAMPNode()
+    await sender.node_bind('bench.payload.sender', WAMPNodeContext(
+        loop=loop, wamp_session=router.session()))
+    receiver.received = loop.create_future()
+    Message.chunk_size = chunk_size
+    tracemalloc.start()
+    start = time.perf_counter()
+    await Message(sender, 'blob', 'bench.payload.receiver',
+                  data=memoryview(payload)).send()
+    size = await receiver.received
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert size == SIZE
+    await sender.node_unbind()
+    await receiver.node_unbind()
+    return elapsed, peak
+
+
+def main():
+    name = sys.argv[1] if len(sys.argv) > 1 else 'json'
+    ser = {'json': serializer.JsonObjectSerializer,
+           'msgpack': serializer.MsgPackObjectSerializer}[name]()
+    serialize_publications(ser)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(init_system(loop=loop))
+    router = LocalRouter(0.001)
+    payload = os.urandom(SIZE)
+    for chunk_size in CHUNK_SIZES:
+        elapsed, peak = loop.run_until_complete(
+            run(router, chunk_size, payload, loop))
+        label = ('whole' if chunk_size > SIZE
+                 else '{} KB chunks'.format(chunk_size // 1024))
+        print("{:>14} ({}): {:.3f}s, {:.1f} MB/s, peak {:.1f} MB".format(
+            label, name, elapsed, SIZE / elapsed / 2**20, peak / 2**20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# :Project:   metapensiero.raccoon.service -- pipelined calls benchmark
+# :Created:   mar 20 ott 2026 20:34:12 CEST
+# :Author:    Alberto Berti <alberto@metapensiero.it>
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2026 Alberto Berti
+#
+
+"""Compare sequential awaits and a :class:`Pipeline` issuing 100
+independent remote calls against the local router stand-in.
+
+Usage: python bench/pipeline.py [rtt in ms, default 1]
+"""
+
+import asyncio
+import sys
+import time
+
+from standin import LocalRouter
+
+from metapensiero.raccoon.node import WAMPNodeContext
+from metapensiero.raccoon.node.wamp import call
+from metapensiero.raccoon.service import WAMPNode, init_system
+from metapensiero.raccoon.service.pipeline import Pipeline
+
+CALLS = 100
+
+
+class Server(WAMPNode):
+
+    @call
+    def square(self, value, details):
+        return value * value
+
+
+async def run(router, pipelined, loop):
+    server = Server()
+    await server.node_bind('bench.pipeline.server', WAMPNodeContext(
+        loop=loop, wamp_session=router.session()))
+    client = WAMPNode()
+    await client.node_bind('bench.pipeline.client', WAMPNodeContext(
+        loop=loop, wamp_session=router.session()))
+    proxy = client.remote('bench.pipeline.server')
+    start = time.perf_counter()
+    if pipelined:
+        async with Pipeline() as p:
+            for i in range(CALLS):
+                p.call(proxy.square, i)
+        results = await p.results()
+    else:
+        results = []
+        for i in range(CALLS):
+            results.append(await proxy.square(i))
+    elapsed = time.perf_counter() - start
+    assert results == [i * i for i in range(CALLS)]
+    await client.node_unbind()
+    await server.node_unbind()
+    return elapsed
+
+
+def main():
+    rtt = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.001
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(init_system(loop=loop))
+    router = LocalRouter(rtt)
+    for pipelined in (False, True):
+        elapsed = loop.run_until_complete(run(router, pipelined, loop))
+        print("{:>10}: {} calls, {:.3f}s, {:.0f} calls/s".format(
+            'pipelined' if pipelined else 'sequential', CALLS, elapsed,
+            CALLS / elapsed))
+
+
+if __name__ == '__main__':
+    main()
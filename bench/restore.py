@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# :Project:   metapensiero.raccoon.service -- session restore benchmark
+# :Created:   mar 20 ott 2026 13:22:09 CEST
+# :Author:    Alberto Berti <alberto@metapensiero.it>
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2026 Alberto Berti
+#
+
+"""Measure the time needed to restore the sessions of an ApplicationService
+from a snapshot store, against the local router stand-in.
+
+Usage: python bench/restore.py [sessions, default 50000] [sqlite|file]
+  [--prefix]
+
+With ``--prefix`` the sessions use prefix registration, so that each of them
+costs a single registration on the router.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from standin import LocalRouter
+
+from metapensiero.raccoon.node.wamp import call
+from metapensiero.raccoon.service import (ApplicationService, SessionMember,
+                                          SessionRoot, init_system)
+from metapensiero.raccoon.service.snapshot import (AppendOnlyFileStore,
+                                                   SQLiteStore)
+
+SERVICE_PATH = 'bench.restore'
+
+
+class Application(SessionMember):
+
+    def __init__(self, *maps, node_context=None):
+        super().__init__(*maps, node_context=node_context)
+        self.counter = 0
+
+    def session_state(self):
+        return {'counter': self.counter}
+
+    async def restore_session_state(self, state):
+        self.counter = state['counter']
+
+    @call
+    def inc_counter(self, details):
+        self.counter += 1
+        return self.counter
+
+
+class PrefixSessionRoot(SessionRoot):
+    node_prefix_registration = True
+
+
+def fill(store, count):
+    store.save_many(SERVICE_PATH, [{
+        'id': str(i),
+        'locations': ['client', 'server'],
+        'local_location_name': 'server',
+        'status': 'active',
+        'peers': {'client': {'uri': '{}.{}.client'.format(SERVICE_PATH, i),
+                             'role': None},
+                  'server': {'uri': '{}.{}.server'.format(SERVICE_PATH, i),
+                             'role': None}},
+        'user': {'user_id': i % 1000, 'login': 'user{}'.format(i % 1000),
+                 'full_name': 'User {}'.format(i % 1000), 'source': 'bench'},
+        'context': {},
+        'member': {'counter': i},
+    } for i in range(1, count + 1)])
+
+
+async def restore(store, prefix, loop):
+    router = LocalRouter(rtt=0.0005)
+    service = ApplicationService(Application, SERVICE_PATH, store=store)
+    if prefix:
+        service.SESSION_CLASS = PrefixSessionRoot
+    service._tmp_context.loop = loop
+    start = time.perf_counter()
+    snapshots = store.load(SERVICE_PATH)
+    loaded = time.perf_counter() - start
+    start = time.perf_counter()
+    await service._on_connection_connected(router.session(), None)
+    elapsed = time.perf_counter() - start
+    return len(snapshots), loaded, elapsed, len(service._sessions), router
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    prefix = '--prefix' in sys.argv
+    count = int(args[0]) if args else 50000
+    kind = args[1] if len(args) > 1 else 'sqlite'
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(init_system(loop=loop))
+    tmpdir = tempfile.mkdtemp()
+    if kind == 'sqlite':
+        store = SQLiteStore(os.path.join(tmpdir, 'sessions.db'))
+    else:
+        store = AppendOnlyFileStore(os.path.join(tmpdir, 'sessions.log'))
+    start = time.perf_counter()
+    fill(store, count)
+    print("{} snapshots written to the {} store in {:.2f}s".format(
+        count, kind, time.perf_counter() - start))
+    snapshots, loaded, elapsed, restored, router = loop.run_until_complete(
+        restore(store, prefix, loop))
+    print("{} snapshots loaded in {:.2f}s".format(snapshots, loaded))
+    print("{} sessions restored in {:.2f}s ({:.0f}/s), {} router"
+          " messages".format(restored, elapsed, restored / elapsed,
+                             router.messages))
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
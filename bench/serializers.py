@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# :Project:   metapensiero.raccoon.service -- serializers benchmark
+# :Created:   mar 20 ott 2026 22:58:33 CEST
+# :Author:    Alberto Berti <alberto@metapensiero.it>
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2026 Alberto Berti
+#
+
+"""Compare the size and the encoding and decoding cost of typical message
+publications with the available WAMP serializers: a ``peer_start`` carrying
+the location map of a session and a ``session_info``.
+
+Usage: python bench/serializers.py [iterations, default 10000]
+"""
+
+import sys
+import timeit
+
+from autobahn.wamp import message
+
+from metapensiero.raccoon.service.wamp.connection import (SERIALIZERS,
+                                                          make_serializers)
+
+SOURCE = {'uri': 'raccoon.app.sessions.0001a2b3c4d',
+          'type': 'SessionRoot',
+          'system': {'name': 'server', 'lang': 'Python'}}
+
+
+def peer_start(locations=8):
+    info = {}
+    for i in range(locations):
+        name = 'location{}'.format(i)
+        info[name] = {'id': 0, 'location': name, 'role': 'member',
+                      'uri': '{}.{}'.format(SOURCE['uri'], name)}
+    return {'msg_source': SOURCE, 'msg_type': 'peer_start',
+            'msg_dest': SOURCE['uri'] + '.server',
+            'msg_details': {'locations': info, 'details': {}}}
+
+
+def session_info():
+    return {'msg_source': SOURCE, 'msg_type': 'session_info',
+            'msg_dest': SOURCE['uri'], 'msg_details': {'status': 'active'}}
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    payloads = [('peer_start', peer_start()), ('session_info', session_info())]
+    for ser in make_serializers(sorted(SERIALIZERS)):
+        for name, kwargs in payloads:
+            msg = message.Publish(1, SOURCE['uri'], kwargs=kwargs)
+            data, binary = ser.serialize(msg)
+            enc = timeit.timeit(lambda: ser.serialize(
+                message.Publish(1, SOURCE['uri'], kwargs=kwargs)),
+                number=iterations)
+            dec = timeit.timeit(lambda: ser.unserialize(data, binary),
+                                number=iterations)
+            print("{:>8} {:>13}: {:5d} bytes, encode {:6.2f} us,"
+                  " decode {:6.2f} us".format(
+                      ser.SERIALIZER_ID, name, len(data),
+                      enc / iterations * 1e6, dec / iterations * 1e6))
+
+
+if __name__ == '__main__':
+    main()
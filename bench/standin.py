@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# :Project:   metapensiero.raccoon.service -- local router stand-in
+# :Created:   mar 20 ott 2026 09:14:02 CEST
+# :Author:    Alberto Berti <alberto@metapensiero.it>
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2026 Alberto Berti
+#
+
+"""A minimal in-process stand-in for a WAMP router, used by the benchmarks.
+
+It patches the router-facing methods of the autobahn session used by
+:class:`~metapensiero.raccoon.service.wamp.session.Session` so that every
+interaction costs a simulated round-trip time and calls are dispatched to the
+endpoints registered on any session of the same :class:`LocalRouter`.
+"""
+
+import asyncio
+import itertools
+
+from arstecnica.raccoon.autobahn.client import ClientSession
+from autobahn.wamp.request import Registration, Subscription
+from autobahn.wamp.types import CallDetails, ComponentConfig
+
+from metapensiero.raccoon.service.wamp.session import Session
+
+
+class LocalRouter:
+    """Keep the registrations of the stand-in sessions.
+
+    :param float rtt: the simulated round-trip time in seconds
+    """
+
+    def __init__(self, rtt=0.001):
+        self.rtt = rtt
+        self.procedures = {}
+        self.topics = {}
+        self._ids = itertools.count(1)
+        self.messages = 0
+
+    async def roundtrip(self):
+        self.messages += 1
+        await asyncio.sleep(self.rtt)
+
+    def session(self):
+        """Return a new :class:`Session` attached to this router."""
+        session = Session(ComponentConfig(realm='default', extra={}))
+        session._standin_router = self
+        return session
+
+
+async def _register(self, endpoint, procedure=None, options=None, **kwargs):
+    router = self._standin_router
+    await router.roundtrip()
+    if procedure in router.procedures:
+        raise RuntimeError("Procedure '{}' exists".format(procedure))
+    reg = Registration(self, next(router._ids), procedure, endpoint)
+    router.procedures[procedure] = (reg, options)
+    self._registrations[reg.id] = reg
+    return reg
+
+
+async def _unregister(self, registration):
+    router = self._standin_router
+    await router.roundtrip()
+    del router.procedures[registration.procedure]
+    del self._registrations[registration.id]
+    registration.active = False
+
+
+async def _subscribe(self, handler, topic=None, options=None, **kwargs):
+    router = self._standin_router
+    await router.roundtrip()
+    sub = Subscription(next(router._ids), topic, self, handler)
+    router.topics.setdefault(topic, []).append(sub)
+    self._subscriptions.setdefault(sub.id, []).append(sub)
+    return sub
+
+
+async def _unsubscribe(self, subscription):
+    router = self._standin_router
+    await router.roundtrip()
+    router.topics[subscription.topic].remove(subscription)
+    self._subscriptions[subscription.id].remove(subscription)
+    subscription.active = False
+
+
+async def _call(self, procedure, *args, **kwargs):
+    router = self._standin_router
+    await router.roundtrip()
+    kwargs.pop('options', None)
+    reg, options = router.procedures[procedure]
+    if options is not None and options.details_arg:
+        kwargs[options.details_arg] = CallDetails(reg.id, procedure=procedure)
+    result = reg.endpoint(*args, **kwargs)
+    if asyncio.iscoroutine(result) or isinstance(result, asyncio.Future):
+        result = await result
+    return result
+
+
+def _publish(self, topic, *args, **kwargs):
+    router = self._standin_router
+    kwargs.pop('options', None)
+    loop = asyncio.get_event_loop()
+    for sub in router.topics.get(topic, ()):
+        loop.call_later(router.rtt / 2, lambda h=sub.handler: h(*args,
+                                                                 **kwargs))
+
+
+def _is_attached(self):
+    return True
+
+
+ClientSession.register = _register
+ClientSession._unregister = _unregister
+ClientSession.subscribe = _subscribe
+ClientSession._unsubscribe = _unsubscribe
+ClientSession.call = _call
+ClientSession.publish = _publish
+ClientSession.is_attached = _is_attached
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# :Project:   metapensiero.raccoon.service -- when_node benchmark
+# :Created:   mar 20 ott 2026 16:48:03 CEST
+# :Author:    Alberto Berti <alberto@metapensiero.it>
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2026 Alberto Berti
+#
+
+"""Compare when_node() and when_nodes() watching a large set of nodes that
+become ready one at a time.
+
+Usage: python bench/when_nodes.py [nodes, default 1000]
+"""
+
+import asyncio
+import sys
+import time
+
+from metapensiero import reactive
+from metapensiero.raccoon.node import NodeContext
+from metapensiero.raccoon.service import (Node, init_system, when_node,
+                                          when_nodes)
+
+
+async def make_nodes(count, base, loop):
+    nodes = []
+    for i in range(count):
+        n = Node()
+        n.ready = False
+        await n.node_bind('bench.{}.n{}'.format(base, i),
+                          NodeContext(loop=loop))
+        nodes.append(n)
+    return nodes
+
+
+async def run(count, incremental, loop):
+    nodes = await make_nodes(count, 'inc' if incremental else 'full', loop)
+    evaluations = 0
+
+    def is_ready(node):
+        nonlocal evaluations
+        evaluations += 1
+        return node.ready
+
+    if incremental:
+        watch = when_nodes(is_ready, nodes)
+    else:
+        watch = when_node(lambda *nodes: all([is_ready(n) for n in nodes]),
+                          *nodes)
+    evaluations = 0
+    start = time.perf_counter()
+    for n in nodes:
+        n.ready = True
+        n.node_changed()
+        # let the flush happen
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    await watch
+    for n in nodes:
+        await n.node_unbind()
+    return elapsed, evaluations
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    loop = asyncio.get_event_loop()
+    reactive.get_tracker().flusher.loop = loop
+    loop.run_until_complete(init_system(loop=loop))
+    for incremental in (False, True):
+        elapsed, evaluations = loop.run_until_complete(
+            run(count, incremental, loop))
+        print("{:>10}: {} changes in {:.3f}s, {} predicate evaluations"
+              " ({:.1f} per change)".format(
+                  'when_nodes' if incremental else 'when_node', count,
+                  elapsed, evaluations, evaluations / count))
+
+
+if __name__ == '__main__':
+    main()
@@ -12,8 +12,9 @@ from metapensiero.reactive.flush.asyncio import AsyncioFlushManager
 reactive.set_flusher_factory(AsyncioFlushManager)
 
 from metapensiero.raccoon.node import NodeContext
-from .message import on_message, Message
-from .node import ContextNode, Node, WAMPNode, when_node
+from .message import on_message, Message, MessageError
+from .node import (ContextNode, Node, NodeSetWatcher, WAMPNode, when_node,
+                   when_nodes)
 from .pairable import PairableNode
 from .service import BaseService, ApplicationService
 from .session import SessionRoot, SessionMember, bootstrap_session
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# :Project:   metapensiero.raccoon.service -- read-through cache of remote calls
+# :Created:   mar 20 ott 2026 19:31:08 CEST
+# :Author:    Alberto Berti <alberto@metapensiero.it>
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2026 Alberto Berti
+#
+
+"""Client side cache of the results of idempotent remote calls.
+
+Only the methods listed as cacheable go through the cache, by default just
+``node_info``::
+
+  cache = CallCache(session, ttl=10, methods=('node_info', 'get_status'))
+  status = await cache.proxy(node.remote('@server')).get_status()
+
+An entry expires after `ttl` seconds and is dropped as soon as the remote
+node notifies a change, if it has ``node_export_changes`` set (see
+:mod:`.remote`). The first miss on a node waits for the subscription to its
+changes, and the results of the nodes whose changes cannot be watched are
+not cached. Concurrent misses on the same entry share a single call.
+The hits and misses are counted by the ``cache.hits`` and ``cache.misses``
+metrics.
+"""
+
+import asyncio
+from collections import OrderedDict
+import time
+
+from . import metrics, remote
+
+_hits = metrics.counter('cache.hits', 'Remote calls served by the cache')
+_misses = metrics.counter('cache.misses', 'Remote calls missing the cache')
+_invalidations = metrics.counter(
+    'cache.invalidations', 'Cache entries dropped on remote changes')
+
+
+class CallCache:
+    """A LRU cache of remote call results, bound to a WAMP `session`.
+
+    :param session: the WAMP session receiving the change events
+    :param float ttl: seconds after which an entry expires, ``None`` to keep
+      it until the remote node changes
+    :param methods: the names of the cacheable methods
+    :param int maxsize: maximum number of entries
+    """
+
+    def __init__(self, session, ttl=30.0, methods=('node_info',),
+                 maxsize=1024):
+        self.session = session
+        self.ttl = ttl
+        self.methods = frozenset(methods)
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._by_uri = {}
+        self._watched = set()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def proxy(self, proxy):
+        """Wrap `proxy` so that its cacheable methods use this cache."""
+        return CachedProxy(proxy, self)
+
+    async def call(self, proxy, method, *args, **kwargs):
+        """Return the result of calling `method` on the remote node reached
+        by `proxy`, from the cache if possible."""
+        uri = str(proxy.node_path)
+        try:
+            key = (uri, method, args, tuple(sorted(kwargs.items())))
+            hash(key)
+        except TypeError:
+            # unhashable arguments, not cacheable
+            key = None
+        if key is not None:
+            entry = self._entries.get(key)
+            if entry is not None:
+                fut, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    _hits.inc()
+                    return await asyncio.shield(fut)
+                self._drop(key)
+        self.misses += 1
+        _misses.inc()
+        if key is None or not await self._watch(uri):
+            return await getattr(proxy, method)(*args, **kwargs)
+        fut = asyncio.ensure_future(getattr(proxy, method)(*args, **kwargs))
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._entries[key] = (fut, expires)
+        self._by_uri.setdefault(uri, set()).add(key)
+        if len(self._entries) > self.maxsize:
+            self._drop(next(iter(self._entries)))
+        try:
+            return await asyncio.shield(fut)
+        except Exception:
+            # don't cache the errors
+            if self._entries.get(key, (None,))[0] is fut:
+                self._drop(key)
+            raise
+
+    def invalidate(self, uri=None):
+        """Drop the entries of the node at `uri` or all of them."""
+        if uri is None:
+            self._entries.clear()
+            self._by_uri.clear()
+        else:
+            for key in self._by_uri.pop(uri, ()):
+                self._entries.pop(key, None)
+
+    def close(self):
+        """Drop all the entries and stop listening to the changes."""
+        self.invalidate()
+        locations = remote.locations(self.session)
+        for uri in self._watched:
+            locations.remove_listener(uri, self._on_change)
+        self._watched.clear()
+
+    async def _watch(self, uri):
+        """Follow the changes of the node at `uri`. Return ``False`` if it's
+        not possible."""
+        locations = remote.locations(self.session)
+        if uri not in self._watched:
+            self._watched.add(uri)
+            locations.add_listener(uri, self._on_change)
+        try:
+            await asyncio.shield(locations.subscription(uri))
+        except Exception:
+            return False
+        return True
+
+    def _drop(self, key):
+        self._entries.pop(key, None)
+        keys = self._by_uri.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_uri[key[0]]
+
+    def _on_change(self, uri):
+        keys = self._by_uri.pop(uri, None)
+        if keys:
+            _invalidations.inc(len(keys))
+            for key in keys:
+                self._entries.pop(key, None)
+
+
+class CachedProxy:
+    """A wrapper around a proxy that serves the cacheable methods from a
+    :class:`CallCache`."""
+
+    def __init__(self, proxy, cache):
+        self._proxy = proxy
+        self._cache = cache
+
+    def __getattr__(self, name):
+        if name in self._cache.methods:
+            def cached_call(*args, **kwargs):
+                return self._cache.call(self._proxy, name, *args, **kwargs)
+            return cached_call
+        return getattr(self._proxy, name)
+
+    def __repr__(self):
+        return '<CachedProxy of {!r}>'.format(self._proxy)
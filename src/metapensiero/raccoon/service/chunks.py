@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# :Project:   metapensiero.raccoon.service -- binary message payloads
+# :Created:   mar 20 ott 2026 21:48:26 CEST
+# :Author:    Alberto Berti <alberto@metapensiero.it>
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2026 Alberto Berti
+#
+
+"""Transfer of big binary values in the details of a
+:class:`~.message.Message`.
+
+The details that are ``bytes``, ``bytearray`` or ``memoryview`` and are
+bigger than :attr:`Message.chunk_size <.message.Message.chunk_size>` are
+replaced by a reference and sent ahead of the message in pieces, each one a
+``message_chunk`` message. Every piece is sliced from the original buffer
+just when it's sent, so the sender doesn't copy the whole value. The pieces
+and the message are sent in order as a single unit of the
+:attr:`~.message.Message.flow_control`: they are queued, dropped or refused
+together and a failure stops the whole send.
+
+The receiver collects the pieces in a :class:`Reassembler` and puts the
+value back in the details, as a ``bytearray``, before calling the handler of
+the message. The pieces of a value that never completes are dropped after a
+timeout and the message is discarded, counting it in the
+``message.chunks.incomplete`` metric.
+"""
+
+import itertools
+import logging
+import os
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+CHUNK_TYPE = 'message_chunk'
+"""The type of the messages carrying the pieces of a value."""
+
+BINARY_TYPES = (bytes, bytearray, memoryview)
+
+_process_id = os.urandom(6).hex()
+_blob_ids = itertools.count(1)
+
+
+def split(details, chunk_size):
+    """Find the big binary values in `details`.
+
+    :returns: a tuple with the details to send, where the big values are
+      replaced by references, the list of their keys and a list of tuples
+      ``(blob_id, view, start, end)`` describing the pieces to send, or
+      ``None`` if there's nothing to split.
+    """
+    pieces = []
+    blobs = []
+    result = None
+    for key, value in details.items():
+        if not isinstance(value, BINARY_TYPES):
+            continue
+        if result is None:
+            result = dict(details)
+        view = memoryview(value).cast('B')
+        size = len(view)
+        if size <= chunk_size:
+            # serializers don't understand memoryview
+            if not isinstance(value, bytes):
+                result[key] = view.tobytes()
+            continue
+        blob_id = '{}.{}'.format(_process_id, next(_blob_ids))
+        count = 0
+        for start in range(0, size, chunk_size):
+            pieces.append((blob_id, view, start, start + chunk_size))
+            count += 1
+        result[key] = {'$blob': blob_id, 'size': size, 'chunks': count}
+        blobs.append(key)
+    if result is None:
+        return None
+    return result, blobs, pieces
+
+
+def piece(blob_id, view, start, end):
+    """Return the serialized content of a ``message_chunk`` message."""
+    index = start // (end - start)
+    return {'msg_type': CHUNK_TYPE,
+            'msg_chunk': {'id': blob_id, 'index': index,
+                          'data': view[start:end].tobytes()}}
+
+
+class Reassembler:
+    """Collect the pieces of the values received in chunks.
+
+    :param float timeout: seconds after which an incomplete value is dropped
+    """
+
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+        self._partial = {}
+        self._assembled = {}
+
+    def __len__(self):
+        return len(self._partial)
+
+    def add(self, chunk, loop):
+        """Store the piece `chunk`. The same piece can be received more than
+        once, one time for each handler of the receiving node.
+
+        :param loop: the loop of the receiving node
+        """
+        blob_id = chunk['id']
+        parts = self._partial.get(blob_id)
+        if parts is None:
+            if blob_id in self._assembled:
+                return
+            parts = self._partial[blob_id] = {}
+            loop.call_later(self.timeout, self._partial.pop, blob_id,
+                            None)
+        parts.setdefault(chunk['index'], chunk['data'])
+
+    def resolve(self, msg, loop):
+        """Replace the references in the details of `msg` with the
+        reassembled values. Return ``False`` if some are incomplete.
+
+        :param loop: the loop of the receiving node
+        """
+        details = dict(msg.details)
+        for key in msg.blobs:
+            ref = details[key]
+            blob_id = ref['$blob']
+            blob = self._assembled.get(blob_id)
+            if blob is None:
+                parts = self._partial.pop(blob_id, {})
+                if len(parts) != ref['chunks']:
+                    metrics.counter('message.chunks.incomplete').inc()
+                    logger.warning("Discarding %r, its '%s' value is"
+                                   " incomplete", msg, key)
+                    return False
+                blob = bytearray(ref['size'])
+                pos = 0
+                for i in range(ref['chunks']):
+                    data = parts.pop(i)
+                    blob[pos:pos + len(data)] = data
+                    pos += len(data)
+                # kept for the other handlers of the same message, that
+                # receive it in the same loop iteration
+                self._assembled[blob_id] = blob
+                loop.call_soon(self._assembled.pop, blob_id, None)
+            details[key] = blob
+        msg.details = details
+        return True
+
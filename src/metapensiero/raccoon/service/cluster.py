@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# :Project:   metapensiero.raccoon.service -- multi-worker support
+# :Created:   mar 20 ott 2026 10:32:18 CEST
+# :Author:    Alberto Berti <alberto@metapensiero.it>
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2026 Alberto Berti
+#
+
+"""Utilities to run the same :class:`~.service.ApplicationService` in
+several worker processes.
+
+Every worker has a short identifier, made of :data:`WORKER_ID_LENGTH` base36
+digits, which is used as the prefix of the ids of the sessions it creates,
+followed by :data:`SEPARATOR` and a base36 counter, e.g. ``wrk1_1a``.
+This way the ids are unique in the whole cluster without any coordination
+and the worker owning a session can be told from its id alone.
+
+When the owner isn't running anymore, or the id doesn't carry a worker
+prefix, the session is assigned to a worker by a :class:`HashRing` of the
+live workers, so that all of them agree on the destination and only a small
+fraction of the sessions move when workers are added or removed.
+"""
+
+from bisect import bisect
+import hashlib
+import random
+import string
+
+WORKER_ID_LENGTH = 4
+"""Number of characters of a worker id."""
+
+SEPARATOR = '_'
+"""The separator between the worker id and the counter of a session id. It's
+valid in the components of a strict WAMP URI."""
+
+DIGITS = string.digits + string.ascii_lowercase
+
+
+def to_base36(number):
+    """Return the compact textual representation of a non negative
+    `number`."""
+    if number < 0:
+        raise ValueError("Negative numbers are not supported")
+    res = []
+    while True:
+        number, rem = divmod(number, 36)
+        res.append(DIGITS[rem])
+        if not number:
+            break
+    return ''.join(reversed(res))
+
+
+def new_worker_id():
+    """Return a random worker id."""
+    return ''.join(random.choice(DIGITS) for _ in range(WORKER_ID_LENGTH))
+
+
+def _is_base36(text):
+    return len(text) > 0 and all(c in DIGITS for c in text)
+
+
+def check_worker_id(worker_id):
+    """Verify that `worker_id` is usable as the prefix of the session ids."""
+    if len(worker_id) != WORKER_ID_LENGTH or not _is_base36(worker_id):
+        raise ValueError("Invalid worker id {!r}, it must be made of {}"
+                         " lowercase letters or digits".format(
+                             worker_id, WORKER_ID_LENGTH))
+    return worker_id
+
+
+def _split_session_id(session_id):
+    worker_id, sep, counter = session_id.partition(SEPARATOR)
+    if (sep and len(worker_id) == WORKER_ID_LENGTH and
+        _is_base36(worker_id) and _is_base36(counter)):
+        return worker_id, counter
+    return None, None
+
+
+def worker_of(session_id):
+    """Return the id of the worker that created `session_id`, or ``None``
+    if it isn't a cluster-unique id."""
+    return _split_session_id(session_id)[0]
+
+
+class SessionIdGenerator:
+    """Generate session ids prefixed by `worker_id`.
+
+    :param str worker_id: the id of this worker, a random one is used if
+      not given
+    """
+
+    def __init__(self, worker_id=None):
+        self.worker_id = check_worker_id(worker_id or new_worker_id())
+        self._next = 1
+
+    def __call__(self):
+        res = self.worker_id + SEPARATOR + to_base36(self._next)
+        self._next += 1
+        return res
+
+    def advance(self, session_id):
+        """Ensure that the ids generated from now on follow `session_id`, if
+        it was generated by this worker."""
+        worker_id, counter = _split_session_id(session_id)
+        if worker_id == self.worker_id:
+            self._next = max(self._next, int(counter, 36) + 1)
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8],
+                          'big')
+
+
+class HashRing:
+    """A consistent hash ring of worker ids.
+
+    :param workers: the initial workers
+    :param int replicas: number of points of each worker on the ring
+    """
+
+    def __init__(self, workers=(), replicas=64):
+        self.replicas = replicas
+        self._points = []
+        self._owners = {}
+        self.workers = set()
+        for worker in workers:
+            self.add(worker)
+
+    def __contains__(self, worker):
+        return worker in self.workers
+
+    def __len__(self):
+        return len(self.workers)
+
+    def add(self, worker):
+        """Add `worker` to the ring."""
+        if worker in self.workers:
+            return
+        self.workers.add(worker)
+        for i in range(self.replicas):
+            point = _hash('{}-{}'.format(worker, i))
+            self._owners[point] = worker
+        self._points = sorted(self._owners)
+
+    def remove(self, worker):
+        """Remove `worker` from the ring."""
+        if worker not in self.workers:
+            return
+        self.workers.discard(worker)
+        for i in range(self.replicas):
+            self._owners.pop(_hash('{}-{}'.format(worker, i)), None)
+        self._points = sorted(self._owners)
+
+    def get(self, key):
+        """Return the worker responsible for `key`, or ``None`` if the ring is
+        empty."""
+        if not self._points:
+            return None
+        ix = bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[self._points[ix]]
+
+    def owner(self, session_id):
+        """Return the worker owning `session_id`: the one that created it if
+        still on the ring, otherwise the one chosen by the hash."""
+        worker = worker_of(session_id)
+        if worker is not None and worker in self.workers:
+            return worker
+        return self.get(session_id)
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+# :Project:   metapensiero.raccoon.service -- payload compression
+# :Created:   mar 20 ott 2026 23:12:47 CEST
+# :Author:    Alberto Berti <alberto@metapensiero.it>
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2026 Alberto Berti
+#
+
+"""Optional compression of the big message details and call results.
+
+It's enabled per connection, passing the name of a codec as the
+`compression` argument of :class:`~.wamp.connection.Connection`, and it's
+negotiated with the receiver of every payload, which must accept the codec.
+The payloads longer than the threshold once encoded as JSON are replaced by
+a mapping like ``{'$compressed': 'zlib', 'data': b'...'}``. Values that don't
+shrink are sent as they are.
+
+The decoding happens on every connection, for all the registered codecs,
+whose names are advertised in the ``codecs`` member of the system's
+``node_info``:
+
+- the details of a message are compressed only for the destinations that
+  advertised the codec in the source of a message received before, see
+  :func:`advertise`;
+
+- the result of a call is compressed only when the caller accepts the
+  codec, that a session with compression enabled tells passing the
+  :data:`ACCEPT_KWARG` keyword argument with the names of the codecs.
+
+The clients that don't know about it, like the browser ones, never receive
+compressed values.
+
+New codecs are added subclassing :class:`Codec` and registering an instance
+with :func:`register_codec`.
+"""
+
+import abc
+from collections import OrderedDict
+import inspect
+import json
+import zlib
+
+from . import metrics
+
+_raw = metrics.counter('compression.bytes.raw',
+                       'Bytes of the payloads before compression')
+_compressed = metrics.counter('compression.bytes.compressed',
+                              'Bytes of the payloads after compression')
+
+MARKER = '$compressed'
+
+ACCEPT_KWARG = 'raccoon_accept_codecs'
+"""The keyword argument of the calls carrying the codecs accepted by the
+caller, removed before calling the endpoint."""
+
+PEERS_SIZE = 4096
+"""Maximum number of destinations whose codecs are remembered."""
+
+_codecs = {}
+_peers = OrderedDict()
+
+
+class Codec(abc.ABC):
+    """The interface of a compression codec."""
+
+    name = None
+    """The name used to refer to the codec on the wire."""
+
+    @abc.abstractmethod
+    def compress(self, data):
+        """Return the compressed version of the bytes `data`."""
+
+    @abc.abstractmethod
+    def decompress(self, data):
+        """Return the original bytes of the compressed `data`."""
+
+
+class ZlibCodec(Codec):
+    """The :mod:`zlib` codec.
+
+    :param int level: the compression level, from 1 to 9
+    """
+
+    name = 'zlib'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+def register_codec(codec):
+    """Make `codec` available for encoding and decoding."""
+    _codecs[codec.name] = codec
+
+
+def get_codec(name):
+    try:
+        return _codecs[name]
+    except KeyError:
+        raise ValueError("Unknown codec {!r}".format(name))
+
+
+def codec_names():
+    """Return the names of the registered codecs."""
+    return sorted(_codecs)
+
+
+register_codec(ZlibCodec())
+
+
+def advertise(uri, codecs):
+    """Remember that the node at `uri` accepts the `codecs`."""
+    _peers[uri] = frozenset(codecs)
+    _peers.move_to_end(uri)
+    if len(_peers) > PEERS_SIZE:
+        _peers.popitem(last=False)
+
+
+def accepts(uri, codec):
+    """Tell if the node at `uri` advertised the `codec`."""
+    return codec in _peers.get(uri, ())
+
+
+def advertise_source(source):
+    """Remember the codecs advertised in the `source` of a received
+    message, that's the ``node_info`` of the sending node."""
+    if isinstance(source, dict):
+        system = source.get('system')
+        if isinstance(system, dict) and 'codecs' in system:
+            advertise(source.get('uri'), system['codecs'])
+
+
+def estimate_size(value, limit):
+    """Return a rough estimate of the length of `value` encoded as JSON.
+    The walk stops as soon as the estimate reaches `limit`, so the cost is
+    bounded for big values too."""
+    size = 0
+    stack = [value]
+    while stack and size < limit:
+        value = stack.pop()
+        if isinstance(value, str):
+            size += len(value) + 2
+        elif isinstance(value, dict):
+            size += 2
+            for key, item in value.items():
+                size += len(key) + 4 if isinstance(key, str) else 8
+                stack.append(item)
+                if size >= limit:
+                    break
+        elif isinstance(value, (list, tuple)):
+            size += len(value) + 2
+            stack.extend(value)
+        else:
+            size += 8
+    return size
+
+
+class Compressor:
+    """Compress the values longer than `threshold` bytes once encoded.
+
+    :param codec: a :class:`Codec` or the name of a registered one
+    :param int threshold: the minimum size in bytes of the compressed values
+    """
+
+    def __init__(self, codec='zlib', threshold=4096):
+        self.codec = get_codec(codec) if isinstance(codec, str) else codec
+        self.threshold = threshold
+
+    def encode(self, value):
+        """Return `value` compressed or as it is, when it's short, it doesn't
+        shrink or it cannot be encoded as JSON."""
+        if estimate_size(value, self.threshold) < self.threshold:
+            # short, don't pay for the encoding
+            return value
+        try:
+            data = json.dumps(value, separators=(',', ':')).encode('utf-8')
+        except (TypeError, ValueError):
+            return value
+        if len(data) < self.threshold:
+            return value
+        packed = self.codec.compress(data)
+        if len(packed) >= len(data):
+            return value
+        _raw.inc(len(data))
+        _compressed.inc(len(packed))
+        return {MARKER: self.codec.name, 'data': packed}
+
+    def encode_for(self, accepted, value):
+        """Return `value` encoded if the receiver `accepted` the codec,
+        otherwise as it is."""
+        if accepted and self.codec.name in accepted:
+            return self.encode(value)
+        return value
+
+
+def wrap(endpoint, compressor=None):
+    """Wrap `endpoint` so that it doesn't receive the :data:`ACCEPT_KWARG`
+    argument and its results are compressed with `compressor`, if given and
+    accepted by the caller."""
+    if getattr(endpoint, '_accepting_codecs', False):
+        return endpoint
+
+    def accepting_endpoint(*args, **kwargs):
+        accepted = kwargs.pop(ACCEPT_KWARG, None)
+        result = endpoint(*args, **kwargs)
+        if compressor is None or not accepted:
+            return result
+        if inspect.isawaitable(result):
+            return _encode_later(compressor, accepted, result)
+        return compressor.encode_for(accepted, result)
+
+    accepting_endpoint._accepting_codecs = True
+    return accepting_endpoint
+
+
+async def _encode_later(compressor, accepted, awaitable):
+    return compressor.encode_for(accepted, await awaitable)
+
+
+def decode(value):
+    """Return `value` decompressed, if it's compressed with a registered
+    codec."""
+    if (isinstance(value, dict) and len(value) == 2 and
+        isinstance(value.get(MARKER), str) and value[MARKER] in _codecs and
+        isinstance(value.get('data'), (bytes, bytearray))):
+        data = _codecs[value[MARKER]].decompress(bytes(value['data']))
+        return json.loads(data.decode('utf-8'))
+    return value
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# :Project:   metapensiero.raccoon.service -- delta streaming of node changes
+# :Created:   mar 20 ott 2026 17:35:26 CEST
+# :Author:    Alberto Berti <alberto@metapensiero.it>
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2026 Alberto Berti
+#
+
+"""Keep remote replicas of the mapping of a node in sync without polling.
+
+A :class:`StreamedNode` publishes the changes to its keys on the
+``<node path>.delta`` topic, coalesced per loop iteration, as events with
+the keyword arguments:
+
+``seq``
+  a sequence number, incremented by one on every event;
+
+``set``
+  a mapping of the keys set to their new value;
+
+``deleted``
+  a list of the deleted keys.
+
+The current state with its sequence number is returned by the
+``delta_snapshot`` endpoint. A :class:`Replica` subscribes to the topic,
+loads the snapshot and applies the following events in order, loading the
+snapshot again when it detects a gap. Child nodes are represented by
+``{'$node': <uri>}``.
+
+To avoid useless traffic, a node starts publishing only after its snapshot
+has been requested for the first time.
+"""
+
+import asyncio
+import logging
+
+from metapensiero.reactive import get_tracker
+from metapensiero.raccoon.node import call
+
+from . import metrics
+from .node import ReactiveServiceNode, WAMPNode
+from .system import flush_loop
+
+logger = logging.getLogger(__name__)
+
+_DELETED = object()
+
+
+class StreamedNode(WAMPNode):
+    """A node whose mapping can be replicated remotely."""
+
+    _delta_seq = 0
+    _delta_streaming = False
+    _delta_pending = None
+
+    @property
+    def delta_topic(self):
+        return str(self.node_path) + '.delta'
+
+    def delta_serialize(self, key, value):
+        """Return the representation of `value` sent to the replicas."""
+        if isinstance(value, ReactiveServiceNode):
+            return {'$node': str(value.node_path)}
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._delta_record(key, value)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._delta_record(key, _DELETED)
+
+    def _delta_record(self, key, value):
+        if not self._delta_streaming or not self.node_path:
+            return
+        if self._delta_pending is None:
+            self._delta_pending = {}
+            flush_loop().call_soon(self._delta_flush)
+        self._delta_pending[key] = value
+
+    def _delta_flush(self):
+        pending, self._delta_pending = self._delta_pending, None
+        if not pending or not self.node_path:
+            return
+        changed = {}
+        deleted = []
+        for key, value in pending.items():
+            if value is _DELETED:
+                deleted.append(key)
+            else:
+                changed[key] = self.delta_serialize(key, value)
+        self._delta_seq += 1
+        self.node_context.wamp_session.publish(
+            self.delta_topic, seq=self._delta_seq, set=changed,
+            deleted=deleted)
+        metrics.counter('delta.published').inc()
+
+    @call
+    def delta_snapshot(self, details=None):
+        """Return the current state of the mapping and its sequence
+        number."""
+        self._delta_streaming = True
+        return {
+            'seq': self._delta_seq,
+            'items': {k: self.delta_serialize(k, v) for k, v in self.items()},
+        }
+
+
+class Replica:
+    """A local copy of the mapping of a remote :class:`StreamedNode`.
+
+    :param session: the WAMP session
+    :param str uri: the path of the remote node
+    :param on_change: an optional callable receiving the mapping of the keys
+      set and the list of the deleted ones after each update
+    """
+
+    def __init__(self, session, uri, on_change=None):
+        self.session = session
+        self.uri = str(uri)
+        self.on_change = on_change
+        self.data = {}
+        self.seq = None
+        self._buffer = []
+        self._subscription = None
+        self._syncing = None
+        self._dependency = get_tracker().dependency(self)
+
+    async def start(self):
+        """Subscribe to the changes and load the initial snapshot."""
+        self._subscription = await self.session.subscribe(
+            self._on_delta, self.uri + '.delta')
+        await self.resync()
+
+    async def stop(self):
+        if self._subscription is not None:
+            sub, self._subscription = self._subscription, None
+            await sub.unsubscribe()
+
+    async def resync(self):
+        """Load the snapshot again and apply the buffered events."""
+        self.seq = None
+        snapshot = await self.session.call(self.uri + '.delta_snapshot')
+        self.data = dict(snapshot['items'])
+        self.seq = snapshot['seq']
+        buffered, self._buffer = self._buffer, []
+        self._notify(self.data, [])
+        for event in sorted(buffered, key=lambda e: e['seq']):
+            self._apply(event, resync=False)
+
+    def depend(self):
+        """Make the current computation depend on this replica."""
+        self._dependency.depend()
+
+    def _on_delta(self, seq, set, deleted):
+        event = {'seq': seq, 'set': set, 'deleted': deleted}
+        if self.seq is None:
+            self._buffer.append(event)
+        else:
+            self._apply(event)
+
+    def _apply(self, event, resync=True):
+        seq = event['seq']
+        if seq <= self.seq:
+            return
+        if seq != self.seq + 1:
+            metrics.counter('delta.gaps').inc()
+            logger.warning("Gap in the changes of %r, expected %d got %d",
+                           self.uri, self.seq + 1, seq)
+            if resync and (self._syncing is None or self._syncing.done()):
+                self._syncing = asyncio.ensure_future(self.resync())
+            return
+        self.seq = seq
+        self.data.update(event['set'])
+        for key in event['deleted']:
+            self.data.pop(key, None)
+        self._notify(event['set'], event['deleted'])
+
+    def _notify(self, changed, deleted):
+        self._dependency.changed()
+        if self.on_change is not None:
+            self.on_change(changed, deleted)
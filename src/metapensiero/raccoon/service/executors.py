@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# :Project:   metapensiero.raccoon.service -- executor offloading
+# :Created:   lun 19 ott 2026 14:05:31 CEST
+# :Author:    Alberto Berti <alberto@metapensiero.it>
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2026 Alberto Berti
+#
+
+"""Run CPU-heavy handlers in a pool of threads or processes, so that they
+don't block the event loop shared by all the sessions of a worker.
+
+Pools are referred to by name. The ``thread`` and ``process`` pools are
+created on first use with default settings, others can be installed with
+:func:`register_pool`. For each pool two metrics are maintained:
+``executor.<name>.pending``, the number of submitted calls not yet completed,
+and ``executor.<name>.submitted``.
+
+Handlers running in a process pool must be picklable, which means they must be
+declared as ``staticmethod`` inside a module-level class (or be module-level
+functions) and take only picklable arguments.
+"""
+
+import asyncio
+from concurrent.futures import (Executor, ProcessPoolExecutor,
+                                ThreadPoolExecutor)
+from functools import partial, wraps
+import importlib
+
+from . import metrics
+
+
+class ExecutorError(Exception):
+    """Error raised for unknown or misconfigured pools."""
+
+
+_pools = {}
+
+_default_factories = {
+    'thread': ThreadPoolExecutor,
+    'process': ProcessPoolExecutor,
+}
+
+
+def register_pool(name, executor):
+    """Install an `executor` with the given `name`.
+
+    :param str name: the name of the pool
+    :param executor: a :class:`concurrent.futures.Executor` instance
+    """
+    if not isinstance(executor, Executor):
+        raise ExecutorError("Wrong executor type, got {!r}".format(executor))
+    if name in _pools:
+        raise ExecutorError("A pool named '{}' exists already".format(name))
+    _pools[name] = executor
+
+
+def get_pool(name):
+    """Return the executor registered with `name`, creating the default
+    ``thread`` and ``process`` ones if needed."""
+    pool = _pools.get(name)
+    if pool is None:
+        if name not in _default_factories:
+            raise ExecutorError("Unknown pool '{}'".format(name))
+        pool = _pools[name] = _default_factories[name]()
+    return pool
+
+
+def shutdown_pools(wait=True):
+    """Shutdown and forget all the pools."""
+    for pool in _pools.values():
+        pool.shutdown(wait=wait)
+    _pools.clear()
+
+
+def _call_target(module, qualname, *args, **kwargs):
+    """Executed in the worker process: find the original function by
+    reference and call it."""
+    obj = importlib.import_module(module)
+    for name in qualname.split('.'):
+        obj = getattr(obj, name)
+    # look for the wrappers added by offload_handler(), the decorators of the
+    # offloaded function itself are preserved
+    wrapper = obj
+    while (not hasattr(wrapper, '_offload_target') and
+           hasattr(wrapper, '__wrapped__')):
+        wrapper = wrapper.__wrapped__
+    target = getattr(wrapper, '_offload_target', obj)
+    return target(*args, **kwargs)
+
+
+def run_in_pool(pool, loop, func, *args, **kwargs):
+    """Execute ``func(*args, **kwargs)`` in the pool named `pool` and return
+    a future, bound to `loop`, with its outcome."""
+    executor = get_pool(pool)
+    if isinstance(executor, ProcessPoolExecutor):
+        call = partial(_call_target, func.__module__, func.__qualname__,
+                       *args, **kwargs)
+    else:
+        call = partial(func, *args, **kwargs)
+    pending = metrics.gauge('executor.{}.pending'.format(pool))
+    metrics.counter('executor.{}.submitted'.format(pool)).inc()
+    pending.inc()
+    fut = loop.run_in_executor(executor, call)
+    fut.add_done_callback(lambda f: pending.dec())
+    return fut
+
+
+def _unwrap_static(func):
+    if isinstance(func, staticmethod):
+        return func.__func__, True
+    return func, False
+
+
+def offload_handler(func, pool):
+    """Return a function with signature ``(node, *args, **kwargs)`` that
+    executes `func` in `pool`. `func` may be a ``staticmethod``, in which case
+    the node isn't passed to it."""
+    target, static = _unwrap_static(func)
+    assert not asyncio.iscoroutinefunction(target), \
+        "Coroutines cannot be offloaded"
+
+    @wraps(target)
+    def offloaded(node, *args, **kwargs):
+        if not static:
+            args = (node,) + args
+        return run_in_pool(pool, node.node_context.loop, target, *args,
+                           **kwargs)
+
+    offloaded._offload_target = target
+    return offloaded
+
+
+def offload(pool='thread'):
+    """Decorator to execute the body of a method in `pool`. It's meant to be
+    used with :func:`~metapensiero.raccoon.node.call` endpoints::
+
+      class Cruncher(WAMPNode):
+
+          @call
+          @offload('process')
+          @staticmethod
+          def crunch(data):
+              ...
+
+    The decorated method becomes a coroutine.
+    """
+    def decorator(func):
+        offloaded = offload_handler(func, pool)
+
+        @wraps(offloaded)
+        async def wrapper(self, *args, **kwargs):
+            return await offloaded(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+# :Project:   metapensiero.raccoon.service -- flow control and priority lanes
+# :Created:   lun 19 ott 2026 15:20:44 CEST
+# :Author:    Alberto Berti <alberto@metapensiero.it>
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2026 Alberto Berti
+#
+
+"""Per-destination send windows and priority lanes for
+:class:`~.message.Message`.
+
+Each destination can have at most `window` sends *in flight*. A send is in
+flight until the awaitable returned by the transport completes or, when the
+transport returns nothing to wait on, until the next iteration of the loop.
+When the window is full further sends are queued and the overflow policy
+decides what happens when the queue itself is full:
+
+``block``
+  the send is queued anyway until `max_queue` is reached, then
+  :class:`FlowControlError` is raised. Callers awaiting the future returned by
+  :meth:`FlowController.submit` are suspended until their message is sent;
+
+``drop-oldest``
+  the oldest queued message is discarded, its future resolves to ``None``;
+
+``error``
+  :class:`FlowControlError` is raised as soon as the window is full.
+
+Every message travels in a *lane*: the ``infra`` lane carries the messages of
+the pairing protocol and the session status, the ``app`` lane everything
+else. Queued ``infra`` sends are always dequeued first and are never dropped,
+and on the receiving side the :class:`Dispatcher` runs ``infra`` handlers as
+soon as they arrive while ``app`` handlers are executed a batch at a time.
+The time spent waiting in each lane is recorded in the
+``lane.<name>.send_wait`` and ``lane.<name>.dispatch_wait`` histograms.
+"""
+
+from collections import deque
+import inspect
+import logging
+import time
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+BLOCK = 'block'
+DROP_OLDEST = 'drop-oldest'
+ERROR = 'error'
+
+POLICIES = (BLOCK, DROP_OLDEST, ERROR)
+
+INFRA = 'infra'
+APP = 'app'
+
+LANES = (INFRA, APP)
+"""Lane names in priority order."""
+
+
+class FlowControlError(Exception):
+    """Raised when a message cannot be accepted for sending."""
+
+
+class SendWindow:
+    """The state of a single destination."""
+
+    def __init__(self, dest):
+        self.dest = dest
+        self.in_flight = 0
+        self.queues = {lane: deque() for lane in LANES}
+
+    def __len__(self):
+        return sum(len(q) for q in self.queues.values())
+
+    @property
+    def idle(self):
+        return self.in_flight == 0 and not len(self)
+
+    def popleft(self):
+        """Return the first queued item of the most important lane."""
+        for lane in LANES:
+            q = self.queues[lane]
+            if q:
+                return lane, q.popleft()
+
+
+class FlowController:
+    """Keep a :class:`SendWindow` for every destination.
+
+    :param int window: maximum number of in flight sends per destination
+    :param int max_queue: maximum number of queued sends per destination
+    :param str policy: one of ``block``, ``drop-oldest`` or ``error``
+    """
+
+    def __init__(self, window=256, max_queue=4096, policy=BLOCK):
+        if policy not in POLICIES:
+            raise ValueError("Unknown overflow policy {!r}".format(policy))
+        self.window = window
+        self.max_queue = max_queue
+        self.policy = policy
+        self._windows = {}
+        self.queued = metrics.gauge('flow.queued',
+                                    'Messages waiting for a send window')
+        self.in_flight = metrics.gauge('flow.in_flight')
+        self.dropped = metrics.counter('flow.dropped')
+        self.rejected = metrics.counter('flow.rejected')
+        self.send_wait = {lane: metrics.histogram(
+            'lane.{}.send_wait'.format(lane)) for lane in LANES}
+
+    def queue_depth(self, dest):
+        """Return the number of messages queued for `dest`."""
+        w = self._windows.get(dest)
+        return len(w) if w is not None else 0
+
+    def submit(self, dest, send, loop, lane=APP):
+        """Send to `dest` when the window allows it.
+
+        :param str dest: the destination
+        :param send: a callable without arguments that performs the send
+        :param loop: the asyncio loop
+        :param str lane: the lane of the message
+        :returns: a future resolved with the result of `send`
+        """
+        w = self._windows.get(dest)
+        if w is None:
+            w = self._windows[dest] = SendWindow(dest)
+        fut = loop.create_future()
+        if w.in_flight < self.window:
+            self.send_wait[lane].observe(0.0)
+            self._send(w, send, fut, loop)
+        else:
+            self._enqueue(w, lane, (send, fut, time.monotonic()))
+        return fut
+
+    def _enqueue(self, w, lane, item):
+        full = len(w) >= self.max_queue
+        if lane == INFRA:
+            # infrastructure messages are never refused nor dropped
+            pass
+        elif self.policy == ERROR or (self.policy == BLOCK and full):
+            self.rejected.inc()
+            raise FlowControlError("Send window to '{}' is full".format(
+                w.dest))
+        elif self.policy == DROP_OLDEST and full and w.queues[APP]:
+            dropped = w.queues[APP].popleft()[1]
+            self.queued.dec()
+            self.dropped.inc()
+            logger.debug("Dropped a message to '%s'", w.dest)
+            if not dropped.done():
+                dropped.set_result(None)
+        w.queues[lane].append(item)
+        self.queued.inc()
+
+    def _send(self, w, send, fut, loop):
+        w.in_flight += 1
+        self.in_flight.inc()
+        try:
+            result = send()
+        except Exception as e:
+            fut.set_exception(e)
+            loop.call_soon(self._release, w, loop)
+            return
+        if inspect.isawaitable(result):
+            inner = loop.create_task(_await(result))
+            inner.add_done_callback(lambda f: self._done(w, f, fut, loop))
+        else:
+            fut.set_result(result)
+            loop.call_soon(self._release, w, loop)
+
+    def _done(self, w, inner, fut, loop):
+        _chain(inner, fut)
+        self._release(w, loop)
+
+    def _release(self, w, loop):
+        w.in_flight -= 1
+        self.in_flight.dec()
+        while len(w) and w.in_flight < self.window:
+            lane, (send, fut, queued_at) = w.popleft()
+            self.queued.dec()
+            if fut.cancelled():
+                continue
+            self.send_wait[lane].observe(time.monotonic() - queued_at)
+            self._send(w, send, fut, loop)
+        if w.idle:
+            del self._windows[w.dest]
+
+
+async def _await(awaitable):
+    return await awaitable
+
+
+class Dispatcher:
+    """Execute the handlers of received messages giving precedence to the
+    ``infra`` lane.
+
+    ``infra`` handlers run immediately, ``app`` ones are queued and executed
+    at most `batch` per loop iteration, so that infrastructure messages
+    arriving during a burst of application traffic don't wait behind it.
+
+    A *barrier* ``infra`` message, like ``peer_stop``, doesn't overtake the
+    ``app`` ones received before it by the same node: their queued handlers
+    are started first.
+
+    The failures of the ``app`` handlers are logged.
+
+    :param int batch: maximum number of ``app`` handlers started per loop
+      iteration
+    """
+
+    def __init__(self, batch=32):
+        self.batch = batch
+        self._queue = deque()
+        self._scheduled = False
+        self.dispatch_wait = {lane: metrics.histogram(
+            'lane.{}.dispatch_wait'.format(lane)) for lane in LANES}
+        self.queued = metrics.gauge('lane.app.queued')
+
+    def dispatch(self, lane, call, loop, key=None, barrier=False):
+        """Execute `call`, a callable without arguments, according to its
+        `lane`.
+
+        :param key: the receiver of the message
+        :param bool barrier: if ``True``, start the queued ``app`` handlers
+          with the same `key` before `call`
+        :returns: the result of `call` for the ``infra`` lane or a future
+          resolved with it for the ``app`` lane
+        """
+        if lane == INFRA:
+            if barrier and self._queue:
+                self.flush(key, loop)
+            self.dispatch_wait[lane].observe(0.0)
+            return call()
+        fut = loop.create_future()
+        fut.add_done_callback(_log_failure)
+        self._queue.append((call, fut, time.monotonic(), key))
+        self.queued.inc()
+        if not self._scheduled:
+            self._scheduled = True
+            loop.call_soon(self._drain, loop)
+        return fut
+
+    def flush(self, key, loop):
+        """Start now, in order, the queued ``app`` handlers with `key`."""
+        keep = deque()
+        while self._queue:
+            item = self._queue.popleft()
+            if item[3] is key:
+                self._run(item, loop)
+            else:
+                keep.append(item)
+        self._queue = keep
+
+    def _drain(self, loop):
+        self._scheduled = False
+        for _ in range(min(self.batch, len(self._queue))):
+            self._run(self._queue.popleft(), loop)
+        if self._queue:
+            self._scheduled = True
+            loop.call_soon(self._drain, loop)
+
+    def _run(self, item, loop):
+        call, fut, queued_at, key = item
+        self.queued.dec()
+        if fut.cancelled():
+            return
+        self.dispatch_wait[APP].observe(time.monotonic() - queued_at)
+        try:
+            result = call()
+        except Exception as e:
+            fut.set_exception(e)
+            return
+        if inspect.isawaitable(result):
+            inner = loop.create_task(_await(result))
+            inner.add_done_callback(lambda f, fut=fut: _chain(f, fut))
+        else:
+            fut.set_result(result)
+
+
+def _log_failure(fut):
+    if not fut.cancelled() and fut.exception() is not None:
+        logger.error("Error in a message handler", exc_info=fut.exception())
+
+
+def _chain(source, dest):
+    if dest.done():
+        return
+    if source.cancelled():
+        dest.cancel()
+    elif source.exception() is not None:
+        dest.set_exception(source.exception())
+    else:
+        dest.set_result(source.result())
@@ -6,12 +6,76 @@
 # :Copyright: © 2016, 2017, 2018 Alberto Berti
 #
 
-from functools import wraps
+import asyncio
+from functools import partial, wraps
+import inspect
+import itertools
+import logging
 
 from metapensiero.signal import handler
 from metapensiero.raccoon.node import Node, Path
 from metapensiero.raccoon.node.proxy import Proxy
 from .node import ServiceNode
+from . import (chunks, compression, executors, flow, metrics, monitor,
+               tracing)
+
+logger = logging.getLogger(__name__)
+
+
+INFRASTRUCTURE_TYPES = frozenset(('pairing_request', 'peer_ready',
+                                  'peer_resume', 'peer_start', 'peer_stop',
+                                  'session_info', 'session_stop'))
+"""Message types sent and dispatched in the ``infra`` lane, ahead of the
+others. See :mod:`.flow`."""
+
+BARRIER_TYPES = frozenset(('peer_stop', 'session_stop'))
+"""Infrastructure message types that don't overtake the application messages
+received before them by the same node."""
+
+
+class MessageError(Exception):
+    """Error raised by a request when the peer replies with an error or the
+    table of the pending requests is full."""
+
+
+class PendingReplies:
+    """The table of the requests waiting for a reply, keyed by correlation
+    id.
+
+    :param int maxsize: the maximum number of pending requests
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._futures = {}
+        self._ids = itertools.count(1)
+
+    def __len__(self):
+        return len(self._futures)
+
+    def add(self, loop):
+        """Return a new correlation id and the future of its reply."""
+        if len(self._futures) >= self.maxsize:
+            raise MessageError("Too many pending requests")
+        cid = next(self._ids)
+        fut = self._futures[cid] = loop.create_future()
+        return cid, fut
+
+    def discard(self, cid):
+        self._futures.pop(cid, None)
+
+    def resolve(self, msg):
+        """Complete the request answered by the reply `msg`. Return ``False``
+        if it's unknown, usually because it has timed out."""
+        fut = self._futures.pop(msg.correlation, None)
+        if fut is None or fut.done():
+            metrics.counter('message.replies.late').inc()
+            return False
+        if msg.error is not None:
+            fut.set_exception(MessageError(msg.error))
+        else:
+            fut.set_result(msg)
+        return True
 
 
 class Message:
@@ -25,12 +89,50 @@ class Message:
       :class:`~metapensiero.raccoon.node.path.Path`
     :param dest: the destination of the message
     :param kwargs: message details
+
+    When tracing is enabled (see :mod:`.tracing`) the message also carries a
+    `trace` context, used by the receiver to correlate its handling with the
+    send.
+
+    A message sent with :meth:`request` carries also a `correlation` id and
+    the uri of the node waiting for the answer in `reply_to`. The receiver
+    answers with :meth:`reply`.
+
+    The details can be binary values, the ones bigger than
+    :attr:`chunk_size` are sent in pieces and listed in `blobs`, see
+    :mod:`.chunks`. When the WAMP session of the source has a compressor,
+    the big details are sent compressed to the destinations that accept it,
+    see :mod:`.compression`.
     """
 
     source = None
     type = None
     dest = None
     misc = None
+    trace = None
+    correlation = None
+    reply_to = None
+    error = None
+    blobs = None
+
+    flow_control = flow.FlowController()
+    """The :class:`~.flow.FlowController` that limits the sends to each
+    destination. It can be replaced on a subclass or set to ``None`` to
+    disable flow control."""
+
+    dispatcher = flow.Dispatcher()
+    """The :class:`~.flow.Dispatcher` that executes the handlers of received
+    messages according to their lane."""
+
+    pending = PendingReplies()
+    """The :class:`PendingReplies` of the requests sent by this process."""
+
+    chunk_size = 256 * 1024
+    """The size of the pieces of the binary details bigger than this."""
+
+    reassembler = chunks.Reassembler()
+    """The :class:`~.chunks.Reassembler` of the binary details received by
+    this process."""
 
     def __init__(self, source, type_=None, dest=None, **kwargs):
         assert isinstance(source, ServiceNode), (
@@ -62,6 +164,11 @@ class Message:
                          else self.source),
                     det=self.details))
 
+    @property
+    def lane(self):
+        """The lane in which this message travels."""
+        return flow.INFRA if self.type in INFRASTRUCTURE_TYPES else flow.APP
+
     def _resolve_destination(self, dest):
         if isinstance(dest, (Node, Proxy)):
             dest = str(dest.node_path)
@@ -81,7 +188,12 @@ class Message:
         new = cls.__new__(cls)
         misc = {}
         for k, v in kwargs.items():
-            if k.startswith('msg_'):
+            if k == 'msg_details':
+                new.__dict__['details'] = compression.decode(v)
+            elif k == 'msg_source':
+                compression.advertise_source(v)
+                new.__dict__['source'] = v
+            elif k.startswith('msg_'):
                 new.__dict__[k[4:]] = v
             else:
                 misc[k] = v
@@ -90,24 +202,163 @@ class Message:
         return new
 
     def send(self, dest=None, **kwargs):
-        data = self(dest=dest, **kwargs)
-        return self._source.remote(self.dest).notify(**data)
+        """Send the message to `dest` or to the destination given at creation
+        time.
+
+        :returns: a future resolved when the message is handed over to the
+          transport. Awaiting it applies the backpressure of the
+          :attr:`flow_control`.
+        """
+        if dest:
+            self.dest = self._resolve_destination(dest)
+        return tracing.trace_send(self, lambda: self._submit(**kwargs))
+
+    def post(self, dest=None, **kwargs):
+        """Send the message like :meth:`send`, for the callers that don't
+        wait for it. A failure of the delivery is logged instead of being
+        lost with the returned future."""
+        fut = self.send(dest, **kwargs)
+        fut.add_done_callback(partial(_log_send_failure, self))
+        return fut
+
+    async def request(self, dest=None, timeout=30, **kwargs):
+        """Send the message like :meth:`send` and wait for the reply.
+
+        The reply is routed back to the source node, that must handle the
+        ``reply`` messages, like :class:`~.pairable.PairableNode` does.
+
+        :param float timeout: seconds to wait for the reply
+        :returns: the reply :class:`Message`
+        :raises asyncio.TimeoutError: if no reply arrives in time
+        :raises MessageError: if the peer replies with an error or the source
+          cannot receive the reply
+        """
+        from .pairable import PairableNode
+        if not isinstance(self._source, PairableNode):
+            raise MessageError("The source of {!r} cannot receive the reply,"
+                               " it isn't a PairableNode".format(self))
+        loop = self._source.node_context.loop
+        cid, fut = self.pending.add(loop)
+        self.correlation = cid
+        self.reply_to = str(self._source.node_path)
+        try:
+            await self.send(dest, **kwargs)
+            return await asyncio.wait_for(fut, timeout)
+        finally:
+            self.pending.discard(cid)
+
+    def reply(self, source, error=None, **kwargs):
+        """Answer this request with a message sent by the `source` node,
+        carrying `kwargs` as details or the given `error`."""
+        if self.reply_to is None:
+            raise MessageError("{!r} is not a request".format(self))
+        msg = Message(source, 'reply', Path(self.reply_to), **kwargs)
+        msg.correlation = self.correlation
+        if error is not None:
+            msg.error = str(error)
+        return msg.send()
+
+    def _submit(self, **kwargs):
+        data = self(**kwargs)
+        notify = self._source.remote(self.dest).notify
+        loop = self._source.node_context.loop
+        compressor = getattr(self._source.node_context.get('wamp_session'),
+                             'compression', None)
+        split = chunks.split(self.details, self.chunk_size)
+        if split is None:
+            if (compressor is not None and
+                compression.accepts(self.dest, compressor.codec.name)):
+                data['msg_details'] = compressor.encode(self.details)
+            return self._submit_one(partial(notify, **data), loop)
+        details, blobs, pieces = split
+        data['msg_details'] = details
+        if blobs:
+            data['msg_blobs'] = blobs
+        # the pieces and the message take a single place in the send window,
+        # so that they are queued, dropped or refused together
+        return self._submit_one(partial(_notify_chunked, notify, pieces, data),
+                                loop)
 
+    def _submit_one(self, notify, loop):
+        if self.flow_control is None:
+            result = notify()
+            if inspect.isawaitable(result):
+                return asyncio.ensure_future(result, loop=loop)
+            fut = loop.create_future()
+            fut.set_result(result)
+            return fut
+        return self.flow_control.submit(self.dest, notify, loop,
+                                        lane=self.lane)
 
-def on_message(type_, signal='.', **kwargs):
+
+def _log_send_failure(msg, fut):
+    if not fut.cancelled() and fut.exception() is not None:
+        logger.error("Error sending %r", msg, exc_info=fut.exception())
+
+
+async def _notify_chunked(notify, pieces, data):
+    # the pieces are sent in order, each one sliced only when it's really
+    # sent, and the first failure stops the whole send
+    for piece in pieces:
+        result = notify(**chunks.piece(*piece))
+        if inspect.isawaitable(result):
+            await result
+    result = notify(**data)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+def _dispatch(node, func, msg):
+    if msg.trace is not None:
+        return tracing.trace_handler(msg, node, func)
+    return func(node, msg)
+
+
+def on_message(type_, signal='.', executor=None, lane=None, **kwargs):
     """Decorator for an handler method, to hook only to a particular `type_`
     of message coming from a `signal`. The wrapped method will receive an
     instance of :class:`Message` as the only argument, carrying all the
     interesting details of the signal.
+
+    If the name of a pool is passed as `executor`, the handler will be
+    executed there instead of in the event loop, see :mod:`.executors`. In
+    that case the handler cannot be a coroutine, and can be a
+    ``staticmethod``, receiving just the message.
+
+    The handler is executed by the :attr:`Message.dispatcher` in the lane
+    given by `lane` or, by default, in the ``infra`` lane if `type_` is one of
+    the :data:`INFRASTRUCTURE_TYPES`, in the ``app`` lane otherwise.
     """
+    if lane is None:
+        lane = flow.INFRA if type_ in INFRASTRUCTURE_TYPES else flow.APP
+    barrier = type_ in BARRIER_TYPES
+
     def wrap_func(func):
 
+        if executor is not None:
+            func = executors.offload_handler(func, executor)
+
         @wraps(func)
         def wrapper(self, *args, **kwargs):
             msg_type = kwargs.get('msg_type')
-            if msg_type == type_:
+            if msg_type == chunks.CHUNK_TYPE:
+                Message.reassembler.add(kwargs['msg_chunk'],
+                                        self.node_context.loop)
+            elif msg_type == type_:
                 msg = Message.read(**kwargs)
-                return func(self, msg)
+                if (msg.blobs is not None and
+                    not Message.reassembler.resolve(
+                        msg, self.node_context.loop)):
+                    return
+                if monitor.is_active():
+                    call = partial(monitor.track, msg_type, _dispatch, self,
+                                   func, msg)
+                else:
+                    call = partial(_dispatch, self, func, msg)
+                return Message.dispatcher.dispatch(
+                    lane, call, self.node_context.loop, key=self,
+                    barrier=barrier)
 
         return handler(signal, **kwargs)(wrapper)
 
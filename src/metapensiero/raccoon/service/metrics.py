@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# :Project:   metapensiero.raccoon.service -- in-process metrics
+# :Created:   lun 19 ott 2026 11:02:48 CEST
+# :Author:    Alberto Berti <alberto@metapensiero.it>
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2026 Alberto Berti
+#
+
+"""A minimal registry of in-process metrics.
+
+Metrics are identified by a dotted name and are created on first access, so
+that every component can simply ask for the one it needs::
+
+  from . import metrics
+
+  metrics.counter('message.sent').inc()
+
+The values can be collected at any time with :func:`snapshot`.
+"""
+
+from collections import deque
+import threading
+
+
+class Counter:
+    """A monotonically increasing value."""
+
+    def __init__(self, name, description=''):
+        self.name = name
+        self.description = description
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def serialize(self):
+        return self.value
+
+
+class Gauge:
+    """A value that can go up and down."""
+
+    def __init__(self, name, description=''):
+        self.name = name
+        self.description = description
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def serialize(self):
+        return self.value
+
+
+class Histogram:
+    """Summary of observed values. Besides count, sum, min and max it keeps a
+    window of the last `window` samples to compute percentiles.
+    """
+
+    def __init__(self, name, description='', window=1024):
+        self.name = name
+        self.description = description
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.samples = deque(maxlen=window)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.samples.append(value)
+
+    def percentile(self, p):
+        """Return the `p` percentile (0-100) of the recent samples."""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        ix = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[ix]
+
+    def serialize(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+        }
+
+
+class Registry:
+    """A collection of named metrics."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, factory, name, description):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = self._metrics[name] = factory(name, description)
+        assert isinstance(metric, factory), (
+            "Metric '{name}' is a {type}".format(
+                name=name, type=type(metric).__name__))
+        return metric
+
+    def counter(self, name, description=''):
+        return self._get(Counter, name, description)
+
+    def gauge(self, name, description=''):
+        return self._get(Gauge, name, description)
+
+    def histogram(self, name, description=''):
+        return self._get(Histogram, name, description)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+
+    def snapshot(self, prefix=None):
+        """Return a mapping of the metric names to their current values,
+        optionally restricted to those starting with `prefix`."""
+        return {name: m.serialize() for name, m in list(self._metrics.items())
+                if prefix is None or name.startswith(prefix)}
+
+
+registry = Registry()
+
+counter = registry.counter
+gauge = registry.gauge
+histogram = registry.histogram
+get = registry.get
+snapshot = registry.snapshot
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# :Project:   metapensiero.raccoon.service -- event loop monitoring
+# :Created:   lun 19 ott 2026 11:35:20 CEST
+# :Author:    Alberto Berti <alberto@metapensiero.it>
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2026 Alberto Berti
+#
+
+import asyncio
+import inspect
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_handling = {}
+"""Map of task -> type of the message being handled by it."""
+
+_active_monitors = 0
+
+
+def _current_task(loop=None):
+    try:
+        if hasattr(asyncio, 'current_task'):
+            return asyncio.current_task(loop)
+        return asyncio.Task.current_task(loop)
+    except RuntimeError:
+        # no running loop
+        return None
+
+
+def is_active():
+    """Return ``True`` if at least one :class:`LoopMonitor` is running."""
+    return _active_monitors > 0
+
+
+def track(msg_type, func, *args):
+    """Call `func` with `args`, recording that the current task is handling a
+    message of type `msg_type`, so that it can be reported in case of a
+    stall. If `func` returns an awaitable, the tracking lasts until it
+    completes.
+    """
+    task = _current_task()
+    previous = _handling.get(task)
+    _handling[task] = msg_type
+    try:
+        result = func(*args)
+    finally:
+        _restore(task, previous)
+    if inspect.isawaitable(result):
+        return _track_awaitable(msg_type, result)
+    return result
+
+
+async def _track_awaitable(msg_type, awaitable):
+    task = _current_task()
+    previous = _handling.get(task)
+    _handling[task] = msg_type
+    try:
+        return await awaitable
+    finally:
+        _restore(task, previous)
+
+
+def _restore(task, previous):
+    if previous is None:
+        _handling.pop(task, None)
+    else:
+        _handling[task] = previous
+
+
+class LoopMonitor:
+    """Measure the scheduling delay of an asyncio loop and report stalls.
+
+    A callback is scheduled every `interval` seconds and the difference
+    between when it was due and when it actually ran is recorded in the
+    ``loop.lag`` histogram metric. A watchdog thread checks that the callback
+    keeps running: when it doesn't for more than `stall_threshold` seconds the
+    stack of the loop thread, the running task and the type of the message
+    it's handling (if any) are logged and passed to the optional `on_stall`
+    callable.
+
+    :param loop: the loop to monitor
+    :param float interval: the sampling interval in seconds
+    :param float stall_threshold: the time in seconds after which the loop is
+      considered stalled
+    :param on_stall: an optional callable receiving a dictionary with the
+      stall report. It's called from the watchdog thread
+    """
+
+    def __init__(self, loop, interval=0.25, stall_threshold=1.0,
+                 on_stall=None):
+        self.loop = loop
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.on_stall = on_stall
+        self.lag = metrics.histogram('loop.lag',
+                                     'Scheduling delay of the event loop')
+        self.current_lag = metrics.gauge('loop.lag.current')
+        self.stalls = metrics.counter('loop.stalls')
+        self._handle = None
+        self._expected = None
+        self._heartbeat = None
+        self._loop_thread = None
+        self._watchdog = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._handle is not None
+
+    def start(self):
+        """Start sampling. It's safe to call this before the loop runs."""
+        global _active_monitors
+        if self.running:
+            return
+        _active_monitors += 1
+        self._stop.clear()
+        self._heartbeat = time.monotonic()
+        self._expected = self.loop.time() + self.interval
+        self._handle = self.loop.call_later(self.interval, self._sample)
+        if self.stall_threshold:
+            self._watchdog = threading.Thread(
+                target=self._watch, name='raccoon-loop-watchdog', daemon=True)
+            self._watchdog.start()
+
+    def stop(self):
+        global _active_monitors
+        if not self.running:
+            return
+        _active_monitors -= 1
+        self._handle.cancel()
+        self._handle = None
+        self._stop.set()
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+
+    def _sample(self):
+        now = self.loop.time()
+        lag = max(0.0, now - self._expected)
+        self.lag.observe(lag)
+        self.current_lag.set(lag)
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._expected = now + self.interval
+        self._handle = self.loop.call_later(self.interval, self._sample)
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.interval):
+            heartbeat = self._heartbeat
+            if (time.monotonic() - heartbeat > self.stall_threshold and
+                reported != heartbeat and self.loop.is_running()):
+                reported = heartbeat
+                self._report(time.monotonic() - heartbeat)
+
+    def report(self):
+        """Return a description of what the loop is doing right now."""
+        frame = sys._current_frames().get(self._loop_thread)
+        task = _current_task(self.loop) if self.loop.is_running() else None
+        return {
+            'stack': ''.join(traceback.format_stack(frame)) if frame else None,
+            'task': repr(task) if task is not None else None,
+            'message_type': _handling.get(task),
+        }
+
+    def _report(self, duration):
+        self.stalls.inc()
+        report = self.report()
+        report['duration'] = duration
+        logger.warning("Event loop stalled for %.3f seconds while handling"
+                       " message type %r in task %s:\n%s", duration,
+                       report['message_type'], report['task'],
+                       report['stack'])
+        if self.on_stall is not None:
+            try:
+                self.on_stall(report)
+            except Exception:
+                logger.exception("Error in stall callback")
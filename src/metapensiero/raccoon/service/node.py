@@ -6,12 +6,21 @@
 # :Copyright: © 2016, 2017, 2018 Alberto Berti
 #
 
+from functools import partial
+import logging
+
+from metapensiero import reactive
 from metapensiero.reactive import get_tracker, ReactiveDict
 from metapensiero.signal import Signal, SignalAndHandlerInitMeta
 from metapensiero.raccoon.node import call
+from metapensiero.raccoon.node.proxy import Proxy
 from metapensiero.raccoon.node.wamp import WAMPInitMeta
 from metapensiero.raccoon import node
 
+from . import remote
+
+logger = logging.getLogger(__name__)
+
 
 class ServiceNode(metaclass=SignalAndHandlerInitMeta):
     """Base node for all the service stuff."""
@@ -19,10 +28,15 @@ class ServiceNode(metaclass=SignalAndHandlerInitMeta):
     node_location = None
     """The location record."""
 
+    node_export_changes = False
+    """Flag to publish the changes of this node to the other processes, so
+    that they can depend on it through a proxy, see :mod:`.remote`."""
+
     on_node_primary_signal = Signal()
     """Signal used to receive *infrastructure* messages. The messages that
-    implement the pairing protocol are of type 'pairing_request', 'peer_ready'
-    and 'peer_start'.
+    implement the pairing protocol are of type 'pairing_request', 'peer_ready',
+    'peer_start' and 'peer_stop'. They are sent and dispatched ahead of
+    application messages, see :mod:`.flow`.
     """
 
     on_node_primary_signal.name = '.'
@@ -50,6 +64,37 @@ class ServiceNode(metaclass=SignalAndHandlerInitMeta):
         await super().node_add(name, value)
         self.__setitem__(name, value)
 
+    node_bind_concurrency = 16
+    """Maximum number of registrations in flight in
+    :meth:`node_bind_concurrent`."""
+
+    async def node_bind_concurrent(self, path, context=None, parent=None):
+        """Bind this node like ``node_bind()`` does, but issue the
+        registrations of the whole subtree concurrently, at most
+        :attr:`node_bind_concurrency` at a time. If any of them fails, the
+        others are rolled back, the node is unbound and
+        :class:`~.wamp.session.RegistrationError` is raised.
+        """
+        ctx = context if context is not None else parent.node_context
+        session = ctx.get('wamp_session')
+        if session is None or not hasattr(session, 'bulk_registrations'):
+            return await self.node_bind(path, context, parent)
+        batch = session.bulk_registrations(self.node_bind_concurrency)
+        batch_ctx = batch.bind_context(ctx)
+        try:
+            async with batch:
+                await self.node_bind(path, batch_ctx, parent)
+        except Exception:
+            if self.node_path:
+                try:
+                    await self.node_unbind()
+                except Exception:
+                    logger.exception("Error while unbinding '%s' after a"
+                                     " failed bind", path)
+            raise
+        finally:
+            batch.release_context(batch_ctx)
+
     def node_changed(self):
         self.node_location.changed()
 
@@ -132,27 +177,215 @@ class WAMPNode(ReactiveServiceNode, node.WAMPNode, metaclass=WAMPInitMeta):
 
 
 class ContextNode(WAMPNode):
-    "A node which becomes its own context at bind time."
+    """A node which becomes its own context at bind time.
+
+    When `node_prefix_registration` is ``True`` the node registers a single
+    prefix procedure on the router at its path and all the endpoints of its
+    subtree are dispatched locally by the
+    :class:`~.wamp.session.Session`, rather than being registered one by
+    one.
+    """
+
+    node_prefix_registration = False
+    """Flag to enable the prefix registration of the subtree."""
+
+    _node_route = None
 
     async def _node_bind(self, path, context=None, parent=None):
+        if self.node_prefix_registration:
+            await self._node_add_route(path, context, parent)
         await super()._node_bind(path, context, parent)
         self.node_context.context = self
 
     async def _node_unbind(self):
         del self.node_context.context
         await super()._node_unbind()
+        if self._node_route is not None:
+            session, path = self._node_route
+            del self._node_route
+            await session.remove_route(path)
+
+    async def _node_add_route(self, path, context, parent):
+        ctx = context if context is not None else parent.node_context
+        session = ctx.get('wamp_session')
+        if session is None or not hasattr(session, 'add_route'):
+            logger.warning("Cannot use prefix registration at '%s', the"
+                           " WAMP session doesn't support it", path)
+            return
+        path = str(path)
+        await session.add_route(path)
+        self._node_route = (session, path)
+
+
+def _node_depend(n):
+    if isinstance(n, Proxy):
+        remote.depend(n)
+    else:
+        n.node_depend()
+
+
+def _node_release(n):
+    if isinstance(n, Proxy):
+        remote.release(n)
 
 
 def when_node(condition, *nodes):
     """
     Return a computation that will evaluate a `condition` on one or more
     `nodes` and that will be automatically re-executed when one of the nodes
-    is marked as changed.
+    is marked as changed. The nodes can also be proxies to remote nodes that
+    export their changes.
     """
 
     def eval_condition(computation):
         for n in nodes:
-            n.node_depend()
+            _node_depend(n)
         return condition(*nodes)
 
     return get_tracker().async_reactive(eval_condition, initial_value=False)
+
+
+class NodeSetWatcher:
+    """Evaluate a `predicate` on each node of a set separately, keeping
+    the count of the nodes that satisfy it.
+
+    Every node has its own computation, that depends only on that node, so a
+    change costs a single evaluation of `predicate` regardless of the size of
+    the set. The aggregates :meth:`count`, :meth:`all` and :meth:`any` are
+    reactive and change only when the result on some node changes.
+
+    A node is dropped from the set when it's unbound.
+
+    :param predicate: a callable receiving a node and returning a boolean
+    :param nodes: the initial nodes
+    :param on_change: an optional callable receiving a node and the new
+      result of `predicate` on it, each time it changes
+    """
+
+    def __init__(self, predicate, nodes=(), on_change=None):
+        self.predicate = predicate
+        self.on_change = on_change
+        self.evaluations = 0
+        """Number of evaluations of the predicate."""
+        self._results = {}
+        self._computations = {}
+        self._true = 0
+        self._count = reactive.Value(initial_value=0)
+        self._total = reactive.Value(initial_value=0)
+        for n in nodes:
+            self.add(n)
+
+    def __len__(self):
+        return len(self._results)
+
+    def __contains__(self, node):
+        return node in self._results
+
+    def add(self, node):
+        """Start watching `node`."""
+        if node in self._results:
+            return
+        self._results[node] = False
+        self._total.value = len(self._results)
+        self._computations[node] = get_tracker().reactive(
+            partial(self._evaluate, node), with_parent=False)
+
+    def remove(self, node):
+        """Stop watching `node`."""
+        comp = self._computations.pop(node, None)
+        if comp is not None:
+            comp.stop()
+        self._drop(node)
+        _node_release(node)
+
+    def _drop(self, node):
+        if node in self._results:
+            if self._results.pop(node):
+                self._true -= 1
+                self._count.value = self._true
+            self._total.value = len(self._results)
+
+    def stop(self):
+        """Stop watching all the nodes."""
+        computations = list(self._computations.items())
+        self._computations.clear()
+        for node, comp in computations:
+            comp.stop()
+            _node_release(node)
+        self._results.clear()
+        self._true = 0
+        self._count.value = 0
+        self._total.value = 0
+
+    def _evaluate(self, node, computation):
+        if not node.node_path:
+            # unbound
+            self._computations.pop(node, None)
+            self._drop(node)
+            computation.stop()
+            return
+        _node_depend(node)
+        self.evaluations += 1
+        result = bool(self.predicate(node))
+        if node not in self._results or self._results[node] == result:
+            return
+        self._results[node] = result
+        self._true += 1 if result else -1
+        self._count.value = self._true
+        if self.on_change is not None:
+            self.on_change(node, result)
+
+    def count(self):
+        """Return the number of nodes satisfying the predicate."""
+        return self._count()
+
+    def total(self):
+        """Return the number of watched nodes."""
+        return self._total()
+
+    def all(self):
+        return self.count() == self.total()
+
+    def any(self):
+        return self.count() > 0
+
+    def matching(self):
+        """Return the nodes satisfying the predicate, without tracking."""
+        return {n for n, r in self._results.items() if r}
+
+
+def when_nodes(predicate, nodes, aggregate='all'):
+    """Incremental variant of :func:`when_node` for large sets of `nodes`.
+
+    The `predicate` is evaluated on each node separately by a
+    :class:`NodeSetWatcher` and only on the nodes that change, while the
+    returned computation evaluates the `aggregate` of the results. It can be
+    ``'all'``, ``'any'`` or a callable receiving the watcher, for example
+    ``lambda w: w.count() >= 10``.
+
+    Stopping the returned computation stops the watcher too, that is
+    available as its ``watcher`` attribute.
+    """
+    watcher = NodeSetWatcher(predicate, nodes)
+    if aggregate == 'all':
+        check = watcher.all
+    elif aggregate == 'any':
+        check = watcher.any
+    elif callable(aggregate):
+        check = partial(aggregate, watcher)
+    else:
+        raise ValueError("Unknown aggregate {!r}".format(aggregate))
+
+    def eval_condition(computation):
+        return check()
+
+    comp = get_tracker().async_reactive(eval_condition, initial_value=False)
+    stop_condition = comp.stop
+
+    def stop():
+        watcher.stop()
+        stop_condition()
+
+    comp.stop = stop
+    comp.watcher = watcher
+    return comp
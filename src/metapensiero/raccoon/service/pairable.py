@@ -6,6 +6,7 @@
 # :Copyright: © 2016, 2017, 2018 Alberto Berti
 #
 
+import asyncio
 import logging
 
 from metapensiero.signal import handler
@@ -29,6 +30,12 @@ class PairableNode(ContextNode):
     The *master* part of the protocol is implemented by the
     :class:`~service.session.SessionRoot` object.
 
+    When the session is re-bound elsewhere, for example after a restart of
+    the service or a migration to another worker, the new session root sends
+    a ``peer_resume`` message to the surviving peers, which answer with a new
+    ``peer_ready``. Once the pairing is complete again they are notified with
+    :meth:`peer_resume` rather than :meth:`peer_start`.
+
     This object needs the service and session infrastructure to operate
     correctly.
     """
@@ -67,12 +74,19 @@ class PairableNode(ContextNode):
         await super()._node_bind(path, context, parent)
         self._expand_context()
 
-    def _pairable_notify_stop(self):
+    async def _pairable_notify_stop(self):
         role = self.node_context.get('role')
         peers = self.node_context.get('peers')
         if peers and self.pairing_active:
-            for peer_role, peer in peers.items():
-                Message(self, 'peer_stop', peer).send(role=role)
+            peers = list(peers.values())
+            results = await asyncio.gather(
+                *(Message(self, 'peer_stop', peer).send(role=role)
+                  for peer in peers),
+                return_exceptions=True)
+            for peer, result in zip(peers, results):
+                if isinstance(result, Exception):
+                    logger.error("Cannot notify the stop of '%s' to %r: %r",
+                                 self.node_path, peer, result)
 
     @on_message('peer_start')
     async def handle_start_message(self, msg):
@@ -92,6 +106,7 @@ class PairableNode(ContextNode):
                 peer = self.remote(uri)  # returns a proxy
             if role:
                 peers[role] = peer
+        resumed = self.pairing_active
         if peers:
             # FIXME: nc.peers is still useful?
             self.node_context.peers = peers
@@ -99,7 +114,21 @@ class PairableNode(ContextNode):
         logger.debug("Pairing phase completed with peers: '%s'", peers)
         self.pairing_active = True
         self.node_location.changed()
-        await self.peer_start(details)
+        if resumed:
+            await self.peer_resume(details)
+        else:
+            await self.peer_start(details)
+
+    @on_message('reply')
+    def handle_reply_message(self, msg):
+        """Complete the request answered by `msg`, see
+        :meth:`.message.Message.request`."""
+        Message.pending.resolve(msg)
+
+    @on_message('peer_resume')
+    def handle_resume_message(self, msg):
+        """The session has been re-bound, announce this peer again."""
+        self._send_ready(msg.details['id'])
 
     @on_message('peer_stop')
     async def handle_stop_message(self, msg):
@@ -131,12 +160,16 @@ class PairableNode(ContextNode):
             pr_id = await self.remote('@pairing_request')(
                 ctx.location, pr
             )
+        await self._send_ready(pr_id)
+
+    def _send_ready(self, pr_id):
+        ctx = self.node_context
         msg = Message(self, 'peer_ready',
                       id=pr_id,
                       location=ctx.location,
                       uri=str(self.node_path),
                       role=ctx.get('role'))
-        msg.send(self.node_path.base)
+        return msg.post(self.node_path.base)
 
     async def peer_init(self):
         logger.debug("Paired object at '%s' initialized.", self.node_path)
@@ -144,9 +177,14 @@ class PairableNode(ContextNode):
     async def peer_start(self, start_info):
         logger.debug("Paired object at '%s' started.", self.node_path)
 
+    async def peer_resume(self, start_info):
+        logger.debug("Paired object at '%s' resumed.", self.node_path)
+
     async def peer_stop(self):
         logger.debug("Paired object at '%s' stopped.", self.node_path)
-        self._pairable_notify_stop()
-        self.pairing_active = False
-        del self.node_context.peers
-        await self.node_unbind()
+        try:
+            await self._pairable_notify_stop()
+        finally:
+            self.pairing_active = False
+            del self.node_context.peers
+            await self.node_unbind()
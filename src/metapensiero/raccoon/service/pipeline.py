@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# :Project:   metapensiero.raccoon.service -- pipelined remote calls
+# :Created:   mar 20 ott 2026 20:16:45 CEST
+# :Author:    Alberto Berti <alberto@metapensiero.it>
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2026 Alberto Berti
+#
+
+"""Issue several independent remote calls without waiting for each one's
+round trip::
+
+  async with Pipeline() as p:
+      status = p.call(node.remote('@server').get_status)
+      info = p.call(node.remote('@client').node_info)
+  print(status.result(), info.result())
+
+Every call is sent as soon as it's added, so the total time is about that
+of the slowest call instead of the sum of all of them.
+"""
+
+import asyncio
+
+
+class Pipeline:
+    """A group of remote calls in flight at the same time.
+
+    :param int concurrency: optional maximum number of calls in flight
+    :param loop: the event loop
+    """
+
+    def __init__(self, concurrency=None, loop=None):
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        self._futures = []
+        self._semaphore = (asyncio.Semaphore(concurrency)
+                           if concurrency else None)
+
+    def __len__(self):
+        return len(self._futures)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.cancel()
+        else:
+            await self.results()
+
+    def call(self, method, *args, **kwargs):
+        """Call `method`, usually a method of a proxy, with the given
+        arguments right away.
+
+        :returns: the future of the result
+        """
+        if self._semaphore is None:
+            coro = method(*args, **kwargs)
+        else:
+            coro = self._limited(method, args, kwargs)
+        fut = asyncio.ensure_future(coro, loop=self.loop)
+        self._futures.append(fut)
+        return fut
+
+    async def _limited(self, method, args, kwargs):
+        async with self._semaphore:
+            return await method(*args, **kwargs)
+
+    def as_completed(self, timeout=None):
+        """Return an iterator of awaitables giving the results in the order
+        they complete."""
+        return asyncio.as_completed(self._futures, timeout=timeout)
+
+    async def results(self, return_exceptions=False):
+        """Wait for all the calls and return their results in the order they
+        were added. If one fails and `return_exceptions` is false, the
+        others are cancelled and its exception is raised."""
+        try:
+            return await asyncio.gather(*self._futures,
+                                        return_exceptions=return_exceptions)
+        except Exception:
+            self.cancel()
+            raise
+
+    def cancel(self):
+        """Cancel the calls still in flight."""
+        for fut in self._futures:
+            if not fut.done():
+                fut.cancel()
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+# :Project:   metapensiero.raccoon.service -- remote reactive dependencies
+# :Created:   mar 20 ott 2026 18:40:52 CEST
+# :Author:    Alberto Berti <alberto@metapensiero.it>
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2026 Alberto Berti
+#
+
+"""Reactive dependencies on nodes living in other processes.
+
+The changes of the nodes with ``node_export_changes`` set to ``True`` are
+published on a topic per node, ``<node uri>.changes`` (see
+:func:`changes_topic`). The changes of a node in the same loop iteration are
+published as a single event, whatever their number.
+
+On the other side :func:`depend` makes the current computation depend on a
+remote node, given its proxy: the first time it's used for a node it
+subscribes to its topic, so that a process receives only the changes of the
+nodes it watches, and each event invalidates the computations depending on
+it. This is what allows :func:`~.node.when_node` to take proxies.
+
+The changes published before the subscription is ready are lost, so the
+dependents of a node are invalidated once when it completes. A failed
+subscription is tried again the next time the node is watched. When no
+computation depends on a node anymore for :attr:`RemoteLocations.release_delay`
+seconds, its subscription is dropped.
+"""
+
+import asyncio
+from functools import partial
+import logging
+import weakref
+
+from metapensiero.reactive import get_tracker
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+CHANGES_SUFFIX = '.changes'
+"""The suffix of the topics where the changes of the exported nodes are
+published."""
+
+
+def changes_topic(uri):
+    """Return the topic where the changes of the node at `uri` are
+    published."""
+    return uri + CHANGES_SUFFIX
+
+
+_pending = {}
+_scheduled = False
+
+
+def export_change(context, uri):
+    """Schedule the publication of the change of the node at `uri`, using
+    the WAMP session in `context`."""
+    global _scheduled
+    session = context.get('wamp_session')
+    if session is None:
+        return
+    uris = _pending.get(session)
+    if uris is None:
+        uris = _pending[session] = set()
+    uris.add(uri)
+    if not _scheduled:
+        from . import system
+        _scheduled = True
+        system.flush_loop().call_soon(_publish)
+
+
+def _publish():
+    global _scheduled
+    _scheduled = False
+    pending = list(_pending.items())
+    _pending.clear()
+    for session, uris in pending:
+        if not session.is_attached():
+            continue
+        for uri in sorted(uris):
+            session.publish(changes_topic(uri))
+        metrics.counter('remote.changes.published').inc(len(uris))
+
+
+async def _unsubscribe(fut):
+    try:
+        sub = await fut
+    except Exception:
+        return
+    if sub.active:
+        try:
+            await sub.unsubscribe()
+        except Exception:
+            logger.exception("Error while unsubscribing %r", sub)
+
+
+class RemoteLocations:
+    """The dependencies on the remote nodes watched through a WAMP
+    session."""
+
+    release_delay = 5.0
+    """Seconds after which a node without dependent computations isn't
+    watched anymore. The computations that run again after an invalidation
+    depend on it anew in the meantime."""
+
+    def __init__(self, session):
+        self.session = session
+        self._dependencies = {}
+        self._listeners = {}
+        self._subscriptions = {}
+        self._unwatched = set()
+        self._sweep_handle = None
+
+    def subscription(self, uri):
+        """Return the future of the subscription to the changes of the node
+        at `uri`, subscribing if needed."""
+        fut = self._subscriptions.get(uri)
+        if fut is None:
+            fut = self._subscriptions[uri] = asyncio.ensure_future(
+                self.session.subscribe(partial(self._on_changes, uri),
+                                       changes_topic(uri)))
+            fut.add_done_callback(partial(self._subscribed, uri))
+        return fut
+
+    def _subscribed(self, uri, fut):
+        if self._subscriptions.get(uri) is not fut:
+            # released in the meantime
+            return
+        if fut.cancelled() or fut.exception() is not None:
+            # try again the next time
+            del self._subscriptions[uri]
+            logger.warning("Cannot watch the changes of '%s': %r", uri,
+                           None if fut.cancelled() else fut.exception())
+            return
+        self._notify(uri)
+
+    def _release(self, uri):
+        if uri in self._dependencies or uri in self._listeners:
+            return
+        fut = self._subscriptions.pop(uri, None)
+        if fut is not None:
+            asyncio.ensure_future(_unsubscribe(fut))
+
+    def depend(self, uri):
+        """Make the current computation depend on the node at `uri`."""
+        dep = self._dependencies.get(uri)
+        if dep is None:
+            dep = self._dependencies[uri] = get_tracker().dependency(self)
+        self.subscription(uri)
+        comp = get_tracker().current_computation
+        if dep.depend() and comp is not None:
+            comp.on_invalidate.connect(partial(self._dependent_invalidated,
+                                               uri))
+
+    def _dependent_invalidated(self, uri, computation):
+        self._unwatched.add(uri)
+        if self._sweep_handle is None:
+            from . import system
+            self._sweep_handle = system.flush_loop().call_later(
+                self.release_delay, self._sweep)
+
+    def _sweep(self):
+        self._sweep_handle = None
+        uris, self._unwatched = self._unwatched, set()
+        for uri in uris:
+            self.release(uri)
+
+    def release(self, uri):
+        """Drop the dependency on the node at `uri` if no computation
+        depends on it anymore."""
+        dep = self._dependencies.get(uri)
+        if dep is None or not dep.has_dependents:
+            self.forget(uri)
+
+    def add_listener(self, uri, callback):
+        """Call `callback` with `uri` each time the node at `uri` changes.
+        Return the future of the subscription."""
+        self._listeners.setdefault(uri, []).append(callback)
+        return self.subscription(uri)
+
+    def remove_listener(self, uri, callback):
+        listeners = self._listeners[uri]
+        listeners.remove(callback)
+        if not listeners:
+            del self._listeners[uri]
+            self._release(uri)
+
+    def forget(self, uri):
+        """Drop the dependency on the node at `uri`."""
+        self._dependencies.pop(uri, None)
+        self._release(uri)
+
+    def _on_changes(self, uri, *args, **kwargs):
+        metrics.counter('remote.changes.received').inc()
+        self._notify(uri)
+
+    def _notify(self, uri):
+        for callback in list(self._listeners.get(uri, ())):
+            try:
+                callback(uri)
+            except Exception:
+                logger.exception("Error in a listener of the remote changes")
+        dep = self._dependencies.get(uri)
+        if dep is not None:
+            dep.changed()
+
+    async def close(self):
+        if self._sweep_handle is not None:
+            self._sweep_handle.cancel()
+            self._sweep_handle = None
+        self._unwatched.clear()
+        subs = list(self._subscriptions.values())
+        self._subscriptions.clear()
+        await asyncio.gather(*(_unsubscribe(fut) for fut in subs))
+
+
+_locations = weakref.WeakKeyDictionary()
+
+
+def locations(session):
+    """Return the :class:`RemoteLocations` of `session`."""
+    res = _locations.get(session)
+    if res is None:
+        res = _locations[session] = RemoteLocations(session)
+    return res
+
+
+def depend(proxy, session=None):
+    """Make the current computation depend on the remote node reached by
+    `proxy`. The WAMP `session` defaults to the one in the proxy's
+    context."""
+    if session is None:
+        context = getattr(proxy, 'node_context', None)
+        if context is not None:
+            session = context.get('wamp_session')
+    if session is None:
+        raise ValueError("Cannot depend on {!r}, it has no WAMP"
+                         " session".format(proxy))
+    locations(session).depend(str(proxy.node_path))
+
+
+def release(proxy, session=None):
+    """Stop watching the remote node reached by `proxy`, if no computation
+    depends on it anymore."""
+    if session is None:
+        context = getattr(proxy, 'node_context', None)
+        if context is not None:
+            session = context.get('wamp_session')
+    if session is not None:
+        locations(session).release(str(proxy.node_path))
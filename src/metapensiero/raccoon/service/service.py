@@ -6,16 +6,21 @@
 # :Copyright: © 2016, 2017, 2018 Alberto Berti
 #
 
+import asyncio
+from functools import partial
 import logging
 
+from autobahn.wamp.exception import ApplicationError
+from autobahn.wamp.types import RegisterOptions
 from metapensiero.signal import handler, Signal
 from metapensiero.raccoon.node import WAMPNodeContext
 from metapensiero.raccoon.node.path import Path
 from metapensiero.raccoon.node.wamp import call
 
-from .node import ContextNode
+from .node import ContextNode, WAMPNode
 from .session import SessionRoot
-from . import system
+from .user import UserRegistry, Users
+from . import cluster, executors, metrics, system
 
 logger = logging.getLogger(__name__)
 
@@ -75,11 +80,18 @@ class BaseService(ContextNode):
 
     async def _on_connection_connected(self, session, session_details,
                                        **kwargs):
+        if self.started:
+            # the connection has been re-established and the registrations
+            # replayed on the new session, just update the context
+            self.node_context.wamp_session = session
+            self.node_context.wamp_details = session_details
+            logger.info("Service at %r reconnected", self.node_path)
+            return
         path, context = self._tmp_path, self._tmp_context
         del self._tmp_path, self._tmp_context
         context.wamp_session = session
         context.wamp_details = session_details
-        await self.node_bind(path, context)
+        await self.node_bind_concurrent(path, context)
         await self.start_service(path, context)
         self.started = True
         await self.on_start.notify(local_path=self.node_path,
@@ -112,7 +124,50 @@ class ApplicationService(BaseService):
     :param context: An optional parent context
     :type context: An instance of
       :class:`~metapensiero.raccoon.node.context.WAMPContext`
+    :param bool multi_worker: enable the multi-worker mode
+    :param str worker_id: the id of this worker in multi-worker mode, a
+      random one if not given. It's required when a `store` is given too, so
+      that the worker finds its sessions again after a restart
+    :param str invoke_policy: the router invocation policy used to share the
+      service endpoints among the workers
+    :param store: an optional :class:`~.snapshot.SnapshotStore` where the
+      snapshots of the sessions are saved
     :results: a dictionary containing initial session info.
+
+    When a `store` is given the snapshot of every session is saved each time
+    its state changes and the saved sessions are restored when the service
+    starts, so that the clients can resume them after a restart instead of
+    creating new ones.
+
+    The users of the sessions are kept in the :attr:`users` registry, so
+    that all the sessions of the same user share a single
+    :class:`~.user.User` node, bound at ``<service path>.users.<user id>``
+    or, in multi-worker mode, at ``<service path>.<worker id>.users.<user
+    id>``.
+
+    In multi-worker mode the same service can be started by several
+    processes: its own endpoints, like :meth:`start_session`, are registered
+    by all of them with `invoke_policy` and the router distributes the calls
+    among the workers. The session ids are prefixed by the worker id (see
+    :mod:`.cluster`), so they are unique in the whole cluster, and the
+    endpoints of each session are registered only by the worker owning it.
+
+    The workers announce themselves on the ``<service path>.cluster`` topic
+    and keep a :class:`~.cluster.HashRing` of the live ones. When
+    :meth:`start_session` is asked to resume a session that belongs to
+    another worker the call is forwarded to the owner, through the
+    ``<service path>.<worker id>.start_session`` procedure registered by each
+    worker, so that reconnecting clients find their session regardless of the
+    worker the router picked.
+
+    A live session can be moved to another worker with
+    :meth:`migrate_session`. The other members of the session stay bound and
+    pair again with the new incarnation, while the old owner keeps a pointer
+    to forward the resumptions. The pointers live in memory only.
+
+    With a `store`, the saved sessions of a worker that is not on the ring
+    anymore are taken over by the worker the ring assigns them to, when it
+    leaves the cluster or when a client asks to resume one of them.
     """
 
     SESSION_CLASS = SessionRoot
@@ -121,33 +176,403 @@ class ApplicationService(BaseService):
 
     location_name = system.name
 
+    restore_concurrency = 64
+    """Maximum number of sessions bound concurrently by
+    :meth:`restore_sessions`."""
+
+    store_pool = 'thread'
+    """The name of the executor pool where the snapshots are written, see
+    :mod:`.executors`."""
+
+    store_retry_delay = 1.0
+    """Seconds to wait before writing again the snapshots whose save
+    failed."""
+
     on_session_stopped = Signal()
     """The `~metapensiero.signal.atom.Signal` that is fired each time a session is
     reached a ``stopped`` state."""
 
-    def __init__(self, factory, node_path, node_context=None):
+    def __init__(self, factory, node_path, node_context=None,
+                 multi_worker=False, worker_id=None,
+                 invoke_policy='roundrobin', store=None):
         super().__init__(node_path, node_context=node_context)
         self._next_session_num = 1
         self._sessions = {}
         self._factory = factory
+        self.store = store
+        self.users = None
+        """The :class:`~.user.UserRegistry` of the service, available once
+        it's started."""
+        self._dirty_sessions = {}
+        self._flush_scheduled = False
+        self._flushing = None
+        self.multi_worker = multi_worker
+        self.invoke_policy = invoke_policy
+        if multi_worker:
+            if store is not None and worker_id is None:
+                raise ValueError("A multi-worker service with a store needs"
+                                 " an explicit worker_id")
+            self._id_generator = cluster.SessionIdGenerator(worker_id)
+        else:
+            self._id_generator = None
+        self._shared_path = None
+        self._ring = cluster.HashRing()
+        self._cluster_handles = None
+        self._migrated = {}
+        self._adoption = None
+        self._adopt_again = False
+        self._adopting = {}
+
+    @property
+    def worker_id(self):
+        """The id of this worker in multi-worker mode, ``None`` otherwise."""
+        if self._id_generator is not None:
+            return self._id_generator.worker_id
 
     def _next_session_id(self):
+        if self._id_generator is not None:
+            return self._id_generator()
         res = self._next_session_num
         self._next_session_num += 1
         return str(res)
 
+    def _skip_session_id(self, session_id):
+        """Ensure that `session_id`, coming from a snapshot, won't be
+        generated again."""
+        if self._id_generator is not None:
+            self._id_generator.advance(session_id)
+        elif session_id.isdigit():
+            self._next_session_num = max(self._next_session_num,
+                                         int(session_id) + 1)
+
+    async def _node_bind(self, path, context=None, parent=None):
+        session = context.get('wamp_session') if context is not None else None
+        if self.multi_worker and session is not None:
+            uri = str(path)
+            session.share_registrations(uri, self.invoke_policy,
+                                        owned=[uri + '.' + self.worker_id])
+            self._shared_path = (session, uri)
+        await super()._node_bind(path, context, parent)
+
+    async def _node_unbind(self):
+        if self._cluster_handles is not None:
+            await self._leave_cluster()
+        await super()._node_unbind()
+        if self._shared_path is not None:
+            session, path = self._shared_path
+            self._shared_path = None
+            session.unshare_registrations(path)
+
+    async def start_service(self, path, context):
+        await super().start_service(path, context)
+        users = Users()
+        if self.multi_worker:
+            # every worker has its own users, under the prefix it owns, as
+            # the shared procedures are not bound to a specific worker
+            worker = WAMPNode()
+            await self.node_add(self.worker_id, worker)
+            await worker.node_add('users', users)
+        else:
+            await self.node_add('users', users)
+        self.users = UserRegistry(users)
+        if self.store is not None:
+            await self.restore_sessions()
+        if self.multi_worker:
+            await self._join_cluster()
+
+    def _cluster_uri(self, *parts):
+        return '.'.join((str(self.node_path),) + parts)
+
+    async def _join_cluster(self):
+        session = self.node_context.wamp_session
+        self._ring.add(self.worker_id)
+        options = RegisterOptions(details_arg='details')
+        regs = []
+        for name, endpoint in (('start_session', self._owner_start_session),
+                               ('adopt_session', self._adopt_session)):
+            regs.append(await session.register(
+                endpoint, self._cluster_uri(self.worker_id, name), options))
+        sub = await session.subscribe(self._on_cluster_event,
+                                      self._cluster_uri('cluster'))
+        self._cluster_handles = (regs, sub)
+        session.publish(self._cluster_uri('cluster'), 'join', self.worker_id)
+        logger.info("Worker %r of %r joined the cluster", self.worker_id,
+                    self.node_path)
+
+    async def _leave_cluster(self):
+        session = self.node_context.wamp_session
+        regs, sub = self._cluster_handles
+        self._cluster_handles = None
+        if not session.is_attached():
+            return
+        session.publish(self._cluster_uri('cluster'), 'leave', self.worker_id)
+        for reg in regs:
+            if reg.active:
+                await reg.unregister()
+        if sub.active:
+            await sub.unsubscribe()
+
+    def _on_cluster_event(self, event, worker_id):
+        if event == 'join':
+            self._ring.add(worker_id)
+            self.node_context.wamp_session.publish(
+                self._cluster_uri('cluster'), 'present', self.worker_id)
+        elif event == 'present':
+            self._ring.add(worker_id)
+        elif event == 'leave':
+            self._ring.remove(worker_id)
+            if self.store is not None:
+                self._schedule_adoption()
+        logger.debug("Cluster of %r has now workers %r", self.node_path,
+                     sorted(self._ring.workers))
+
+    async def _forward_start_session(self, owner, from_location, session_id):
+        """Forward the resumption of `session_id` to the `owner` worker.
+        Return ``None`` if no other worker can handle it."""
+        while owner is not None and owner != self.worker_id:
+            metrics.counter('cluster.forwarded').inc()
+            try:
+                return await self.node_context.wamp_session.call(
+                    self._cluster_uri(owner, 'start_session'), from_location,
+                    session_id=session_id)
+            except ApplicationError as e:
+                if e.error != ApplicationError.NO_SUCH_PROCEDURE:
+                    raise
+                logger.warning("Worker %r of %r is gone", owner,
+                               self.node_path)
+                self._ring.remove(owner)
+                owner = self._ring.owner(session_id)
+
+    async def _owner_start_session(self, from_location, session_id=None,
+                                   details=None):
+        target = self._migrated.get(session_id)
+        if target is not None and session_id not in self._sessions:
+            result = await self._forward_start_session(
+                target, from_location, session_id)
+            if result is not None:
+                return result
+        return await self._start_local_session(from_location, session_id,
+                                               details)
+
+    async def migrate_session(self, session_id, worker_id):
+        """Move the session `session_id` to the worker `worker_id`.
+
+        The session is unbound quietly, without notifying its members, and its
+        snapshot is adopted by the target worker, that binds it again at the
+        same path. If the target fails the session is restored here.
+        """
+        assert self.multi_worker, "Migration needs the multi-worker mode"
+        sess = self._sessions.pop(session_id)
+        self._dirty_sessions.pop(session_id, None)
+        snapshot = sess.snapshot()
+        # no more snapshots from this incarnation
+        sess.restoring = True
+        await sess.node_unbind()
+        try:
+            await self.node_context.wamp_session.call(
+                self._cluster_uri(worker_id, 'adopt_session'), snapshot)
+        except Exception:
+            logger.exception("Migration of session %r to worker %r failed",
+                             session_id, worker_id)
+            self._sessions[session_id] = await self._create_session(
+                session_id, None, snapshot=snapshot)
+            raise
+        self._migrated[session_id] = worker_id
+        if self.store is not None:
+            self._delete_snapshot(session_id)
+        metrics.counter('cluster.migrated').inc()
+        logger.info("Session %r migrated to worker %r", session_id, worker_id)
+
+    async def _adopt_session(self, snapshot, details=None):
+        session_id = snapshot['id']
+        if session_id in self._sessions:
+            raise ApplicationError('raccoon.error.session_exists', session_id)
+        sess = await self._create_session(session_id, None,
+                                          snapshot=snapshot)
+        self._sessions[session_id] = sess
+        self._migrated.pop(session_id, None)
+        sess.snapshot_changed()
+        return True
+
+    def save_session(self, session):
+        """Schedule the save of the snapshot of `session` in the store. The
+        saves requested in the same loop iteration are written together, in
+        the :attr:`store_pool`, one write at a time."""
+        self._dirty_sessions[session.node_context.session_id] = session
+        self._schedule_flush()
+
+    def _schedule_flush(self, delay=None):
+        if self._flush_scheduled or self._flushing is not None:
+            # the write in flight schedules the next one when it ends
+            return
+        self._flush_scheduled = True
+        loop = self.node_context.loop
+        if delay is None:
+            loop.call_soon(self._flush_snapshots)
+        else:
+            loop.call_later(delay, self._flush_snapshots)
+
+    def _flush_snapshots(self):
+        self._flush_scheduled = False
+        dirty, self._dirty_sessions = self._dirty_sessions, {}
+        snapshots = [s.snapshot() for s in dirty.values()
+                     if s.status != 'stopped']
+        if self.multi_worker:
+            for snapshot in snapshots:
+                snapshot['worker'] = self.worker_id
+        if not snapshots:
+            return
+        self._flushing = executors.run_in_pool(
+            self.store_pool, self.node_context.loop, self.store.save_many,
+            str(self.node_path), snapshots)
+        self._flushing.add_done_callback(partial(self._snapshots_flushed,
+                                                 dirty))
+
+    def _snapshots_flushed(self, dirty, fut):
+        self._flushing = None
+        error = fut.exception() if not fut.cancelled() else None
+        if fut.cancelled() or error is not None:
+            logger.error("Cannot save the snapshots of %d sessions of %r",
+                         len(dirty), self.node_path, exc_info=error)
+            # try again, keeping the newer changes
+            for session_id, session in dirty.items():
+                if session_id in self._sessions:
+                    self._dirty_sessions.setdefault(session_id, session)
+            if self._dirty_sessions:
+                self._schedule_flush(self.store_retry_delay)
+        elif self._dirty_sessions:
+            self._schedule_flush()
+
+    def _delete_snapshot(self, session_id):
+        if self._flushing is not None:
+            # the write in flight may contain it
+            self._flushing.add_done_callback(
+                lambda f: self._delete_snapshot(session_id))
+            return
+        self.store.delete(str(self.node_path), session_id)
+
+    async def restore_sessions(self):
+        """Restore the sessions saved in the store. In multi-worker mode only
+        the sessions created by this worker are restored, the others are
+        taken over later by :meth:`adopt_sessions`.
+
+        :returns: the number of restored sessions
+        """
+        snapshots = self.store.load(str(self.node_path))
+        if self.multi_worker:
+            snapshots = [s for s in snapshots
+                         if _snapshot_worker(s) == self.worker_id]
+        return await self._restore_snapshots(snapshots)
+
+    def _schedule_adoption(self):
+        """Run :meth:`adopt_sessions` in a single task, again if another
+        worker leaves while it runs."""
+        if self._adoption is not None:
+            self._adopt_again = True
+            return
+        self._adoption = asyncio.ensure_future(self._adopt_orphans(),
+                                               loop=self.node_context.loop)
+        self._adoption.add_done_callback(self._adoption_done)
+
+    async def _adopt_orphans(self):
+        restored = 0
+        self._adopt_again = True
+        while self._adopt_again:
+            self._adopt_again = False
+            restored += await self.adopt_sessions()
+        return restored
+
+    def _adoption_done(self, fut):
+        self._adoption = None
+        if fut.cancelled():
+            return
+        if fut.exception() is not None:
+            logger.error("Cannot adopt the sessions of the departed workers"
+                         " of %r", self.node_path, exc_info=fut.exception())
+        else:
+            logger.info("Adopted %d sessions of the departed workers of %r",
+                        fut.result(), self.node_path)
+
+    async def adopt_sessions(self, session_id=None):
+        """Restore the saved sessions whose worker is not on the ring
+        anymore and that the ring assigns to this one, or just the session
+        `session_id`. The sessions being adopted already are skipped, or
+        waited for when it's `session_id`.
+
+        :returns: the number of restored sessions
+        """
+        if session_id is not None and session_id in self._adopting:
+            await asyncio.shield(self._adopting[session_id])
+            return 0
+        snapshots = [s for s in self.store.load(str(self.node_path))
+                     if s['id'] not in self._sessions and
+                     s['id'] not in self._adopting and
+                     _snapshot_worker(s) not in self._ring and
+                     self._ring.get(s['id']) == self.worker_id and
+                     session_id in (None, s['id'])]
+        if not snapshots:
+            return 0
+        done = self.node_context.loop.create_future()
+        for snapshot in snapshots:
+            self._adopting[snapshot['id']] = done
+        try:
+            restored = await self._restore_snapshots(snapshots)
+        finally:
+            for snapshot in snapshots:
+                del self._adopting[snapshot['id']]
+            done.set_result(None)
+        for snapshot in snapshots:
+            sess = self._sessions.get(snapshot['id'])
+            if sess is not None:
+                # record the new owner in the store
+                sess.snapshot_changed()
+        return restored
+
+    async def _restore_snapshots(self, snapshots):
+        semaphore = asyncio.Semaphore(self.restore_concurrency)
+
+        async def restore(snapshot):
+            session_id = snapshot['id']
+            self._skip_session_id(session_id)
+            async with semaphore:
+                sess = await self._create_session(session_id, None,
+                                                  snapshot=snapshot)
+            self._sessions[session_id] = sess
+
+        results = await asyncio.gather(*(restore(s) for s in snapshots),
+                                       return_exceptions=True)
+        errors = [r for r in results if isinstance(r, Exception)]
+        for snapshot, result in zip(snapshots, results):
+            if isinstance(result, Exception):
+                logger.error("Cannot restore session %r: %r", snapshot['id'],
+                             result)
+        logger.info("Restored %d sessions of %r", len(results) - len(errors),
+                    self.node_path)
+        return len(results) - len(errors)
+
     async def _create_session(self, session_id, from_location,
-                              client_details=None):
+                              client_details=None, snapshot=None):
         session_ctx = self.node_context.new(service=self,
                                             session_id=session_id)
         session_ctx.session_id = session_id
         session_path = Path(self.node_path + session_id)
         session_path.base = session_path
-        sess = self.SESSION_CLASS(locations=[from_location, self.location_name],
+        if snapshot is not None:
+            locations = snapshot['locations']
+        else:
+            locations = [from_location, self.location_name]
+        sess = self.SESSION_CLASS(locations=locations,
                                   local_location_name=self.location_name,
                                   local_member_factory=self._factory,
                                   client_details=client_details)
-        await sess.node_bind(session_path, session_ctx, self)
+        if snapshot is not None:
+            sess.restoring = True
+        await sess.node_bind_concurrent(session_path, session_ctx, self)
+        if snapshot is not None:
+            try:
+                await sess.restore(snapshot)
+            finally:
+                sess.restoring = False
         return sess
 
     @call
@@ -157,6 +582,24 @@ class ApplicationService(BaseService):
         start a session that will establish and orchestrate further
         communication.
         """
+        if (self.multi_worker and session_id and
+            session_id not in self._sessions):
+            owner = (self._migrated.get(session_id) or
+                     self._ring.owner(session_id))
+            if owner is not None and owner != self.worker_id:
+                result = await self._forward_start_session(
+                    owner, from_location, session_id)
+                if result is not None:
+                    return result
+        return await self._start_local_session(from_location, session_id,
+                                               details)
+
+    async def _start_local_session(self, from_location, session_id=None,
+                                   details=None):
+        if (self.multi_worker and self.store is not None and session_id and
+            session_id not in self._sessions):
+            # a session of a worker gone without leaving the cluster
+            await self.adopt_sessions(session_id)
         if (session_id and session_id not in self._sessions) or \
            not session_id:
             session_id = self._next_session_id()
@@ -175,3 +618,10 @@ class ApplicationService(BaseService):
     @handler('on_session_stopped')
     def _remove_session(self, session):
         del self._sessions[session.node_name]
+        if self.store is not None:
+            self._dirty_sessions.pop(session.node_name, None)
+            self._delete_snapshot(session.node_name)
+
+
+def _snapshot_worker(snapshot):
+    return snapshot.get('worker', cluster.worker_of(snapshot['id']))
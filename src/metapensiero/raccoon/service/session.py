@@ -54,9 +54,18 @@ class SessionRoot(ContextNode):
     Usually there are two members with locations ``server`` and ``client``.
 
     This object is coded to work with the :class:`SessionMember` object.
+
+    The state of the session can be captured with :meth:`snapshot` and
+    applied to a new instance bound at the same path with :meth:`restore`,
+    see :meth:`~.service.ApplicationService.restore_sessions`.
     """
 
     _status = None
+    _user_registry = None
+
+    snapshot_keys = ()
+    """The names of the context values to include in the snapshot. Their
+    values must be serializable to JSON."""
 
     def __init__(self, locations, local_location_name,
                  local_member_factory, client_details=None):
@@ -84,6 +93,11 @@ class SessionRoot(ContextNode):
         self._local_member_factory = local_member_factory
         self.user = None
         self._client_details = client_details
+        self.peers_info = None
+        """The locations of the initial pairing, once completed."""
+        self.restoring = False
+        """Flag that is true while the session is being restored from a
+        snapshot."""
 
     def _new_pairing_id(self):
         """Generate a new pairing id."""
@@ -93,8 +107,8 @@ class SessionRoot(ContextNode):
 
     def _send_status_msg(self, **data):
         msg = Message(self, 'session_info', **data)
-        msg.send(dest=self.node_path)
-        msg.send(dest=self.node_parent.node_path)
+        msg.post(dest=self.node_path)
+        msg.post(dest=self.node_parent.node_path)
 
     @on_message('peer_ready')
     def handle_pairing_message(self, msg):
@@ -111,12 +125,13 @@ class SessionRoot(ContextNode):
                 msg = Message(self, 'peer_start', **data)
                 for location in pr.locations:
                     p = Path(pr.location_info[location]['uri'])
-                    msg.send(p)
+                    msg.post(p)
                     if id == 0 and location != self.local_location_name:
                         # add a proxy to the other locations
                         setattr(self, location, self.remote(p))
                 to_remove.add(id)
                 if id == 0:
+                    self.peers_info = data['locations']
                     logger.info("session at '%s' is now active",
                                 self.node_path)
                     self.status = 'active'
@@ -138,14 +153,92 @@ class SessionRoot(ContextNode):
         msg = Message(self, 'pairing_request', id=pr_id, info=info)
         for loc in self.locations:
             if loc != src_location:
-                msg.send(self.node_path + loc)
+                msg.post(self.node_path + loc)
         self.manage_pairings().invalidate()
         return pr_id
 
     async def set_user(self, user_node):
+        """Set the user of the session. If the service has a
+        :class:`~.user.UserRegistry` the session is linked to the
+        :class:`~.user.User` node shared by all the sessions of the same
+        user, otherwise `user_node` is added as the ``user`` child."""
         assert isinstance(user_node, User), "Wrong user type"
-        self.node_context.user = user_node
-        await self.node_add('user', user_node)
+        service = self.node_context.get('service')
+        registry = getattr(service, 'users', None)
+        if registry is not None:
+            shared = await registry.acquire(user_node)
+            await self._release_user()
+            self._user_registry = registry
+            user_node = shared
+        else:
+            await self.node_add('user', user_node)
+        self.user = self.node_context.user = user_node
+        self.snapshot_changed()
+
+    async def _release_user(self):
+        if self._user_registry is not None and self.user is not None:
+            registry, self._user_registry = self._user_registry, None
+            await registry.release(self.user)
+
+    async def _node_unbind(self):
+        await self._release_user()
+        await super()._node_unbind()
+
+    @property
+    def local_member(self):
+        return self.get(self.local_location_name)
+
+    def snapshot(self):
+        """Return a JSON-serializable mapping with the state of this session.
+        """
+        user = self.node_context.get('user')
+        member = self.local_member
+        ctx = self.node_context
+        return {
+            'id': ctx.session_id,
+            'locations': list(self.locations),
+            'local_location_name': self.local_location_name,
+            'status': self.status,
+            'peers': self.peers_info,
+            'user': None if user is None else {
+                'user_id': user.user_id,
+                'login': user.login,
+                'full_name': user.full_name,
+                'source': user.source,
+            },
+            'context': {k: ctx.get(k) for k in self.snapshot_keys if k in ctx},
+            'member': (member.session_state()
+                       if isinstance(member, SessionMember) else None),
+        }
+
+    async def restore(self, snapshot):
+        """Apply the `snapshot` taken from a previous incarnation of this
+        session. The session must be bound already; the initial pairing
+        happens again when the other members answer the ``peer_resume``
+        message or bootstrap again."""
+        for key, value in snapshot.get('context', {}).items():
+            self.node_context.set(key, value)
+        self.peers_info = snapshot.get('peers')
+        if snapshot.get('user'):
+            await self.set_user(User(**snapshot['user']))
+        member = self.local_member
+        if isinstance(member, SessionMember) and snapshot.get('member'):
+            await member.restore_session_state(snapshot['member'])
+        if self.peers_info:
+            # ask the surviving members to pair again
+            msg = Message(self, 'peer_resume', id=0)
+            for location, info in self.peers_info.items():
+                if location != self.local_location_name:
+                    msg.post(Path(info['uri']))
+
+    def snapshot_changed(self):
+        """Ask the service to save a new snapshot of this session, if it has
+        a store."""
+        if self.restoring:
+            return
+        service = self.node_context.get('service')
+        if service is not None and getattr(service, 'store', None):
+            service.save_session(self)
 
     @handler('on_node_bind')
     async def start(self):
@@ -174,6 +267,8 @@ class SessionRoot(ContextNode):
         if value != self._status:
             self._status = value
             self._send_status_msg(status=value)
+            if value != 'stopped':
+                self.snapshot_changed()
         else:
             self._status = value
 
@@ -204,6 +299,22 @@ class SessionMember(PairableNode):
     async def create_new_peer(self, details):
         raise NotImplementedError("An incoming pairing request must be handled")
 
+    def session_state(self):
+        """Return the JSON-serializable state of this member to include in
+        the session snapshot. By default there's none."""
+        return None
+
+    async def restore_session_state(self, state):
+        """Apply the `state` returned by :meth:`session_state` in a
+        previous incarnation of the session."""
+
+    def session_state_changed(self):
+        """Signal that the value returned by :meth:`session_state` has
+        changed and a new snapshot of the session should be saved."""
+        session = self.node_context.get('session')
+        if isinstance(session, SessionRoot):
+            session.snapshot_changed()
+
 
 async def bootstrap_session(wamp_context, service_uri, factory,
                             location_name=None, session_id=None, loop=None):
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+# :Project:   metapensiero.raccoon.service -- session snapshot stores
+# :Created:   mar 20 ott 2026 12:05:51 CEST
+# :Author:    Alberto Berti <alberto@metapensiero.it>
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2026 Alberto Berti
+#
+
+"""Persistent stores for the snapshots of the sessions of an
+:class:`~.service.ApplicationService`.
+
+A snapshot is a JSON-serializable mapping produced by
+:meth:`~.session.SessionRoot.snapshot`. The stores keep the last snapshot of
+every session, keyed by the path of the service and the session id, so that
+a restarted service can restore them with
+:meth:`~.service.ApplicationService.restore_sessions`.
+
+The service writes the snapshots from the threads of an executor pool, so
+the stores serialize the access to their storage with a lock.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+
+
+class SnapshotStore:
+    """The interface of the stores."""
+
+    def save_many(self, service, snapshots):
+        """Save the `snapshots` of some sessions of `service`."""
+        raise NotImplementedError()
+
+    def save(self, service, snapshot):
+        """Save the `snapshot` of a session of `service`."""
+        self.save_many(service, [snapshot])
+
+    def delete(self, service, session_id):
+        """Forget the session `session_id` of `service`."""
+        raise NotImplementedError()
+
+    def load(self, service):
+        """Return a list with the snapshots of the sessions of `service`."""
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class MemoryStore(SnapshotStore):
+    """A volatile store, mostly useful for testing."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def save_many(self, service, snapshots):
+        with self._lock:
+            sessions = self._data.setdefault(service, {})
+            for snapshot in snapshots:
+                sessions[snapshot['id']] = json.dumps(snapshot)
+
+    def delete(self, service, session_id):
+        with self._lock:
+            self._data.get(service, {}).pop(session_id, None)
+
+    def load(self, service):
+        with self._lock:
+            data = list(self._data.get(service, {}).values())
+        return [json.loads(s) for s in data]
+
+
+class SQLiteStore(SnapshotStore):
+    """Keep the snapshots in a SQLite database.
+
+    :param str filename: the path of the database
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS sessions ('
+                         ' service TEXT NOT NULL,'
+                         ' id TEXT NOT NULL,'
+                         ' data TEXT NOT NULL,'
+                         ' PRIMARY KEY (service, id))')
+        self._db.commit()
+
+    def save_many(self, service, snapshots):
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO sessions (service, id, data)'
+                ' VALUES (?, ?, ?)',
+                [(service, s['id'], json.dumps(s)) for s in snapshots])
+
+    def delete(self, service, session_id):
+        with self._lock, self._db:
+            self._db.execute(
+                'DELETE FROM sessions WHERE service = ? AND id = ?',
+                (service, session_id))
+
+    def load(self, service):
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT data FROM sessions WHERE service = ?',
+                (service,)).fetchall()
+        return [json.loads(data) for data, in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class AppendOnlyFileStore(SnapshotStore):
+    """Keep the snapshots in a file of JSON lines, one per change. The file
+    is rewritten with only the live snapshots by :meth:`compact`, which is
+    executed automatically when it's opened.
+
+    :param str filename: the path of the file
+    :param bool fsync: whether to flush every write to the disk
+    """
+
+    def __init__(self, filename, fsync=False):
+        self.filename = filename
+        self.fsync = fsync
+        self._file = None
+        self._lock = threading.Lock()
+        self.compact()
+
+    def _write(self, records):
+        data = ''.join(json.dumps(r) + '\n' for r in records)
+        with self._lock:
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def save_many(self, service, snapshots):
+        self._write({'service': service, 'id': s['id'], 'data': s}
+                    for s in snapshots)
+
+    def delete(self, service, session_id):
+        self._write([{'service': service, 'id': session_id, 'data': None}])
+
+    def _replay(self):
+        state = {}
+        if not os.path.exists(self.filename):
+            return state
+        with open(self.filename, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a truncated last line, left by a crash
+                    continue
+                key = (record['service'], record['id'])
+                if record['data'] is None:
+                    state.pop(key, None)
+                else:
+                    state[key] = record['data']
+        return state
+
+    def load(self, service):
+        with self._lock:
+            state = self._replay()
+        return [data for (srv, _), data in state.items() if srv == service]
+
+    def compact(self):
+        """Rewrite the file keeping only the live snapshots."""
+        with self._lock:
+            state = self._replay()
+            if self._file is not None:
+                self._file.close()
+            tmp = self.filename + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                for (service, session_id), data in state.items():
+                    f.write(json.dumps({'service': service, 'id': session_id,
+                                        'data': data}) + '\n')
+            os.replace(tmp, self.filename)
+            self._file = open(self.filename, 'a', encoding='utf-8')
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -6,12 +6,14 @@
 # :Copyright: © 2016, 2017, 2018 Alberto Berti
 #
 
+import asyncio
 import sys
 import weakref
 
 from metapensiero.reactive import get_tracker
 from metapensiero.raccoon.node import Path
 from .node import Node
+from . import compression, metrics, remote
 
 
 class SystemError(Exception):
@@ -29,7 +31,8 @@ class System(Node):
     def node_info(self):
         return {
             'name': self.name,
-            'lang': 'Python'
+            'lang': 'Python',
+            'codecs': compression.codec_names()
         }
 
     def register_node(self, node):
@@ -50,6 +53,7 @@ class System(Node):
         del self.NODE_LOCATION[node]
         del self.LOCATION_NODE[loc]
         del self.URI_NODE[str(loc.key)]
+        loc.deactivate()
 
 
 system = System()
@@ -65,32 +69,86 @@ class LocationMeta(type):
         return result
 
 
+_suppressed = metrics.counter(
+    'location.changes.suppressed',
+    'Location changes coalesced with an invalidation already pending')
+
+
+def flush_loop():
+    """Return the loop of the reactive flusher, where the changes of the
+    nodes are propagated, or the current event loop if it has none."""
+    loop = get_tracker().flusher.loop
+    return loop if loop is not None else asyncio.get_event_loop()
+
+
 class Location(metaclass=LocationMeta):
+    """The record of a bound node. Its reactive dependency is created only
+    when something depends on it, as most nodes are never watched.
+
+    The changes are coalesced: the dependents are invalidated at most once
+    per loop iteration, on the next flush, however many times
+    :meth:`changed` is called in the meantime. The skipped invalidations are
+    counted by the ``location.changes.suppressed`` metric.
+
+    The changes of the nodes with ``node_export_changes`` are also
+    published to the other processes, see :mod:`.remote`.
+    """
+
+    __slots__ = ('_active', '_key', '_node', '_is_root', '_dependency',
+                 '_pending', '_exported', '__weakref__')
 
     def __init__(self, node):
         self._active = True
         self._key = node.node_path.absolute
         self._node = weakref.ref(node)
         self._is_root = node.node_parent is None
-        self._dependency = get_tracker().dependency(self)
-        node.on_node_unbind.connect(self._on_node_unbind)
+        self._dependency = None
+        self._pending = False
+        self._exported = (node.node_context
+                          if getattr(node, 'node_export_changes', False)
+                          else None)
 
     def __hash__(self):
         return hash(self._key)
 
-    def _on_node_unbind(self, node, path, parent):
-        assert path.absolute is self._key, "Node changed path after bind"
+    def deactivate(self):
+        """Called when the node is unbound, invalidates the dependents one
+        last time, immediately."""
         self._active = False
         self.changed(override=True)
 
     def changed(self, override=False):
+        """Invalidate the dependents on the next flush or, with `override`,
+        immediately."""
         if self._active or override:
-            self._dependency.changed()
+            if self._dependency is None and self._exported is None:
+                return
+            if override:
+                self._pending = False
+                self._fire()
+            elif self._pending:
+                _suppressed.inc()
+            else:
+                self._pending = True
+                flush_loop().call_soon(self._flush)
         else:
             raise SystemError("Location no more active")
 
+    def _flush(self):
+        if self._pending:
+            self._pending = False
+            self._fire()
+
+    def _fire(self):
+        if self._dependency is not None:
+            self._dependency.changed()
+        if self._exported is not None:
+            remote.export_change(self._exported, str(self._key))
+
     def depend(self):
         if self._active:
+            if self._dependency is None:
+                self._dependency = get_tracker().dependency(self)
             self._dependency.depend()
         else:
             raise SystemError("Location no more active")
@@ -5,5 +5,10 @@
 # :License:   GNU General Public License version 3 or later
 #
 
+import sys
+
 from metapensiero.raccoon.service.testing import *
 from metapensiero.raccoon.node.testing import *
+
+# asynchronous generators are a syntax error before Python 3.6
+collect_ignore = ['test_streaming.py'] if sys.version_info < (3, 6) else []
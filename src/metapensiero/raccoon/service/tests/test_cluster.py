@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+# :Project:  metapensiero.raccoon.service -- multi-worker tests
+# :Created:  mar 20 ott 2026 11:04:26 CEST
+# :Author:   Alberto Berti <alberto@metapensiero.it>
+# :License:  GNU General Public License version 3 or later
+#
+
+import asyncio
+import multiprocessing
+
+import pytest
+from metapensiero.signal import handler
+from metapensiero.raccoon.node.wamp import call
+
+from metapensiero.raccoon.service import cluster
+from metapensiero.raccoon.service.service import ApplicationService
+from metapensiero.raccoon.service.session import (SessionMember,
+                                                  bootstrap_session)
+from metapensiero.raccoon.service.snapshot import MemoryStore
+
+
+SERVICE_PATH = 'raccoon.test.clustered'
+
+
+class Application(SessionMember):
+
+    def __init__(self, *maps, node_context=None):
+        super().__init__(*maps, node_context=node_context)
+        self._counter = 0
+
+    def session_state(self):
+        return {'counter': self._counter}
+
+    async def restore_session_state(self, state):
+        self._counter = state['counter']
+
+    @call
+    def whoami(self, details):
+        return self.node_context.service.worker_id
+
+    @call
+    def inc_counter(self, details):
+        self._counter += 1
+        self.session_state_changed()
+        return self._counter
+
+
+class Client(SessionMember):
+    pass
+
+
+def _run_worker(ws_url, worker_id, ready, path=SERVICE_PATH):
+    # executed in a separate process
+    import txaio
+    from metapensiero import reactive
+    from metapensiero.raccoon.service import init_system
+    from metapensiero.raccoon.service.wamp.connection import Connection
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    txaio.use_asyncio()
+    txaio.config.loop = loop
+    reactive.get_tracker().flusher.loop = loop
+    loop.run_until_complete(init_system(loop=loop))
+
+    class Worker(ApplicationService):
+
+        @handler('on_start')
+        def _set_ready(self):
+            ready.set()
+
+    conn = Connection(ws_url, 'default', loop=loop)
+    service = Worker(Application, path, multi_worker=True,
+                     worker_id=worker_id)
+    loop.run_until_complete(conn.connect(username='user1', password='abc123'))
+    loop.run_until_complete(service.set_connection(conn))
+    loop.run_forever()
+
+
+def test_session_ids():
+    gen = cluster.SessionIdGenerator('w001')
+    ids = [gen() for _ in range(40)]
+    assert len(set(ids)) == 40
+    assert ids[:2] == ['w001_1', 'w001_2']
+    assert ids[-1] == 'w001_14'
+    assert all(cluster.worker_of(i) == 'w001' for i in ids)
+    # ids without the worker prefix have no owner
+    for session_id in ('12345', 'w0011', 'w001_', 'w01_1', 'W001_1',
+                       'w001_1_2'):
+        assert cluster.worker_of(session_id) is None
+    gen.advance('w001_zz')
+    assert gen() == 'w001_100'
+    gen.advance('w002_zzz')
+    assert gen() == 'w001_101'
+    assert cluster.to_base36(0) == '0'
+    assert len(cluster.new_worker_id()) == cluster.WORKER_ID_LENGTH
+    with pytest.raises(ValueError):
+        cluster.SessionIdGenerator('W-1')
+
+
+def test_hash_ring():
+    ring = cluster.HashRing(['wrk1', 'wrk2', 'wrk3'])
+    keys = ['session{}'.format(i) for i in range(1000)]
+    before = {k: ring.get(k) for k in keys}
+    assert set(before.values()) == {'wrk1', 'wrk2', 'wrk3'}
+    ring.add('wrk4')
+    after = {k: ring.get(k) for k in keys}
+    moved = [k for k in keys if before[k] != after[k]]
+    # only the keys taken by the new worker move
+    assert all(after[k] == 'wrk4' for k in moved)
+    assert len(moved) < 500
+    ring.remove('wrk4')
+    assert {k: ring.get(k) for k in keys} == before
+    # the worker embedded in the id wins, as long as it's alive
+    assert ring.owner('wrk2_abc') == 'wrk2'
+    assert ring.owner('dead_1') == ring.get('dead_1')
+
+
+@pytest.mark.asyncio
+async def test_multi_worker(connection1, connection2, ws_url, events):
+
+    events.define('started')
+
+    class Worker(ApplicationService):
+
+        @handler('on_start')
+        def _set_started(self):
+            events.started.set()
+
+    mp = multiprocessing.get_context('spawn')
+    ready = mp.Event()
+    other = mp.Process(target=_run_worker, args=(ws_url, 'wrk2', ready),
+                       daemon=True)
+    other.start()
+    try:
+        local = Worker(Application, SERVICE_PATH, multi_worker=True,
+                       worker_id='wrk1')
+        await local.set_connection(connection1)
+        await events.wait_for(events.started, 5)
+        loop = asyncio.get_event_loop()
+        assert await loop.run_in_executor(None, ready.wait, 20)
+        # the users are not shared among the workers
+        assert (str(local.users.container.node_path) ==
+                SERVICE_PATH + '.wrk1.users')
+
+        clients = []
+        for _ in range(4):
+            clients.append(await bootstrap_session(
+                connection2.new_context(), SERVICE_PATH, Client, 'test'))
+        ids = [c.node_context.session_id for c in clients]
+        assert len(set(ids)) == 4
+        # the start_session calls are distributed among the workers
+        assert {cluster.worker_of(i) for i in ids} == {'wrk1', 'wrk2'}
+        # and the session endpoints live on the owner
+        for client, session_id in zip(clients, ids):
+            owner = await client.remote('@server').whoami()
+            assert owner == cluster.worker_of(session_id)
+
+        # resuming a session works whatever worker gets the call
+        start = SERVICE_PATH + '.start_session'
+        for session_id in ids * 2:
+            info = await connection2.session.call(start, 'test',
+                                                  session_id=session_id)
+            assert info['id'] == session_id
+        # sessions of unknown workers are assigned by the ring
+        info = await connection2.session.call(start, 'test',
+                                              session_id='gone_1')
+        assert cluster.worker_of(info['id']) == local._ring.get('gone_1')
+
+        # teardown
+        for client in clients:
+            await client.node_unbind()
+        await local.node_unbind()
+    finally:
+        other.terminate()
+        other.join()
+
+
+@pytest.mark.asyncio
+async def test_session_migration(connection1, connection2, ws_url, events):
+
+    events.define('started', 'resumed')
+    path = SERVICE_PATH + '_migration'
+
+    class Worker(ApplicationService):
+
+        @handler('on_start')
+        def _set_started(self):
+            events.started.set()
+
+    class ResumingClient(SessionMember):
+
+        async def peer_resume(self, start_info):
+            await super().peer_resume(start_info)
+            events.resumed.set()
+
+    mp = multiprocessing.get_context('spawn')
+    ready = mp.Event()
+    other = mp.Process(target=_run_worker,
+                       args=(ws_url, 'wrk4', ready, path), daemon=True)
+    other.start()
+    clients = []
+    try:
+        local = Worker(Application, path, multi_worker=True,
+                       worker_id='wrk3')
+        await local.set_connection(connection1)
+        await events.wait_for(events.started, 5)
+        loop = asyncio.get_event_loop()
+        assert await loop.run_in_executor(None, ready.wait, 20)
+
+        # get a session on the local worker
+        while not clients or \
+              clients[-1].node_context.session_id not in local._sessions:
+            assert len(clients) < 4
+            clients.append(await bootstrap_session(
+                connection2.new_context(), path, ResumingClient, 'test'))
+        tc = clients[-1]
+        session_id = tc.node_context.session_id
+        server = tc.remote('@server')
+        assert await server.inc_counter() == 1
+        assert await server.inc_counter() == 2
+
+        await local.migrate_session(session_id, 'wrk4')
+        assert session_id not in local._sessions
+        await events.wait_for(events.resumed, 5)
+        # same path, new owner, same state
+        assert await server.whoami() == 'wrk4'
+        assert await server.inc_counter() == 3
+        # resumptions are forwarded to the new owner
+        for _ in range(2):
+            info = await connection2.session.call(path + '.start_session',
+                                                  'test',
+                                                  session_id=session_id)
+            assert info['id'] == session_id
+        assert await server.inc_counter() == 4
+
+        # teardown
+        for client in clients:
+            await client.node_unbind()
+        await local.node_unbind()
+    finally:
+        other.terminate()
+        other.join()
+
+
+def test_store_needs_worker_id():
+    with pytest.raises(ValueError):
+        ApplicationService(Application, SERVICE_PATH, multi_worker=True,
+                           store=MemoryStore())
+
+
+@pytest.mark.asyncio
+async def test_orphan_sessions(connection1, connection2, events):
+
+    events.define('started')
+    path = SERVICE_PATH + '.orphans'
+
+    class Worker(ApplicationService):
+
+        @handler('on_start')
+        def _set_started(self):
+            events.started.set()
+
+    store = MemoryStore()
+    gone = Worker(Application, path, multi_worker=True, worker_id='wrk5',
+                  store=store)
+    await gone.set_connection(connection1)
+    await events.wait_for(events.started, 5)
+    tc = await bootstrap_session(connection2.new_context(), path, Client,
+                                 'test')
+    session_id = tc.node_context.session_id
+    assert await tc.remote('@server').inc_counter() == 1
+    # the snapshots are written in a thread
+    for _ in range(20):
+        if [s['member'] for s in store.load(path)] == [{'counter': 1}]:
+            break
+        await asyncio.sleep(0.05)
+    # the worker stops, leaving its session in the store
+    await tc.node_unbind()
+    await gone.node_unbind()
+
+    events.started.clear()
+    local = Worker(Application, path, multi_worker=True, worker_id='wrk6',
+                   store=store)
+    await local.set_connection(connection1)
+    await events.wait_for(events.started, 5)
+    # its own sessions only are restored at start
+    assert session_id not in local._sessions
+    tc = await bootstrap_session(connection2.new_context(), path, Client,
+                                 'test', session_id=session_id)
+    assert tc.node_context.session_id == session_id
+    assert await tc.remote('@server').whoami() == 'wrk6'
+    assert await tc.remote('@server').inc_counter() == 2
+    for _ in range(20):
+        snapshot, = store.load(path)
+        if snapshot['member'] == {'counter': 2}:
+            break
+        await asyncio.sleep(0.05)
+    assert snapshot['worker'] == 'wrk6'
+
+    # teardown
+    await tc.node_unbind()
+    await local.node_unbind()
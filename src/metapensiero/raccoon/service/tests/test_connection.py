@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# :Project:  metapensiero.raccoon.service -- connection tests
+# :Created:  mar 20 ott 2026 22:51:09 CEST
+# :Author:   Alberto Berti <alberto@metapensiero.it>
+# :License:  GNU General Public License version 3 or later
+#
+
+import pytest
+
+from metapensiero.raccoon.service.wamp.connection import (Connection,
+                                                          make_serializers)
+
+
+def test_make_serializers():
+    sers = make_serializers(['msgpack'])
+    assert sers[-1].SERIALIZER_ID == 'json'
+    assert [s.SERIALIZER_ID for s in make_serializers(['json'])] == ['json']
+    with pytest.raises(ValueError):
+        make_serializers(['xml'])
+
+
+@pytest.mark.asyncio
+async def test_serializer_selection(event_loop, ws_url, setup_txaio,
+                                    setup_reactive, setup_system):
+    conn = Connection(ws_url, 'default', loop=event_loop,
+                      serializers=['json'])
+    assert conn.serializer_id is None
+    await conn.connect(username='user1', password='abc123')
+    assert conn.serializer_id == 'json'
+
+    # teardown
+    await conn.disconnect()
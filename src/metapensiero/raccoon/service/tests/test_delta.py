@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# :Project:  metapensiero.raccoon.service -- delta streaming tests
+# :Created:  mar 20 ott 2026 17:58:40 CEST
+# :Author:   Alberto Berti <alberto@metapensiero.it>
+# :License:  GNU General Public License version 3 or later
+#
+
+import asyncio
+
+import pytest
+
+from metapensiero.raccoon.service.delta import Replica, StreamedNode
+from metapensiero.raccoon.service.node import WAMPNode
+
+
+@pytest.mark.asyncio
+async def test_replica(connection1, connection2):
+    node = StreamedNode()
+    await node.node_bind('raccoon.test.streamed', connection1.new_context())
+    node['a'] = 1
+    changes = []
+    replica = Replica(connection2.session, 'raccoon.test.streamed',
+                      on_change=lambda s, d: changes.append((s, d)))
+    await replica.start()
+    assert replica.data == {'a': 1}
+    assert replica.seq == 0
+
+    # many changes in the same loop iteration travel together
+    node['a'] = 2
+    node['b'] = 3
+    node['b'] = 4
+    del node['a']
+    await node.node_add('child', WAMPNode())
+    for _ in range(20):
+        await asyncio.sleep(0.05)
+        if replica.seq:
+            break
+    assert replica.seq == 1
+    assert replica.data == {'b': 4,
+                            'child': {'$node': 'raccoon.test.streamed.child'}}
+    assert changes[-1][1] == ['a']
+
+    # a gap triggers a new snapshot
+    replica._on_delta(seq=5, set={'c': 1}, deleted=[])
+    await replica._syncing
+    assert replica.seq == 1
+    assert 'c' not in replica.data
+
+    # teardown
+    await replica.stop()
+    await node.node_unbind()
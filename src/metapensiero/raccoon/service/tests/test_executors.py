@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# :Project:  metapensiero.raccoon.service -- executors tests
+# :Created:  lun 19 ott 2026 14:48:12 CEST
+# :Author:   Alberto Berti <alberto@metapensiero.it>
+# :License:  GNU General Public License version 3 or later
+#
+
+from functools import wraps
+import os
+import threading
+
+import pytest
+
+from metapensiero.raccoon.service import executors, metrics
+
+
+class FakeContext:
+
+    def __init__(self, loop):
+        self.loop = loop
+
+
+def doubled(func):
+
+    @wraps(func)
+    def wrapper(value):
+        return func(value) * 2
+
+    return wrapper
+
+
+class Cruncher:
+
+    def __init__(self, loop):
+        self.node_context = FakeContext(loop)
+
+    def where(self, value):
+        return threading.get_ident(), value * 2
+
+    @staticmethod
+    def pid(value):
+        if value < 0:
+            raise ValueError(value)
+        return os.getpid(), value
+
+    @executors.offload('process')
+    @staticmethod
+    @doubled
+    def double(value):
+        return value
+
+
+@pytest.mark.asyncio
+async def test_thread_offload(event_loop):
+    node = Cruncher(event_loop)
+    offloaded = executors.offload_handler(Cruncher.where, 'thread')
+    ident, result = await offloaded(node, 21)
+    assert ident != threading.get_ident()
+    assert result == 42
+    assert metrics.get('executor.thread.pending').value == 0
+
+
+@pytest.mark.asyncio
+async def test_process_offload(event_loop):
+    node = Cruncher(event_loop)
+    offloaded = executors.offload_handler(Cruncher.__dict__['pid'],
+                                          'process')
+    pid, result = await offloaded(node, 1)
+    assert pid != os.getpid()
+    assert result == 1
+    with pytest.raises(ValueError):
+        await offloaded(node, -1)
+    assert metrics.get('executor.process.submitted').value == 2
+    # the decorators of the offloaded function are kept
+    assert await node.double(21) == 42
+
+
+def test_unknown_pool():
+    with pytest.raises(executors.ExecutorError):
+        executors.get_pool('nonexistent')
@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+# :Project:  metapensiero.raccoon.service -- message tests
+# :Created:  lun 19 ott 2026 10:31:05 CEST
+# :Author:   Alberto Berti <alberto@metapensiero.it>
+# :License:  GNU General Public License version 3 or later
+#
+
+import asyncio
+
+import pytest
+from metapensiero.raccoon.node import Path
+
+from metapensiero.raccoon.service import chunks, compression, flow, tracing
+from metapensiero.raccoon.service.message import (Message, MessageError,
+                                                  PendingReplies,
+                                                  _notify_chunked)
+
+
+class FakeNode:
+
+    node_path = Path('raccoon.test.dest')
+
+
+@pytest.fixture
+def tracer():
+    tracer = tracing.Tracer(tracing.InMemoryExporter())
+    tracing.set_tracer(tracer)
+    yield tracer
+    tracing.set_tracer(None)
+
+
+def test_message_read_trace():
+    msg = Message.read(msg_type='foo', msg_details={'a': 1},
+                       msg_trace={'trace_id': 'abc', 'span_id': 'def',
+                                  'sent': 1.0},
+                       other=2)
+    assert msg.type == 'foo'
+    assert msg.trace['trace_id'] == 'abc'
+    assert msg.misc == {'other': 2}
+
+
+def test_trace_handler(tracer):
+    send_span = tracer.start_span('message.send')
+    msg = Message.read(msg_type='foo', msg_source={'uri': 'raccoon.test.src'},
+                       msg_details={}, msg_trace=send_span.context())
+    node = FakeNode()
+
+    def handler(node, msg):
+        return 42
+
+    assert tracing.trace_handler(msg, node, handler) == 42
+    spans = tracer.exporter.find(send_span.trace_id)
+    assert [s.name for s in spans] == ['message.dispatch', 'message.handle']
+    assert all(s.parent_id == send_span.span_id for s in spans)
+    assert spans[1].attributes['dest'] == 'raccoon.test.dest'
+
+
+@pytest.mark.asyncio
+async def test_trace_async_handler(tracer):
+    send_span = tracer.start_span('message.send')
+    msg = Message.read(msg_type='foo', msg_details={},
+                       msg_trace=send_span.context())
+
+    async def handler(node, msg):
+        raise ValueError('boom')
+
+    with pytest.raises(ValueError):
+        await tracing.trace_handler(msg, FakeNode(), handler)
+    handle = tracer.exporter.find(send_span.trace_id)[-1]
+    assert handle.name == 'message.handle'
+    assert handle.duration is not None
+    assert 'boom' in handle.error
+
+
+@pytest.mark.asyncio
+async def test_trace_send(tracer, event_loop):
+    msg = Message.read(msg_type='foo', msg_source={'uri': 'raccoon.test.src'},
+                       msg_details={})
+    sent = event_loop.create_future()
+    fut = tracing.trace_send(msg, lambda: sent)
+    assert fut is sent
+    # the span is open until the message is handed over
+    assert not tracer.exporter.find(msg.trace['trace_id'])
+    sent.set_exception(ValueError('boom'))
+    with pytest.raises(ValueError):
+        await fut
+    await asyncio.sleep(0)
+    span, = tracer.exporter.find(msg.trace['trace_id'])
+    assert span.name == 'message.send'
+    assert span.duration is not None
+    assert 'boom' in span.error
+
+
+@pytest.mark.asyncio
+async def test_flow_control_block(event_loop):
+    fc = flow.FlowController(window=2, max_queue=3)
+    acks = []
+    sent = []
+
+    def send(i):
+        sent.append(i)
+        ack = event_loop.create_future()
+        acks.append(ack)
+        return ack
+
+    futs = [fc.submit('dest', lambda i=i: send(i), event_loop)
+            for i in range(5)]
+    assert sent == [0, 1]
+    assert fc.queue_depth('dest') == 3
+    with pytest.raises(flow.FlowControlError):
+        fc.submit('dest', lambda: send(5), event_loop)
+    # other destinations have their own window
+    fc.submit('other', lambda: None, event_loop)
+    assert fc.queue_depth('other') == 0
+
+    acks[0].set_result('ack0')
+    assert await futs[0] == 'ack0'
+    await asyncio.sleep(0)
+    assert sent == [0, 1, 2]
+    while not all(f.done() for f in futs):
+        for ack in acks:
+            if not ack.done():
+                ack.set_result(None)
+        await asyncio.sleep(0)
+    assert sent == [0, 1, 2, 3, 4]
+    assert fc.queue_depth('dest') == 0
+
+
+@pytest.mark.asyncio
+async def test_flow_control_drop_oldest(event_loop):
+    fc = flow.FlowController(window=1, max_queue=1, policy=flow.DROP_OLDEST)
+    sent = []
+    first = fc.submit('dest', lambda: sent.append(0), event_loop)
+    dropped = fc.submit('dest', lambda: sent.append(1), event_loop)
+    last = fc.submit('dest', lambda: sent.append(2), event_loop)
+    assert dropped.done() and dropped.result() is None
+    await asyncio.gather(first, last)
+    assert sent == [0, 2]
+
+
+def test_flow_control_error(event_loop):
+    fc = flow.FlowController(window=1, policy=flow.ERROR)
+    fc.submit('dest', lambda: None, event_loop)
+    with pytest.raises(flow.FlowControlError):
+        fc.submit('dest', lambda: None, event_loop)
+
+
+@pytest.mark.asyncio
+async def test_flow_control_infra_lane_first(event_loop):
+    fc = flow.FlowController(window=1, max_queue=2, policy=flow.ERROR)
+    sent = []
+    ack = event_loop.create_future()
+    fc.submit('dest', lambda: ack, event_loop)
+    with pytest.raises(flow.FlowControlError):
+        fc.submit('dest', lambda: sent.append('app'), event_loop)
+    infra = fc.submit('dest', lambda: sent.append('infra'), event_loop,
+                      lane=flow.INFRA)
+    ack.set_result(None)
+    await infra
+    assert sent == ['infra']
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_lanes(event_loop):
+    dispatcher = flow.Dispatcher(batch=2)
+    handled = []
+
+    def handle(name):
+        handled.append(name)
+        if name == 'app1':
+            # an infrastructure message arrives while the burst is handled
+            dispatcher.dispatch(flow.INFRA, lambda: handle('infra2'),
+                                event_loop)
+        return name
+
+    futs = [dispatcher.dispatch(flow.APP, lambda i=i: handle('app%d' % i),
+                                event_loop) for i in range(4)]
+    assert dispatcher.dispatch(flow.INFRA, lambda: handle('infra1'),
+                               event_loop) == 'infra1'
+    assert handled == ['infra1']
+    assert await asyncio.gather(*futs) == ['app0', 'app1', 'app2', 'app3']
+    assert handled == ['infra1', 'app0', 'app1', 'infra2', 'app2', 'app3']
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_barrier(event_loop, caplog):
+    dispatcher = flow.Dispatcher()
+    handled = []
+    node, other = object(), object()
+
+    def handle(name):
+        handled.append(name)
+        if name == 'fail':
+            raise RuntimeError('boom')
+
+    for name, key in (('a1', node), ('o1', other), ('fail', node)):
+        dispatcher.dispatch(flow.APP, lambda n=name: handle(n), event_loop,
+                            key=key)
+    # the stop of node doesn't overtake its application messages
+    dispatcher.dispatch(flow.INFRA, lambda: handle('stop'), event_loop,
+                        key=node, barrier=True)
+    assert handled == ['a1', 'fail', 'stop']
+    for _ in range(3):
+        await asyncio.sleep(0)
+    assert handled == ['a1', 'fail', 'stop', 'o1']
+    assert 'Error in a message handler' in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_pending_replies(event_loop):
+    pending = PendingReplies(maxsize=2)
+    cid1, fut1 = pending.add(event_loop)
+    cid2, fut2 = pending.add(event_loop)
+    assert cid1 != cid2
+    with pytest.raises(MessageError):
+        pending.add(event_loop)
+
+    reply = Message.read(msg_type='reply', msg_correlation=cid1,
+                         msg_details={'answer': 42})
+    assert pending.resolve(reply)
+    assert (await fut1).details == {'answer': 42}
+    # a late or duplicated reply is ignored
+    assert not pending.resolve(reply)
+
+    pending.resolve(Message.read(msg_type='reply', msg_correlation=cid2,
+                                 msg_error='boom', msg_details={}))
+    with pytest.raises(MessageError):
+        await fut2
+    assert len(pending) == 0
+
+
+@pytest.mark.asyncio
+async def test_chunked_details(event_loop):
+    payload = bytes(range(256)) * 40
+    details, blobs, pieces = chunks.split(
+        {'data': memoryview(payload), 'small': bytearray(b'abc'), 'n': 1},
+        1000)
+    assert blobs == ['data']
+    assert details['small'] == b'abc' and details['n'] == 1
+    assert details['data']['size'] == len(payload)
+    assert len(pieces) == details['data']['chunks'] == 11
+
+    reassembler = chunks.Reassembler()
+    # pieces can arrive more than once, one time for each handler
+    for p in pieces + pieces:
+        content = chunks.piece(*p)
+        assert content['msg_type'] == chunks.CHUNK_TYPE
+        reassembler.add(content['msg_chunk'], event_loop)
+    msg = Message.read(msg_type='blob', msg_details=details, msg_blobs=blobs)
+    assert reassembler.resolve(msg, event_loop)
+    assert msg.details['data'] == payload
+    assert len(reassembler) == 0
+
+    # a missing piece discards the message
+    details, blobs, pieces = chunks.split({'data': payload}, 1000)
+    for p in pieces[1:]:
+        reassembler.add(chunks.piece(*p)['msg_chunk'], event_loop)
+    msg = Message.read(msg_type='blob', msg_details=details, msg_blobs=blobs)
+    assert not reassembler.resolve(msg, event_loop)
+
+    assert chunks.split({'n': 1}, 1000) is None
+
+
+@pytest.mark.asyncio
+async def test_chunked_send_is_one_unit(event_loop):
+    fc = flow.FlowController(window=1, policy=flow.ERROR)
+    details, blobs, pieces = chunks.split({'data': b'x' * 2500}, 1000)
+    sent = []
+
+    async def notify(**kwargs):
+        await asyncio.sleep(0)
+        sent.append(kwargs['msg_type'])
+        return len(sent)
+
+    fut = fc.submit('dest', lambda: _notify_chunked(
+        notify, pieces, {'msg_type': 'blob', 'msg_details': details}),
+                    event_loop)
+    # the whole payload takes a single place in the window
+    with pytest.raises(flow.FlowControlError):
+        fc.submit('dest', lambda: None, event_loop)
+    assert await fut == 4
+    assert sent == [chunks.CHUNK_TYPE] * 3 + ['blob']
+
+    # a failed piece stops the send
+    sent.clear()
+
+    def failing(**kwargs):
+        if len(sent) == 1:
+            raise ValueError('boom')
+        sent.append(kwargs['msg_type'])
+
+    with pytest.raises(ValueError):
+        await fc.submit('dest', lambda: _notify_chunked(
+            failing, pieces, {'msg_type': 'blob', 'msg_details': details}),
+                        event_loop)
+    assert sent == [chunks.CHUNK_TYPE]
+
+
+def test_compressed_details():
+    compressor = compression.Compressor('zlib', threshold=100)
+    details = {'locations': {'loc{}'.format(i): {'uri': 'raccoon.test.loc',
+                                                 'role': None}
+                             for i in range(50)}}
+    encoded = compressor.encode(details)
+    assert encoded[compression.MARKER] == 'zlib'
+    assert len(encoded['data']) < len(repr(details))
+    msg = Message.read(msg_type='peer_start', msg_details=encoded)
+    assert msg.details == details
+
+    # short values aren't compressed
+    assert compressor.encode({'a': 1}) == {'a': 1}
+    assert compressor.encode(42) == 42
+    assert compression.estimate_size({'a': [1, 'bc']}, 100) < 100
+    assert compression.estimate_size(['x' * 10] * 1000, 100) >= 100
+    assert compression.decode({'a': 1}) == {'a': 1}
+    assert 'zlib' in compression.codec_names()
+    # results that just look like compressed ones are left alone
+    for value in ({compression.MARKER: 'zlib', 'data': 'text'},
+                  {compression.MARKER: 'unknown', 'data': b'x'},
+                  {compression.MARKER: [1], 'data': b'x'}):
+        assert compression.decode(value) == value
+    with pytest.raises(TypeError):
+        compression.Codec()
+
+
+@pytest.mark.asyncio
+async def test_compression_negotiation(event_loop):
+    compressor = compression.Compressor('zlib', threshold=10)
+    big = {'text': 'a' * 100}
+
+    def endpoint(details=None):
+        return big
+
+    async def async_endpoint(details=None):
+        return big
+
+    wrapped = compression.wrap(endpoint, compressor)
+    # callers that don't accept compression get the plain result
+    assert wrapped(details=None) == big
+    encoded = wrapped(**{compression.ACCEPT_KWARG: ['zlib']})
+    assert encoded[compression.MARKER] == 'zlib'
+    assert compression.decode(encoded) == big
+    assert wrapped(**{compression.ACCEPT_KWARG: ['other']}) == big
+    wrapped = compression.wrap(async_endpoint, compressor)
+    encoded = await wrapped(**{compression.ACCEPT_KWARG: ['zlib']})
+    assert compression.decode(encoded) == big
+    # without a compressor the argument is just removed
+    assert compression.wrap(endpoint)(**{compression.ACCEPT_KWARG:
+                                         ['zlib']}) == big
+
+    # the destinations advertise the codecs in the messages they send
+    assert not compression.accepts('raccoon.test.peer', 'zlib')
+    Message.read(msg_type='foo', msg_details={},
+                 msg_source={'uri': 'raccoon.test.peer',
+                             'system': {'codecs': ['zlib']}})
+    assert compression.accepts('raccoon.test.peer', 'zlib')
+    Message.read(msg_type='foo', msg_details={},
+                 msg_source={'uri': 'raccoon.test.browser'})
+    assert not compression.accepts('raccoon.test.browser', 'zlib')
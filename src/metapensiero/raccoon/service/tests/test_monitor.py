@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# :Project:  metapensiero.raccoon.service -- loop monitor tests
+# :Created:  lun 19 ott 2026 12:10:44 CEST
+# :Author:   Alberto Berti <alberto@metapensiero.it>
+# :License:  GNU General Public License version 3 or later
+#
+
+import asyncio
+import time
+
+import pytest
+
+from metapensiero.raccoon.service import metrics, monitor
+
+
+@pytest.mark.asyncio
+async def test_loop_stall_report(event_loop):
+    reports = []
+    mon = monitor.LoopMonitor(event_loop, interval=0.02, stall_threshold=0.1,
+                              on_stall=reports.append)
+    mon.start()
+    assert monitor.is_active()
+
+    async def blocking_handler():
+        time.sleep(0.4)
+
+    try:
+        await asyncio.sleep(0.05)
+        await monitor.track('crunch', blocking_handler)
+        await asyncio.sleep(0.05)
+    finally:
+        mon.stop()
+    assert not monitor.is_active()
+    assert len(reports) == 1
+    assert reports[0]['message_type'] == 'crunch'
+    assert 'blocking_handler' in reports[0]['stack']
+    assert metrics.get('loop.lag').max >= 0.3
@@ -5,11 +5,15 @@
 # :License:  GNU General Public License version 3 or later
 #
 
+import asyncio
+
 import pytest
 from metapensiero.signal import handler
 from metapensiero.raccoon.node import Path
 
 from metapensiero.raccoon.node.wamp import call
+from metapensiero.raccoon.service.message import (Message, MessageError,
+                                                  on_message)
 from metapensiero.raccoon.service.service import ApplicationService
 from metapensiero.raccoon.service.session import SessionMember, bootstrap_session
 from metapensiero.raccoon.service.pairable import PairableNode
@@ -91,3 +95,51 @@ async def test_role_paths(connection1, connection2, event_loop,
             foo.node_context.from_context.node_path == tc.node_path)
     await s1.node_unbind()
     await tc.node_unbind()
+
+
+@pytest.mark.asyncio
+async def test_request_reply(connection1, connection2, events):
+
+    events.define('app_started')
+
+    class MyAppService(ApplicationService):
+
+        @handler('on_start')
+        def _set_started_event(self):
+            events['app_started'].set()
+
+    class MyApplication(SessionMember):
+
+        @on_message('question')
+        async def handle_question(self, msg):
+            await msg.reply(self, answer=msg.details['n'] * 2)
+
+        @on_message('bad_question')
+        async def handle_bad_question(self, msg):
+            await msg.reply(self, error='no answer')
+
+    class TestClient(SessionMember):
+        pass
+
+    s1 = MyAppService(MyApplication, Path('raccoon.replyservice'))
+    await s1.set_connection(connection1)
+    await events.wait_for(events.app_started, 5)
+    tc = await bootstrap_session(connection2.new_context(),
+                                 'raccoon.replyservice', TestClient, 'test')
+    server = tc.remote('@server')
+
+    reply = await Message(tc, 'question', n=21).request(server)
+    assert reply.type == 'reply'
+    assert reply.details == {'answer': 42}
+    with pytest.raises(MessageError):
+        await Message(tc, 'bad_question').request(server)
+    # nobody answers
+    with pytest.raises(asyncio.TimeoutError):
+        await Message(tc, 'unknown').request(server, timeout=0.2)
+    assert len(Message.pending) == 0
+    # the replies are received by the pairable nodes only
+    with pytest.raises(MessageError):
+        await Message(s1, 'question', n=1).request(server)
+
+    await s1.node_unbind()
+    await tc.node_unbind()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# :Project:  metapensiero.raccoon.service -- remote nodes tests
+# :Created:  mar 20 ott 2026 19:02:17 CEST
+# :Author:   Alberto Berti <alberto@metapensiero.it>
+# :License:  GNU General Public License version 3 or later
+#
+
+import asyncio
+import time
+
+import pytest
+
+from metapensiero import reactive
+from metapensiero.raccoon.node.wamp import call
+from metapensiero.raccoon.service import metrics, remote
+from metapensiero.raccoon.service.cache import CallCache
+from metapensiero.raccoon.service.node import WAMPNode, when_node
+from metapensiero.raccoon.service.pipeline import Pipeline
+
+
+class Exported(WAMPNode):
+    node_export_changes = True
+    ready = False
+
+
+@pytest.mark.asyncio
+async def test_remote_dependency(connection1, connection2, setup_reactive):
+    exported = Exported()
+    await exported.node_bind('raccoon.test.exported',
+                             connection1.new_context())
+    client = WAMPNode()
+    await client.node_bind('raccoon.test.watcher', connection2.new_context())
+    proxy = client.remote('raccoon.test.exported')
+
+    calls = 0
+
+    def depend_on_proxy(comp):
+        nonlocal calls
+        remote.depend(proxy)
+        calls += 1
+
+    computation = reactive.get_tracker().reactive(depend_on_proxy)
+    assert calls == 1
+    locations = remote.locations(connection2.session)
+    await locations.subscription('raccoon.test.exported')
+    await asyncio.sleep(0.05)
+    # invalidated once when the subscription is ready, the changes published
+    # before are lost
+    assert calls == 2 or computation.invalidated
+    received = metrics.counter('remote.changes.received')
+    before = received.value
+
+    # many changes in the same loop iteration travel in a single event
+    for _ in range(5):
+        exported.node_changed()
+    for _ in range(20):
+        await asyncio.sleep(0.05)
+        if received.value > before:
+            break
+    await asyncio.sleep(0.05)
+    assert received.value == before + 1
+    assert calls == 3 or computation.invalidated
+
+    # when_node() accepts proxies, the condition reads the state of the
+    # remote node and it's evaluated again when it changes
+    cond = when_node(lambda p: exported.ready, proxy)
+    await asyncio.sleep(0.05)
+    assert not cond.value
+    exported.ready = True
+    exported.node_changed()
+    for _ in range(20):
+        await asyncio.sleep(0.05)
+        if cond.value:
+            break
+    assert cond.value
+
+    # teardown
+    cond.stop()
+    computation.stop()
+    await locations.close()
+    await client.node_unbind()
+    await exported.node_unbind()
+
+
+@pytest.mark.asyncio
+async def test_remote_release(connection1, connection2, setup_reactive):
+    exported = Exported()
+    await exported.node_bind('raccoon.test.released',
+                             connection1.new_context())
+    client = WAMPNode()
+    await client.node_bind('raccoon.test.releaser', connection2.new_context())
+    proxy = client.remote('raccoon.test.released')
+    locations = remote.locations(connection2.session)
+    locations.release_delay = 0.1
+
+    computation = reactive.get_tracker().reactive(
+        lambda comp: remote.depend(proxy))
+    await locations.subscription('raccoon.test.released')
+    await asyncio.sleep(0.3)
+    # still watched, the computation runs again after the invalidation
+    assert 'raccoon.test.released' in locations._subscriptions
+
+    computation.stop()
+    await asyncio.sleep(0.3)
+    assert 'raccoon.test.released' not in locations._subscriptions
+    assert 'raccoon.test.released' not in locations._dependencies
+
+    # teardown
+    await locations.close()
+    await client.node_unbind()
+    await exported.node_unbind()
+
+
+@pytest.mark.asyncio
+async def test_call_cache(connection1, connection2):
+    exported = Exported()
+    await exported.node_bind('raccoon.test.cached', connection1.new_context())
+    client = WAMPNode()
+    await client.node_bind('raccoon.test.cacher', connection2.new_context())
+    cache = CallCache(connection2.session, ttl=60)
+    proxy = cache.proxy(client.remote('raccoon.test.cached'))
+
+    info = await proxy.node_info()
+    assert info['uri'] == 'raccoon.test.cached'
+    assert await proxy.node_info() == info
+    assert (cache.hits, cache.misses) == (1, 1)
+    # the first miss waited for the subscription to the changes
+    assert remote.locations(connection2.session).subscription(
+        'raccoon.test.cached').done()
+
+    # a change of the remote node drops its entries
+    exported.node_changed()
+    for _ in range(20):
+        await asyncio.sleep(0.05)
+        if not len(cache):
+            break
+    assert len(cache) == 0
+    await proxy.node_info()
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert cache.hit_rate == 1 / 3
+
+    # teardown
+    cache.close()
+    await client.node_unbind()
+    await exported.node_unbind()
+
+
+@pytest.mark.asyncio
+async def test_pipeline(connection1, connection2):
+
+    class Slow(WAMPNode):
+
+        @call
+        async def echo(self, value, details):
+            await asyncio.sleep(0.1)
+            return value
+
+    server = Slow()
+    await server.node_bind('raccoon.test.pipelined', connection1.new_context())
+    client = WAMPNode()
+    await client.node_bind('raccoon.test.pipeliner',
+                           connection2.new_context())
+    proxy = client.remote('raccoon.test.pipelined')
+
+    start = time.monotonic()
+    async with Pipeline() as p:
+        futures = [p.call(proxy.echo, i) for i in range(10)]
+    assert [f.result() for f in futures] == list(range(10))
+    # the calls overlap
+    assert time.monotonic() - start < 0.5
+
+    p = Pipeline(concurrency=2)
+    for i in range(4):
+        p.call(proxy.echo, i)
+    assert sorted([await f for f in p.as_completed()]) == [0, 1, 2, 3]
+
+    # teardown
+    await client.node_unbind()
+    await server.node_unbind()
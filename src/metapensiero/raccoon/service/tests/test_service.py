@@ -5,14 +5,21 @@
 # :License:  GNU General Public License version 3 or later
 #
 
+import asyncio
+
 import pytest
 from metapensiero import reactive
 from metapensiero.signal import Signal, handler
 from metapensiero.raccoon.node import Path
 
 from metapensiero.raccoon.node.wamp import call
+from metapensiero.raccoon.service.node import WAMPNode
 from metapensiero.raccoon.service.service import BaseService, ApplicationService
-from metapensiero.raccoon.service.session import SessionMember, bootstrap_session
+from metapensiero.raccoon.service.session import (SessionMember, SessionRoot,
+                                                  bootstrap_session)
+from metapensiero.raccoon.service.snapshot import MemoryStore
+from metapensiero.raccoon.service.user import User
+from metapensiero.raccoon.service.wamp.session import RegistrationError
 
 
 @pytest.mark.asyncio
@@ -36,6 +43,95 @@ async def test_start_service(connection1, events, event_loop):
     await my.node_unbind()
 
 
+@pytest.mark.asyncio
+async def test_service_reconnect(connection1, connection2, events):
+
+    events.define('started', 'reconnected')
+
+    class MyService(BaseService):
+
+        @handler('on_start')
+        def _set_started_event(self):
+            events.started.set()
+
+        @call
+        def ping(self, details):
+            return 'pong'
+
+    connection1.reconnect_delay = 0.1
+    my = MyService('raccoon.test.reconnecting')
+    await my.set_connection(connection1)
+    await events.wait_for(events.started, 3)
+    old_session = connection1.session
+
+    async def on_reconnect(session, session_details, **kwargs):
+        events.reconnected.set()
+
+    await connection1.on_connect.connect(on_reconnect)
+    events.reconnected.clear()
+
+    # simulate the loss of the session
+    await old_session.leave()
+    await events.wait_for(events.reconnected, 5)
+    assert connection1.session is not old_session
+    assert my.node_context.wamp_session is connection1.session
+    result = await connection2.session.call('raccoon.test.reconnecting.ping')
+    assert result == 'pong'
+
+    # teardown
+    await my.node_unbind()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_bind_rollback(connection1, connection2):
+
+    class Endpoints(WAMPNode):
+
+        @call
+        def one(self, details):
+            return 1
+
+        @call
+        def two(self, details):
+            return 2
+
+        @call
+        def three(self, details):
+            return 3
+
+    async def taken(details):
+        pass
+
+    # a clashing procedure registered by another session
+    clash = await connection2.session.register(
+        taken, 'raccoon.test.concurrent.two')
+    node = Endpoints()
+    # bound at the same time on the same session, outside of the batch
+    other = Endpoints()
+    results = await asyncio.gather(
+        node.node_bind_concurrent('raccoon.test.concurrent',
+                                  connection1.new_context()),
+        other.node_bind('raccoon.test.unrelated', connection1.new_context()),
+        return_exceptions=True)
+    assert isinstance(results[0], RegistrationError)
+    assert results[1] is None
+    assert not node.node_registered
+    # the rollback didn't touch the other node
+    assert other.node_registered
+    assert await connection2.session.call('raccoon.test.unrelated.one') == 1
+    await other.node_unbind()
+    assert not any(str(reg.procedure).startswith('raccoon.test.concurrent')
+                   for reg in connection1.session._registrations_log)
+
+    # teardown
+    await clash.unregister()
+    await node.node_bind_concurrent('raccoon.test.concurrent',
+                                    connection1.new_context())
+    result = await connection2.session.call('raccoon.test.concurrent.three')
+    assert result == 3
+    await node.node_unbind()
+
+
 @pytest.mark.asyncio
 async def test_double_services(connection1, connection2, event_loop, events):
 
@@ -145,3 +241,193 @@ async def test_application_service(connection1, connection2, event_loop,
     await s1.node_unbind()
     await tc.node_unbind()
     await tc2.node_unbind()
+
+
+@pytest.mark.asyncio
+async def test_prefix_registration(connection1, connection2, events):
+
+    events.define('app_started')
+
+    class PrefixSessionRoot(SessionRoot):
+        node_prefix_registration = True
+
+    class MyAppService(ApplicationService):
+
+        SESSION_CLASS = PrefixSessionRoot
+
+        @handler('on_start')
+        def _set_started_event(self):
+            events['app_started'].set()
+
+    class MyApplication(SessionMember):
+
+        @call
+        def echo(self, value, details):
+            return value
+
+    class TestClient(SessionMember):
+        pass
+
+    s1 = MyAppService(MyApplication, Path('raccoon.prefixservice'))
+    await s1.set_connection(connection1)
+    await events.wait_for(events.app_started, 5)
+    tc = await bootstrap_session(connection2.new_context(),
+                                 'raccoon.prefixservice', TestClient, 'test')
+    session_root = next(iter(s1._sessions.values()))
+    wsession = connection1.session
+    session_path = str(session_root.node_path)
+    assert session_path + '.' in wsession._routes
+    assert session_path + '.server.echo' in wsession._local_endpoints
+    assert await tc.remote('@server').echo('foo') == 'foo'
+
+    # teardown
+    await s1.node_unbind()
+    await tc.node_unbind()
+    assert session_path + '.' not in wsession._routes
+    assert not any(p.startswith(session_path)
+                   for p in wsession._local_endpoints)
+
+
+@pytest.mark.asyncio
+async def test_session_restore(connection1, connection2, events):
+
+    events.define('app_started')
+
+    class MyAppService(ApplicationService):
+
+        @handler('on_start')
+        def _set_started_event(self):
+            events['app_started'].set()
+
+    class MyApplication(SessionMember):
+
+        def __init__(self, *maps, node_context=None):
+            super().__init__(*maps, node_context=node_context)
+            self._counter = 0
+
+        def session_state(self):
+            return {'counter': self._counter}
+
+        async def restore_session_state(self, state):
+            self._counter = state['counter']
+
+        @call
+        def inc_counter(self, details):
+            self._counter += 1
+            self.session_state_changed()
+            return self._counter
+
+    class TestClient(SessionMember):
+        pass
+
+    store = MemoryStore()
+    s1 = MyAppService(MyApplication, Path('raccoon.restoreservice'),
+                      store=store)
+    await s1.set_connection(connection1)
+    await events.wait_for(events.app_started, 5)
+    tc = await bootstrap_session(connection2.new_context(),
+                                 'raccoon.restoreservice', TestClient, 'test')
+    session_id = tc.node_context.session_id
+    session_root = s1._sessions[session_id]
+    await session_root.set_user(User(1, 'jdoe', 'John Doe', 'test'))
+    assert await tc.remote('@server').inc_counter() == 1
+    assert await tc.remote('@server').inc_counter() == 2
+    # the snapshots are written in a thread
+    for _ in range(20):
+        snapshot, = store.load('raccoon.restoreservice')
+        if snapshot['member'] == {'counter': 2}:
+            break
+        await asyncio.sleep(0.05)
+    assert snapshot['id'] == session_id
+    assert snapshot['status'] == 'active'
+    assert snapshot['user']['login'] == 'jdoe'
+    assert snapshot['member'] == {'counter': 2}
+    assert set(snapshot['peers']) == {'test', session_root.local_location_name}
+
+    # simulate a restart of the service
+    await tc.node_unbind()
+    await s1.node_unbind()
+    events.app_started.clear()
+    s2 = MyAppService(MyApplication, Path('raccoon.restoreservice'),
+                      store=store)
+    await s2.set_connection(connection1)
+    await events.wait_for(events.app_started, 5)
+    restored = s2._sessions[session_id]
+    assert restored.node_context.user.login == 'jdoe'
+    tc = await bootstrap_session(connection2.new_context(),
+                                 'raccoon.restoreservice', TestClient, 'test',
+                                 session_id=session_id)
+    assert tc.node_context.session_id == session_id
+    assert await tc.remote('@server').inc_counter() == 3
+    assert s2._next_session_id() != session_id
+
+    # teardown
+    await tc.node_unbind()
+    await s2.node_unbind()
+
+
+@pytest.mark.asyncio
+async def test_shared_users(connection1, connection2, events):
+
+    events.define('app_started')
+
+    class MyAppService(ApplicationService):
+
+        @handler('on_start')
+        def _set_started_event(self):
+            events['app_started'].set()
+
+    class MyApplication(SessionMember):
+
+        @call
+        def user_name(self, details):
+            return self.node_context.user.full_name
+
+    class TestClient(SessionMember):
+        pass
+
+    s1 = MyAppService(MyApplication, Path('raccoon.usersservice'))
+    await s1.set_connection(connection1)
+    await events.wait_for(events.app_started, 5)
+    clients = []
+    for _ in range(3):
+        clients.append(await bootstrap_session(
+            connection2.new_context(), 'raccoon.usersservice', TestClient,
+            'test'))
+    roots = [s1._sessions[c.node_context.session_id] for c in clients]
+    for root in roots:
+        await root.set_user(User(42, 'jdoe', 'John Doe', 'test'))
+    user = roots[0].user
+    assert all(r.user is user for r in roots)
+    assert s1.users.refcount(42) == 3
+    assert str(user.node_path) == 'raccoon.usersservice.users.42'
+    assert 'user' not in roots[0]
+
+    names = []
+
+    def depend_on_user(comp):
+        user.node_depend()
+        names.append(user.full_name)
+
+    computation = reactive.get_tracker().reactive(depend_on_user)
+    assert names == ['John Doe']
+    user.update(full_name='Johnny Doe')
+    for _ in range(3):
+        await asyncio.sleep(0)
+    # the change reaches the computations of the shared node
+    assert names == ['John Doe', 'Johnny Doe']
+    computation.stop()
+    for client in clients:
+        assert await client.remote('@server').user_name() == 'Johnny Doe'
+
+    await roots[0].node_unbind()
+    assert s1.users.refcount(42) == 2
+    assert user.node_path
+    await roots[1].node_unbind()
+    await roots[2].node_unbind()
+    assert 42 not in s1.users
+
+    # teardown
+    for client in clients:
+        await client.node_unbind()
+    await s1.node_unbind()
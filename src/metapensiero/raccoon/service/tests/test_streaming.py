@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# :Project:  metapensiero.raccoon.service -- progressive results tests
+# :Created:  mar 20 ott 2026 21:25:51 CEST
+# :Author:   Alberto Berti <alberto@metapensiero.it>
+# :License:  GNU General Public License version 3 or later
+#
+
+import asyncio
+
+import pytest
+
+from metapensiero.raccoon.node.wamp import call
+from metapensiero.raccoon.service.node import WAMPNode
+from metapensiero.raccoon.service.wamp.streaming import drain, stream
+
+
+class Streaming(WAMPNode):
+
+    @call
+    async def count(self, n, details):
+        for i in range(n):
+            yield {'i': i}
+
+    @call
+    def single(self, details):
+        return 'one'
+
+
+@pytest.mark.asyncio
+async def test_progressive_results(connection1, connection2):
+    server = Streaming()
+    await server.node_bind('raccoon.test.streaming', connection1.new_context())
+    client = WAMPNode()
+    await client.node_bind('raccoon.test.streamer', connection2.new_context())
+    proxy = client.remote('raccoon.test.streaming')
+
+    chunks = []
+    async for chunk in stream(proxy, 'count', 5):
+        chunks.append(chunk)
+    assert chunks == [{'i': i} for i in range(5)]
+
+    # without progress the chunks are collected
+    assert await proxy.count(3) == [{'i': 0}, {'i': 1}, {'i': 2}]
+
+    # plain endpoints give a single chunk
+    chunks = []
+    async for chunk in stream(proxy, 'single'):
+        chunks.append(chunk)
+    assert chunks == ['one']
+
+    # teardown
+    await client.node_unbind()
+    await server.node_unbind()
+
+
+class FakeTransport:
+
+    def __init__(self, sizes):
+        self.sizes = list(sizes)
+
+    def get_write_buffer_limits(self):
+        return 16, 64
+
+    def get_write_buffer_size(self):
+        return self.sizes.pop(0) if len(self.sizes) > 1 else self.sizes[0]
+
+    def is_closing(self):
+        return False
+
+
+class FakeProtocol:
+
+    def __init__(self, transport):
+        self.transport = transport
+
+
+class FakeSession:
+
+    def __init__(self, transport):
+        self._transport = FakeProtocol(transport)
+
+
+@pytest.mark.asyncio
+async def test_drain(event_loop):
+    # waits until the buffer is below the high-water mark
+    transport = FakeTransport([100, 80, 10])
+    await asyncio.wait_for(drain(FakeSession(transport)), 1)
+    assert transport.sizes == [10]
+    # sessions without a transport just yield to the loop
+    await drain(None)
+    await drain(FakeSession(None))
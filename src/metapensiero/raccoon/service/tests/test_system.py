@@ -5,11 +5,14 @@
 # :License: GNU General Public License version 3 or later
 #
 
+import asyncio
+
 import pytest
 
 from metapensiero import reactive
 from metapensiero.raccoon.node import NodeContext
-from metapensiero.raccoon.service import system, Node
+from metapensiero.raccoon.service import (metrics, system, Node, NodeSetWatcher,
+                                         when_nodes)
 
 
 @pytest.mark.asyncio
@@ -39,3 +42,107 @@ async def test_system_location(init_node_system, event_loop, setup_reactive):
     assert len(system.NODE_LOCATION) == 1
 
     assert computation.invalidated or calls == 2
+
+
+@pytest.mark.asyncio
+async def test_location_coalesced_changes(init_node_system, event_loop,
+                                          setup_reactive):
+    n = Node()
+    await n.node_bind('foo.coalesced', NodeContext(loop=event_loop))
+    assert n.node_location._dependency is None
+
+    calls = 0
+
+    def depend_on_n(comp):
+        nonlocal calls
+        if n.node_path:
+            n.node_depend()
+        calls += 1
+
+    tracker = reactive.get_tracker()
+    computation = tracker.reactive(depend_on_n)
+    suppressed = metrics.counter('location.changes.suppressed')
+    before = suppressed.value
+
+    for _ in range(5):
+        n.node_changed()
+    assert not computation.invalidated and calls == 1
+    assert suppressed.value == before + 4
+
+    for _ in range(3):
+        await asyncio.sleep(0)
+    assert computation.invalidated or calls == 2
+    assert calls <= 2
+
+    await n.node_unbind()
+
+
+@pytest.mark.asyncio
+async def test_node_set_watcher(init_node_system, event_loop, setup_reactive):
+    nodes = []
+    for i in range(3):
+        n = Node()
+        n.ready = False
+        await n.node_bind('foo.watched.n{}'.format(i),
+                          NodeContext(loop=event_loop))
+        nodes.append(n)
+
+    changes = []
+    watcher = NodeSetWatcher(lambda n: n.ready, nodes,
+                             on_change=lambda n, r: changes.append((n, r)))
+    assert watcher.evaluations == 3
+    assert watcher.count() == 0 and not watcher.any()
+
+    nodes[1].ready = True
+    nodes[1].node_changed()
+    for _ in range(3):
+        await asyncio.sleep(0)
+    # only the changed node is evaluated again
+    assert watcher.evaluations == 4
+    assert changes == [(nodes[1], True)]
+    assert watcher.count() == 1 and watcher.any() and not watcher.all()
+
+    for n in nodes:
+        n.ready = True
+        n.node_changed()
+    for _ in range(3):
+        await asyncio.sleep(0)
+    assert watcher.all()
+    assert watcher.matching() == set(nodes)
+
+    await nodes[0].node_unbind()
+    for _ in range(3):
+        await asyncio.sleep(0)
+    assert len(watcher) == 2 and watcher.all()
+
+    for n in nodes[1:]:
+        await n.node_unbind()
+
+
+@pytest.mark.asyncio
+async def test_when_nodes_stop(init_node_system, event_loop, setup_reactive):
+    nodes = []
+    for i in range(3):
+        n = Node()
+        n.ready = False
+        await n.node_bind('foo.stopped.n{}'.format(i),
+                          NodeContext(loop=event_loop))
+        nodes.append(n)
+
+    cond = when_nodes(lambda n: n.ready, nodes)
+    watcher = cond.watcher
+    assert len(watcher) == 3 and watcher.evaluations == 3
+
+    cond.stop()
+    assert len(watcher) == 0 and watcher.total() == 0
+
+    # the nodes are not watched anymore
+    for n in nodes:
+        n.ready = True
+        n.node_changed()
+    for _ in range(3):
+        await asyncio.sleep(0)
+    assert watcher.evaluations == 3
+
+    for n in nodes:
+        await n.node_unbind()
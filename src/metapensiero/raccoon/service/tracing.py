@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+# :Project:   metapensiero.raccoon.service -- message tracing
+# :Created:   lun 19 ott 2026 09:42:17 CEST
+# :Author:    Alberto Berti <alberto@metapensiero.it>
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2026 Alberto Berti
+#
+
+"""Optional end-to-end tracing of :class:`~.message.Message` instances.
+
+When a :class:`Tracer` is installed with :func:`set_tracer`, every sent
+message carries a small *trace context* (trace id, span id and the send
+timestamp) which is used on the receiving side to record the latency of the
+dispatch and the duration of the handler. Spans are handed to an *exporter*,
+which can be anything exposing an ``export(span)`` method.
+"""
+
+import asyncio
+from collections import deque
+from functools import partial
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _new_id():
+    return os.urandom(8).hex()
+
+
+class Span:
+    """A timed operation.
+
+    :param str name: the name of the operation
+    :param str trace_id: the id of the trace this span belongs to
+    :param str parent_id: the id of the parent span, if any
+    :param float start: an optional start time, in seconds since the epoch
+    :param attributes: misc details about the operation
+    """
+
+    def __init__(self, name, trace_id=None, parent_id=None, start=None,
+                 **attributes):
+        self.name = name
+        self.trace_id = trace_id or _new_id()
+        self.span_id = _new_id()
+        self.parent_id = parent_id
+        self.start = time.time() if start is None else start
+        self.end = None
+        self.attributes = attributes
+        self.error = None
+
+    def __repr__(self):
+        return "<{cls} '{name}', trace: '{trace}', duration: {dur}>".format(
+            cls=self.__class__.__name__, name=self.name, trace=self.trace_id,
+            dur=self.duration)
+
+    @property
+    def duration(self):
+        """The duration of the span in seconds or ``None`` if the span is
+        still open."""
+        if self.end is not None:
+            return self.end - self.start
+
+    def context(self):
+        """Return the trace context to be carried by a message."""
+        return {'trace_id': self.trace_id, 'span_id': self.span_id,
+                'sent': time.time()}
+
+    def serialize(self):
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'end': self.end,
+            'duration': self.duration,
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+
+class InMemoryExporter:
+    """Keep the last `maxlen` finished spans in memory, useful for tests and
+    for introspection from a debugging console.
+    """
+
+    def __init__(self, maxlen=10000):
+        self.spans = deque(maxlen=maxlen)
+
+    def export(self, span):
+        self.spans.append(span)
+
+    def clear(self):
+        self.spans.clear()
+
+    def find(self, trace_id):
+        """Return all the spans belonging to the given trace."""
+        return [s for s in self.spans if s.trace_id == trace_id]
+
+
+class FileExporter:
+    """Append finished spans to a file, one JSON document per line.
+
+    :param str filename: the file to write to
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._file = open(filename, 'a', encoding='utf-8')
+
+    def export(self, span):
+        line = json.dumps(span.serialize(), default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class Tracer:
+    """Create spans and hand them to the `exporter` when finished.
+
+    :param exporter: an object with an ``export(span)`` method
+    """
+
+    def __init__(self, exporter):
+        self.exporter = exporter
+
+    def start_span(self, name, trace_id=None, parent_id=None, start=None,
+                   **attributes):
+        return Span(name, trace_id, parent_id, start, **attributes)
+
+    def finish(self, span, end=None, error=None):
+        span.end = time.time() if end is None else end
+        if error is not None:
+            span.error = repr(error)
+        try:
+            self.exporter.export(span)
+        except Exception:
+            logger.exception("Error while exporting span %r", span)
+
+
+_tracer = None
+
+
+def get_tracer():
+    """Return the installed :class:`Tracer` or ``None`` if tracing is
+    disabled."""
+    return _tracer
+
+
+def set_tracer(tracer):
+    """Install a :class:`Tracer`. Passing ``None`` disables tracing."""
+    global _tracer
+    _tracer = tracer
+
+
+def _source_uri(msg):
+    src = msg.source
+    return src.get('uri') if isinstance(src, dict) else src
+
+
+def trace_send(msg, send):
+    """Execute `send` (a callable without arguments) within a
+    ``message.send`` span. The trace context of the span is stored on the
+    `msg` before calling `send` so that it gets serialized with it. When
+    `send` returns a future the span ends with it, recording its error."""
+    tracer = _tracer
+    if tracer is None:
+        return send()
+    span = tracer.start_span('message.send', type=msg.type,
+                             source=_source_uri(msg), dest=msg.dest)
+    msg.trace = span.context()
+    try:
+        result = send()
+    except Exception as e:
+        tracer.finish(span, error=e)
+        raise
+    if asyncio.isfuture(result):
+        result.add_done_callback(partial(_finish_send, tracer, span))
+    else:
+        tracer.finish(span)
+    return result
+
+
+def _finish_send(tracer, span, fut):
+    if fut.cancelled():
+        tracer.finish(span, error=asyncio.CancelledError())
+    else:
+        tracer.finish(span, error=fut.exception())
+
+
+def trace_handler(msg, node, func):
+    """Call the handler `func` for the received `msg`, recording a
+    ``message.dispatch`` span covering the time from the send to the
+    reception and a ``message.handle`` span covering the execution of the
+    handler, also when it is a coroutine.
+    """
+    tracer = _tracer
+    ctx = msg.trace
+    if tracer is None or not isinstance(ctx, dict):
+        return func(node, msg)
+    attrs = {'type': msg.type, 'source': _source_uri(msg),
+             'dest': str(node.node_path), 'handler': func.__qualname__}
+    received = time.time()
+    tracer.finish(tracer.start_span('message.dispatch', ctx.get('trace_id'),
+                                    ctx.get('span_id'), ctx.get('sent'),
+                                    **attrs),
+                  end=received)
+    span = tracer.start_span('message.handle', ctx.get('trace_id'),
+                             ctx.get('span_id'), received, **attrs)
+    try:
+        result = func(node, msg)
+    except Exception as e:
+        tracer.finish(span, error=e)
+        raise
+    if inspect.isawaitable(result):
+        return _finish_when_done(tracer, span, result)
+    tracer.finish(span)
+    return result
+
+
+async def _finish_when_done(tracer, span, awaitable):
+    try:
+        result = await awaitable
+    except Exception as e:
+        tracer.finish(span, error=e)
+        raise
+    tracer.finish(span)
+    return result
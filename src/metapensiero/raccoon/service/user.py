@@ -6,6 +6,8 @@
 # :Copyright: © 2016, 2017, 2018 Alberto Berti
 #
 
+import asyncio
+
 from .node import WAMPNode
 
 
@@ -17,3 +19,76 @@ class User(WAMPNode):
         self.login = login
         self.full_name = full_name
         self.source = source
+
+    def update(self, **fields):
+        """Change some of the attributes of the user and notify the change to
+        the computations depending on this node."""
+        for name, value in fields.items():
+            setattr(self, name, value)
+        if self.node_location is not None:
+            self.node_changed()
+
+
+class Users(WAMPNode):
+    """The container of the shared :class:`User` nodes."""
+
+
+class UserRegistry:
+    """Keep a single :class:`User` node per `user_id`, shared by all the
+    sessions of the user, with a count of the references to it.
+
+    The nodes are bound under `container` when first acquired and unbound
+    when the last session releases them.
+
+    :param container: the :class:`Users` node, already bound
+    """
+
+    def __init__(self, container):
+        self.container = container
+        self._entries = {}
+
+    def __contains__(self, user_id):
+        return user_id in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def refcount(self, user_id):
+        """Return the number of the references to the user `user_id`."""
+        entry = self._entries.get(user_id)
+        return entry[1] if entry is not None else 0
+
+    async def acquire(self, user):
+        """Return the shared node for the same user as `user`, that is bound
+        and used as the shared one if there's none yet."""
+        entry = self._entries.get(user.user_id)
+        if entry is None:
+            ready = asyncio.Future()
+            entry = self._entries[user.user_id] = [user, 0, ready]
+            try:
+                await self.container.node_add(str(user.user_id), user)
+            except Exception as e:
+                del self._entries[user.user_id]
+                ready.set_exception(e)
+                # there may be no other waiter, mark it as retrieved
+                ready.exception()
+                raise
+            ready.set_result(user)
+        entry[1] += 1
+        try:
+            return await asyncio.shield(entry[2])
+        except Exception:
+            entry[1] -= 1
+            raise
+
+    async def release(self, user):
+        """Drop a reference to the shared `user`, unbinding it when it's the
+        last one."""
+        entry = self._entries.get(user.user_id)
+        if entry is None or entry[0] is not user:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self._entries[user.user_id]
+            if user.node_path:
+                await self.container.node_remove(str(user.user_id))
@@ -6,37 +6,103 @@
 # :Copyright: © 2016, 2017, 2018 Alberto Berti
 #
 
+import asyncio
 import logging
+import random
 import signal
+import weakref
 
 from arstecnica.raccoon.autobahn.client import Client
+from autobahn.wamp import serializer
 from metapensiero.signal import Signal, SignalAndHandlerInitMeta
 from metapensiero.raccoon.node import WAMPNodeContext
 
+from ..compression import Compressor
+from ..monitor import LoopMonitor
 from .session import Session
 
 logger = logging.getLogger(__name__)
 
+SERIALIZERS = {
+    'cbor': 'CBORSerializer',
+    'json': 'JsonSerializer',
+    'msgpack': 'MsgPackSerializer',
+    'ubjson': 'UBJSONSerializer',
+}
+"""The names of the supported serializers and of their autobahn classes."""
+
+
+def make_serializers(names):
+    """Return the instances of the serializers in `names`, in order of
+    preference, skipping the ones whose library isn't installed. JSON is
+    always added as the last resort, as every router supports it.
+    """
+    result = []
+    for name in names:
+        if name not in SERIALIZERS:
+            raise ValueError("Unknown serializer {!r}".format(name))
+        cls = getattr(serializer, SERIALIZERS[name], None)
+        if cls is None:
+            logger.warning("The %s serializer is not available", name)
+        else:
+            result.append(cls())
+    if 'json' not in names:
+        result.append(serializer.JsonSerializer())
+    return result
+
 
 class Connection(Client, metaclass=SignalAndHandlerInitMeta):
     "A client connection, enriched with some signals."
 
     on_connect = Signal()
     """Signal emitted when the connection is activated and the session has
-    joined the realm.
+    joined the realm. It's emitted again each time the connection is
+    re-established after a failure.
     """
 
-    def __init__(self, url, realm, loop=None, **kwargs):
+    def __init__(self, url, realm, loop=None, reconnect=True,
+                 reconnect_delay=0.5, reconnect_max_delay=30.0,
+                 serializers=None, compression=None,
+                 compression_threshold=4096, **kwargs):
         """:param str url: a :term:`WAMP` connection url
         :param str realm: a :term:`WAMP` realm to enter
         :param loop: an optional asyncio loop
+        :param bool reconnect: whether to reconnect automatically when the
+          session is lost without calling :meth:`disconnect`
+        :param float reconnect_delay: the delay before the first reconnection
+          attempt. It's doubled on every failed attempt, up to
+          `reconnect_max_delay`, and randomized to avoid all the clients
+          hitting the router at the same time
+        :param serializers: an optional sequence of names of serializers
+          among ``'cbor'``, ``'msgpack'``, ``'ubjson'`` and ``'json'``, in
+          order of preference. The router picks the first one it supports.
+          The unavailable ones are skipped and JSON is always the last
+          resort. By default autobahn offers all the available ones
+        :param compression: the name of a codec to compress the message
+          details and the call results, for the receivers that accept it.
+          The calls made through the connection accept it too, see
+          :mod:`..compression`
+        :param int compression_threshold: the minimum size in bytes of the
+          payloads to compress
 
         Every other keyword argument will be passed to the underlying
         autobahn client.
         """
+        if serializers is not None:
+            kwargs['serializers'] = make_serializers(serializers)
         super().__init__(url, realm, loop=None, **kwargs)
         self.session = None
         self.session_details = None
+        self.loop_monitor = None
+        self.reconnect = reconnect
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self._credentials = None
+        self._closing = False
+        self._reconnecting = None
+        self._contexts = weakref.WeakSet()
+        self.compression = (Compressor(compression, compression_threshold)
+                            if compression is not None else None)
 
     def _notify_disconnect(self):
         """NOTE: This is not a coroutine but returns one."""
@@ -47,20 +113,71 @@ class Connection(Client, metaclass=SignalAndHandlerInitMeta):
             self.session_details = None
 
     async def _on_session_leave(self, details):
+        session = self.session
+        if (self.reconnect and not self._closing and session is not None and
+            self._reconnecting is None):
+            self._reconnecting = self.loop.create_task(
+                self._reconnect(session))
         return self._notify_disconnect()
 
-    async def connect(self, username=None, password=None):
-        "Emits the :attr:`on_connect` signal."
-        session, sess_details = await super().connect(username, password,
-                                                      session_class=Session)
+    async def _reconnect(self, old_session):
+        """Try to establish a new session with exponential backoff, then
+        replay on it the registrations and subscriptions of `old_session`."""
+        attempt = 0
+        try:
+            while not self._closing:
+                delay = min(self.reconnect_max_delay,
+                            self.reconnect_delay * 2 ** attempt)
+                await asyncio.sleep(random.uniform(delay / 2, delay))
+                attempt += 1
+                try:
+                    session, sess_details = await super().connect(
+                        *self._credentials, session_class=Session)
+                except Exception as e:
+                    logger.warning("Reconnection attempt %d failed: %r",
+                                   attempt, e)
+                    continue
+                session.compression = self.compression
+                regs, subs = await session.replay(old_session)
+                logger.info("Reconnected after %d attempts, replayed %d"
+                            " registrations and %d subscriptions",
+                            attempt, regs, subs)
+                for ctx in self._contexts:
+                    if ctx.wamp_session is old_session:
+                        ctx.wamp_session = session
+                await self._attach(session, sess_details)
+                break
+        finally:
+            self._reconnecting = None
+
+    async def _attach(self, session, sess_details):
         self.session = session
         self.session_details = sess_details
+        logger.debug("Session attached using the %s serializer",
+                     self.serializer_id)
         await self.on_connect.notify(session=session,
                                      session_details=sess_details,
                                      loop=self.loop)
         session.on_leave.connect(self._on_session_leave)
+
+    async def connect(self, username=None, password=None):
+        "Emits the :attr:`on_connect` signal."
+        self._closing = False
+        self._credentials = (username, password)
+        session, sess_details = await super().connect(username, password,
+                                                      session_class=Session)
+        session.compression = self.compression
+        await self._attach(session, sess_details)
         return session, sess_details
 
+    @property
+    def serializer_id(self):
+        """The id of the serializer negotiated with the router, like
+        ``'json'`` or ``'msgpack'``, or ``None`` if not connected."""
+        protocol = getattr(self, 'protocol', None)
+        ser = getattr(protocol, '_serializer', None)
+        return ser.SERIALIZER_ID if ser is not None else None
+
     @property
     def connected(self):
         """Returns ``True`` if this connection is attached to a session."""
@@ -68,15 +185,21 @@ class Connection(Client, metaclass=SignalAndHandlerInitMeta):
 
     async def disconnect(self):
         "Emits the :attr:`on_disconnect` signal."
+        self._closing = True
+        if self._reconnecting is not None:
+            self._reconnecting.cancel()
         await self._notify_disconnect()
         await super().disconnect()
 
     def new_context(self):
         """
         Return a new :class:`~metapensiero.raccoon.node.node.WAMPNodeContext`
-        instance tied to this connection.
+        instance tied to this connection. Its session is updated when the
+        connection is re-established.
         """
-        return WAMPNodeContext(loop=self.loop, wamp_session=self.session)
+        ctx = WAMPNodeContext(loop=self.loop, wamp_session=self.session)
+        self._contexts.add(ctx)
+        return ctx
 
     @on_connect.on_connect
     async def on_connect(self, handler, subscribers, connect):
@@ -104,10 +227,21 @@ class Connection(Client, metaclass=SignalAndHandlerInitMeta):
         disconnect(handler)
         return res
 
-    def run(self):
+    def run(self, monitor=True):
         """Adds a ``SIGTERM`` handler and runs the loop until the connection
         ends or the process is killed.
+
+        :param monitor: either a boolean or a
+          :class:`~..monitor.LoopMonitor` instance. When ``True`` (the
+          default) a monitor with default settings is used to measure the
+          loop lag and report stalls.
         """
+        if monitor is True:
+            monitor = LoopMonitor(self.loop)
+        if monitor:
+            self.loop_monitor = monitor
+            monitor.start()
+
         try:
             self.loop.add_signal_handler(signal.SIGTERM, self.loop.stop)
         except NotImplementedError:
@@ -120,6 +254,9 @@ class Connection(Client, metaclass=SignalAndHandlerInitMeta):
             # wait until we send Goodbye if user hit ctrl-c
             # (done outside this except so SIGTERM gets the same handling)
             pass
+        finally:
+            if monitor:
+                monitor.stop()
 
         # give Goodbye message a chance to go through, if we still
         # have an active session
@@ -6,16 +6,199 @@
 # :Copyright: © 2016, 2017, 2018 Alberto Berti
 #
 
+import asyncio
+import inspect
 import logging
 
 from arstecnica.raccoon.autobahn.client import ClientSession
+from autobahn.wamp.exception import ApplicationError
+from autobahn.wamp.request import Registration
+from autobahn.wamp.types import RegisterOptions
 from metapensiero.signal import Signal, SignalAndHandlerInitMeta
 
+from .. import compression
+from . import streaming
+
 logger = logging.getLogger(__name__)
 
 
+def _done(result=None):
+    fut = asyncio.Future()
+    fut.set_result(result)
+    return fut
+
+
+class RegistrationError(Exception):
+    """Raised when some of the registrations issued by a
+    :class:`RegistrationBatch` fail. The failures are in `errors`."""
+
+    def __init__(self, errors):
+        super().__init__("{} registrations failed".format(len(errors)))
+        self.errors = errors
+
+
+class LocalRegistration:
+    """A registration served by a prefix route, without a counterpart on
+    the router. It mimics :class:`~autobahn.wamp.request.Registration`."""
+
+    id = None
+
+    def __init__(self, session, procedure, endpoint):
+        self.session = session
+        self.procedure = procedure
+        self.endpoint = endpoint
+        self.active = True
+
+    def unregister(self):
+        if not self.active:
+            raise Exception("registration no longer active")
+        self.active = False
+        self.session._local_endpoints.pop(self.procedure, None)
+        return _done()
+
+
+class PendingRegistration(Registration):
+    """A registration issued by a :class:`RegistrationBatch`, returned
+    before the router acknowledges it. Its `id` is set on acknowledgement."""
+
+    __slots__ = ('task',)
+
+    def unregister(self):
+        if not self.active:
+            # rolled back or failed
+            return _done()
+        if self.id is None:
+            return asyncio.ensure_future(self._unregister_when_done())
+        return self.session._unregister(self)
+
+    async def _unregister_when_done(self):
+        try:
+            await self.task
+        except Exception:
+            return
+        if self.active:
+            await self.session._unregister(self)
+
+
+class RegistrationBatch:
+    """Asynchronous context manager that issues concurrently, at most
+    `concurrency` at a time, the registrations made within it through the
+    contexts returned by :meth:`bind_context`. The registrations made on
+    the session directly, by any other code, are not affected.
+
+    Each registration immediately returns a :class:`PendingRegistration`,
+    so that the code registering many endpoints in sequence doesn't wait
+    for the router. On exit all of them are awaited: if any fails, or if the
+    body raised an exception, the successful ones are unregistered and
+    :class:`RegistrationError` is raised (in the former case).
+    """
+
+    def __init__(self, session, concurrency=16):
+        self.session = session
+        self.closed = False
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._pending = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.closed = True
+        await self.flush(rollback=exc_type is not None)
+
+    def bind_context(self, context):
+        """Return a child of the node `context` whose WAMP session issues
+        the registrations through this batch while it's open. The nodes to
+        bind in the batch must receive it."""
+        return context.new(wamp_session=BatchedSession(self))
+
+    @staticmethod
+    def release_context(context):
+        """Make the nodes bound with a context returned by
+        :meth:`bind_context` use the session of its parent again."""
+        del context.wamp_session
+
+    def register(self, endpoint, procedure, options=None, **kwargs):
+        reg = PendingRegistration(self.session, None, procedure, None)
+        reg.task = asyncio.ensure_future(
+            self._register(reg, endpoint, procedure, options, kwargs))
+        self._pending.append(reg)
+        return _done(reg)
+
+    async def _register(self, reg, endpoint, procedure, options, kwargs):
+        session = self.session
+        async with self._semaphore:
+            real = await super(Session, session).register(
+                endpoint, procedure, options, **kwargs)
+        reg.id = real.id
+        reg.procedure = real.procedure
+        reg.endpoint = real.endpoint
+        session._registrations[real.id] = reg
+        session._registrations_log[reg] = (endpoint, options)
+        return reg
+
+    async def flush(self, rollback=False):
+        """Wait for all the pending registrations, rolling back all of them
+        if one fails or if `rollback` is ``True``."""
+        pending, self._pending = self._pending, []
+        results = await asyncio.gather(*(reg.task for reg in pending),
+                                       return_exceptions=True)
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors or rollback:
+            done = []
+            for reg, result in zip(pending, results):
+                if isinstance(result, Exception) or not reg.active:
+                    reg.active = False
+                else:
+                    done.append(reg)
+            await asyncio.gather(*(reg.unregister() for reg in done),
+                                 return_exceptions=True)
+            for reg in done:
+                reg.active = False
+            if errors:
+                raise RegistrationError(errors)
+
+
+class BatchedSession:
+    """The WAMP session of the contexts returned by
+    :meth:`RegistrationBatch.bind_context`. It passes the batch to
+    :meth:`Session.register` and behaves like the real session otherwise."""
+
+    def __init__(self, batch):
+        self._batch = batch
+
+    def __getattr__(self, name):
+        return getattr(self._batch.session, name)
+
+    def register(self, endpoint, procedure=None, options=None, **kwargs):
+        return self._batch.session.register(endpoint, procedure, options,
+                                            batch=self._batch, **kwargs)
+
+
 class Session(ClientSession, metaclass=SignalAndHandlerInitMeta):
-    "A client session, enriched with some signals."
+    """A client session, enriched with some signals.
+
+    It also keeps a log of the active registrations and subscriptions, so
+    that they can be replayed on a new session with :meth:`replay` when the
+    connection to the router is re-established.
+
+    With :meth:`add_route` a whole tree of procedures can be served by a
+    single *prefix* registration on the router: the procedures registered
+    under it are kept in a local table and the calls are dispatched from
+    there.
+
+    With :meth:`share_registrations` the procedures under a given path are
+    registered with a router *invocation policy*, so that several workers can
+    register them at the same time.
+
+    The endpoints that are asynchronous generators send their chunks as
+    progressive results, see :mod:`.streaming`.
+
+    When :attr:`compression` is set the calls tell the callee that the
+    compressed results are accepted and the results of the endpoints are
+    compressed for the callers that accept them. The compressed results of
+    the calls are always decompressed, see :mod:`..compression`.
+    """
 
     on_join = Signal()
     "Signal emitted when the session is joined."
@@ -23,6 +206,17 @@ class Session(ClientSession, metaclass=SignalAndHandlerInitMeta):
     on_leave = Signal()
     "Signal emitted when the session is detached."
 
+    compression = None
+    """The :class:`~..compression.Compressor` of the results, if any."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._registrations_log = {}
+        self._subscriptions_log = {}
+        self._routes = {}
+        self._local_endpoints = {}
+        self._shared = {}
+
     def onJoin(self, details):
         "Emit the :attr:`on_join` signal."
         loop = self.config.extra['joined']._loop
@@ -34,3 +228,195 @@ class Session(ClientSession, metaclass=SignalAndHandlerInitMeta):
         loop = self.config.extra['joined']._loop
         self.on_leave.notify(details, loop=loop)
         super().onLeave(details)
+
+    def register(self, endpoint, procedure=None, options=None, batch=None,
+                 **kwargs):
+        """Register `endpoint`, through the :class:`RegistrationBatch`
+        `batch` if it's given and still open."""
+        if callable(endpoint) and kwargs.get('prefix'):
+            procedure = kwargs.pop('prefix') + procedure
+        if callable(endpoint) and streaming.is_streaming(endpoint):
+            endpoint = streaming.streamed(endpoint, options, self)
+        if callable(endpoint):
+            endpoint = compression.wrap(endpoint, self.compression)
+        if callable(endpoint) and self._shared:
+            options = self._shared_options(procedure, options)
+        if callable(endpoint) and self._routes:
+            if self._route_for(procedure) is not None:
+                return self._register_local(endpoint, procedure, options)
+        if callable(endpoint) and batch is not None and not batch.closed:
+            return batch.register(endpoint, procedure, options, **kwargs)
+        result = super().register(endpoint, procedure, options, **kwargs)
+        if callable(endpoint):
+            result = asyncio.ensure_future(result)
+            result.add_done_callback(
+                lambda f: self._log_registration(f, endpoint, options))
+        return result
+
+    async def call(self, procedure, *args, **kwargs):
+        if self.compression is not None and not procedure.startswith('wamp.'):
+            # the router's meta procedures don't know about it
+            kwargs[compression.ACCEPT_KWARG] = compression.codec_names()
+        result = await super().call(procedure, *args, **kwargs)
+        return compression.decode(result)
+
+    def _log_registration(self, fut, endpoint, options):
+        if not fut.cancelled() and fut.exception() is None:
+            self._registrations_log[fut.result()] = (endpoint, options)
+
+    def _unregister(self, registration):
+        self._registrations_log.pop(registration, None)
+        return super()._unregister(registration)
+
+    def subscribe(self, handler, topic=None, options=None, **kwargs):
+        result = super().subscribe(handler, topic, options, **kwargs)
+        if callable(handler):
+            result = asyncio.ensure_future(result)
+            result.add_done_callback(
+                lambda f: self._log_subscription(f, handler, options))
+        return result
+
+    def _log_subscription(self, fut, handler, options):
+        if not fut.cancelled() and fut.exception() is None:
+            self._subscriptions_log[fut.result()] = (handler, options)
+
+    def _unsubscribe(self, subscription):
+        self._subscriptions_log.pop(subscription, None)
+        return super()._unsubscribe(subscription)
+
+    def share_registrations(self, path, invoke='roundrobin', owned=()):
+        """Register every procedure under `path`, and `path` itself, with the
+        `invoke` policy, unless a different one is given explicitly.
+
+        :param str path: the base of the shared procedures
+        :param str invoke: the router invocation policy
+        :param owned: prefixes of the procedures under `path` that belong to
+          this session only and must be registered without policy
+        """
+        self._shared[path] = (invoke, tuple(owned))
+
+    def unshare_registrations(self, path):
+        """Stop applying the policy set with :meth:`share_registrations` to
+        the new registrations under `path`."""
+        self._shared.pop(path, None)
+
+    def _shared_options(self, procedure, options):
+        for path, (invoke, owned) in self._shared.items():
+            if ((procedure == path or procedure.startswith(path + '.')) and
+                not any(procedure.startswith(p) for p in owned)):
+                break
+        else:
+            return options
+        if options is None:
+            return RegisterOptions(invoke=invoke)
+        if options.invoke is not None:
+            return options
+        return RegisterOptions(match=options.match, invoke=invoke,
+                               concurrency=options.concurrency,
+                               details_arg=options.details_arg,
+                               force_reregister=options.force_reregister)
+
+    def _route_for(self, procedure):
+        for prefix in self._routes:
+            if procedure.startswith(prefix):
+                return prefix
+
+    def _register_local(self, endpoint, procedure, options):
+        if procedure in self._local_endpoints:
+            raise ApplicationError(ApplicationError.PROCEDURE_ALREADY_EXISTS,
+                                   procedure)
+        self._local_endpoints[procedure] = (endpoint, options)
+        return _done(LocalRegistration(self, procedure, endpoint))
+
+    async def _dispatch_local(self, *args, details=None, **kwargs):
+        entry = self._local_endpoints.get(details.procedure)
+        if entry is None:
+            raise ApplicationError(ApplicationError.NO_SUCH_PROCEDURE,
+                                   details.procedure)
+        endpoint, options = entry
+        if options is not None and options.details_arg:
+            kwargs[options.details_arg] = details
+        result = endpoint(*args, **kwargs)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    def bulk_registrations(self, concurrency=16):
+        """Return a :class:`RegistrationBatch` to be used as an asynchronous
+        context manager."""
+        return RegistrationBatch(self, concurrency)
+
+    async def add_route(self, path):
+        """Serve all the procedures that will be registered under `path` with
+        a single prefix registration. If `path` is already covered by another
+        route, nothing is registered on the router.
+        """
+        prefix = path + '.'
+        assert prefix not in self._routes, "Route exists already"
+        if self._route_for(prefix) is None:
+            reg = await self.register(
+                self._dispatch_local, prefix,
+                RegisterOptions(match='prefix', details_arg='details'))
+        else:
+            reg = None
+        self._routes[prefix] = reg
+
+    async def remove_route(self, path):
+        """Remove the route for `path` previously added with
+        :meth:`add_route`."""
+        reg = self._routes.pop(path + '.')
+        if reg is not None and reg.active and reg.session.is_attached():
+            await reg.unregister()
+
+    async def replay(self, old_session):
+        """Re-issue on this session all the registrations and subscriptions
+        still active on `old_session`, concurrently.
+
+        The :class:`~autobahn.wamp.request.Registration` and
+        :class:`~autobahn.wamp.request.Subscription` objects held by the nodes
+        are moved to this session, so that they can be unregistered as
+        usual.
+
+        :returns: a tuple with the number of replayed registrations and
+          subscriptions
+        """
+        # the local tables are shared, so that the LocalRegistration objects
+        # bound to the old session keep working
+        self._routes = old_session._routes
+        self._local_endpoints = old_session._local_endpoints
+        self._shared = old_session._shared
+        regs = list(old_session._registrations_log.items())
+        subs = list(old_session._subscriptions_log.items())
+        old_session._registrations_log.clear()
+        old_session._subscriptions_log.clear()
+        results = await asyncio.gather(
+            *([self._replay_registration(reg, endpoint, options)
+               for reg, (endpoint, options) in regs] +
+              [self._replay_subscription(sub, handler, options)
+               for sub, (handler, options) in subs]),
+            return_exceptions=True)
+        failed = [r for r in results if isinstance(r, Exception)]
+        for error in failed:
+            logger.error("Error while replaying on the new session: %r",
+                         error)
+        return (sum(1 for r in results[:len(regs)] if r is True),
+                sum(1 for r in results[len(regs):] if r is True))
+
+    async def _replay_registration(self, reg, endpoint, options):
+        new = await super().register(endpoint, reg.procedure, options)
+        reg.id = new.id
+        reg.session = self
+        reg.active = True
+        self._registrations[new.id] = reg
+        self._registrations_log[reg] = (endpoint, options)
+        return True
+
+    async def _replay_subscription(self, sub, handler, options):
+        new = await super().subscribe(handler, sub.topic, options)
+        handlers = self._subscriptions[new.id]
+        handlers[handlers.index(new)] = sub
+        sub.id = new.id
+        sub.session = self
+        sub.active = True
+        self._subscriptions_log[sub] = (handler, options)
+        return True
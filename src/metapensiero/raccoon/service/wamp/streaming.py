@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+# :Project:   metapensiero.raccoon.service -- progressive call results
+# :Created:   mar 20 ott 2026 21:02:38 CEST
+# :Author:    Alberto Berti <alberto@metapensiero.it>
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2026 Alberto Berti
+#
+
+"""Stream the results of a call as WAMP progressive results.
+
+An endpoint written as an asynchronous generator is wrapped at registration
+time by :class:`~.session.Session`, so that each yielded chunk is sent to
+the caller as soon as it's produced, without collecting the whole result::
+
+  class Sessions(WAMPNode):
+
+      @call
+      async def listing(self, details):
+          for session in self.sessions:
+              yield session.info()
+
+The caller iterates over the chunks with :func:`stream`::
+
+  async for info in stream(node.remote('@server'), 'listing'):
+      ...
+
+A caller that doesn't ask for progressive results receives the list of all
+the chunks as the result of the call.
+
+WAMP has no flow control for progressive results: the endpoint yields to the
+loop after each chunk and is paused while the write buffer of the session's
+transport is above its high-water mark, so a fast generator cannot pile up
+its chunks in memory. On the receiving side the chunks are queued without a
+bound until the caller consumes them, because the progress callback cannot
+make the router wait.
+"""
+
+import asyncio
+import inspect
+
+from autobahn.wamp.types import CallOptions
+
+from .. import metrics
+
+_chunks = metrics.counter('wamp.stream.chunks',
+                          'Chunks sent as progressive results')
+
+
+def is_streaming(endpoint):
+    """Tell if `endpoint` is an asynchronous generator function."""
+    isasyncgenfunction = getattr(inspect, 'isasyncgenfunction', None)
+    if isasyncgenfunction is None:
+        return False
+    return isasyncgenfunction(inspect.unwrap(endpoint))
+
+
+DRAIN_INTERVAL = 0.01
+"""Seconds between the checks of a full write buffer."""
+
+
+def _write_transport(session):
+    # the session's transport is the autobahn protocol, the asyncio one is
+    # its transport
+    protocol = getattr(session, '_transport', None)
+    transport = getattr(protocol, 'transport', None)
+    if not hasattr(transport, 'get_write_buffer_size'):
+        return None
+    return transport
+
+
+async def drain(session):
+    """Yield to the loop and wait until the write buffer of the transport of
+    `session` is below its high-water mark."""
+    await asyncio.sleep(0)
+    transport = _write_transport(session)
+    if transport is None:
+        return
+    high = transport.get_write_buffer_limits()[1]
+    while (not transport.is_closing() and
+           transport.get_write_buffer_size() > high):
+        await asyncio.sleep(DRAIN_INTERVAL)
+
+
+def streamed(endpoint, options, session=None):
+    """Wrap the asynchronous generator function `endpoint`, sending the
+    chunks it yields through the ``progress`` of the call details, if the
+    caller asked for them. After each chunk the endpoint waits for the
+    transport of `session` to :func:`drain`."""
+    details_arg = options.details_arg if options is not None else None
+
+    async def streamed_endpoint(*args, **kwargs):
+        details = kwargs.get(details_arg) if details_arg else None
+        progress = getattr(details, 'progress', None)
+        chunks = None if progress is not None else []
+        async for chunk in endpoint(*args, **kwargs):
+            if chunks is None:
+                progress(chunk)
+                _chunks.inc()
+                await drain(session)
+            else:
+                chunks.append(chunk)
+        return chunks
+
+    return streamed_endpoint
+
+
+_END = object()
+
+
+class RemoteStream:
+    """An asynchronous iterator over the progressive results of a call.
+
+    The chunks are queued as they arrive, without a limit: a consumer slower
+    than the endpoint keeps them all in memory. A final result other than
+    ``None`` is returned as the last chunk, so that endpoints that don't
+    stream can be iterated too.
+
+    :param session: the WAMP session
+    :param str procedure: the procedure to call
+    """
+
+    def __init__(self, session, procedure, *args, **kwargs):
+        self.session = session
+        self.procedure = procedure
+        self._args = args
+        self._kwargs = kwargs
+        self._queue = asyncio.Queue()
+        self._call = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._call is None:
+            self._start()
+        chunk = await self._queue.get()
+        if chunk is _END:
+            # keep raising on further iterations
+            self._queue.put_nowait(_END)
+            exc = self._call.exception()
+            if exc is not None:
+                raise exc
+            raise StopAsyncIteration
+        return chunk
+
+    def _start(self):
+        options = CallOptions(on_progress=self._on_progress)
+        self._call = asyncio.ensure_future(self.session.call(
+            self.procedure, *self._args, options=options, **self._kwargs))
+        self._call.add_done_callback(self._on_done)
+
+    def _on_progress(self, chunk):
+        self._queue.put_nowait(chunk)
+
+    def _on_done(self, fut):
+        if not fut.cancelled() and fut.exception() is None:
+            result = fut.result()
+            if result is not None:
+                self._queue.put_nowait(result)
+        self._queue.put_nowait(_END)
+
+    def cancel(self):
+        """Stop waiting for the call."""
+        if self._call is not None and not self._call.done():
+            self._call.cancel()
+
+
+def stream(proxy, method, *args, **kwargs):
+    """Return a :class:`RemoteStream` over the results of calling `method`
+    on the remote node reached by `proxy`."""
+    context = getattr(proxy, 'node_context', None)
+    session = context.get('wamp_session') if context is not None else None
+    if session is None:
+        raise ValueError("Cannot call {!r}, it has no WAMP"
+                         " session".format(proxy))
+    return RemoteStream(session, '{}.{}'.format(proxy.node_path, method),
+                        *args, **kwargs)